@@ -0,0 +1,444 @@
+"""
+In-process approximate nearest neighbour index over memory-mapped embeddings.
+
+An inverted-file (IVF) index: every document is assigned to the nearest of nlist
+k-means centroids, and a search only scores the documents in the nprobe lists closest
+to the query. Vectors, inverted lists and documents are stored in flat files in one
+directory. Readers open them with np.memmap / mmap, so opening is instant and all
+worker processes share the same pages of the OS page cache instead of each holding a
+copy. New documents are appended as a segment of inverted lists of their own, without
+retraining the centroids:
+
+    python ann_index.py build kb_index docs.jsonl
+    python ann_index.py add kb_index new_docs.jsonl
+    python ann_index.py search kb_index "Singly Linked List"
+
+docs.jsonl holds one {"text": ..., "metadata": {...}} object per line. Any number of
+processes may search an index, but only one may add to it at a time.
+
+Indexes are built with the local hashed embedding unless --embedding names a function
+("module:function") embedding a list of texts as a matrix; the name is stored in the
+index, which imports the function again when it is opened.
+"""
+from typing import Callable, Optional
+import argparse
+import importlib
+import json
+import math
+import mmap
+import os
+import sys
+import threading
+import numpy as np
+from nlp import embed_text
+
+
+MANIFEST = "index.json"
+CENTROIDS = "centroids.npy"
+VECTORS = "vectors.f32"
+# Document ids of every segment, grouped by list, and where each list starts in them
+LIST_IDS = "list_ids.i32"
+LIST_OFFSETS = "list_offsets.i64"
+OFFSETS = "offsets.i64"
+DOCS = "docs.jsonl"
+
+# Name stored in the manifest for indexes built with nlp.embed_text
+HASHED_EMBEDDING = "hashed"
+
+
+def hashed_embeddings(texts: list[str], dimensions: int = 256) -> np.ndarray:
+    """Embed texts with nlp.embed_text as a (len(texts), dimensions) float32 matrix."""
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for i, text in enumerate(texts):
+        vectors[i] = embed_text(text, dimensions)
+    return vectors
+
+
+def load_embedding(name: str) -> Callable[[list[str]], np.ndarray]:
+    """Import an embedding function from its "module:function" name."""
+    module, _, function = name.partition(":")
+    if not module or not function:
+        raise ValueError(f"Embedding '{name}' is not of the form 'module:function'")
+    return getattr(importlib.import_module(module), function)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of a matrix, leaving all-zero rows as they are."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Index of the most similar centroid for every vector, computed in chunks."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        labels[start : start + chunk_size] = np.argmax(vectors[start : start + chunk_size] @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(
+    vectors: np.ndarray, nlist: int, iterations: int = 10, sample_size: int = 256, seed: int = 0
+) -> np.ndarray:
+    """
+    Train IVF centroids with spherical k-means.
+
+    Args:
+        vectors: Unit-length document vectors
+        nlist: Number of lists (clamped to the number of vectors)
+        iterations: Number of k-means iterations
+        sample_size: Vectors per list used for training; larger inputs are subsampled
+        seed: Seed of the initial centroid and training sample draws
+
+    Returns:
+        np.ndarray: Unit-length centroids of shape (nlist, dimensions)
+    """
+    rng = np.random.default_rng(seed)
+    nlist = max(1, min(nlist, len(vectors)))
+    if len(vectors) > nlist * sample_size:
+        vectors = vectors[np.sort(rng.choice(len(vectors), nlist * sample_size, replace=False))]
+    centroids = np.array(vectors[rng.choice(len(vectors), nlist, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        labels = _nearest(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=nlist)
+        # Lists that lost all their vectors keep their previous centroid
+        centroids = np.where(counts[:, None] > 0, _normalize(sums), centroids)
+    return centroids
+
+
+def _write_at(path: str, offset: int, data: bytes) -> None:
+    """Write data at offset, dropping anything after it (e.g. left over from an interrupted add)."""
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+
+
+class ANNIndex:
+    """
+    IVF index opened from a directory written by ANNIndex.build.
+
+    Searches map the files read-only, up to the document count recorded in the
+    manifest. add appends the new documents first and then atomically replaces the
+    manifest, so readers never see a partially written document; they pick up the new
+    count on their next search.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embed: Optional[Callable[[list[str]], np.ndarray]] = None,
+        nprobe: int = 8,
+        top_k: int = 5,
+    ):
+        """
+        Args:
+            path: Index directory
+            embed: Function embedding a list of texts as a matrix; it must be the function used
+                to build the index (default: the embedding named in the index's manifest)
+            nprobe: Lists searched per query
+            top_k: Default number of results per query
+        """
+        self.path = path
+        self.nprobe = nprobe
+        self.top_k = top_k
+        self.manifest: dict = {}
+        self._embed = embed
+        self._state: tuple = (0, None, None, None, None, None, None)
+        self._manifest_stat: Optional[tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.refresh()
+        if embed is None:
+            embedding, dimensions = self.manifest["embedding"], self.manifest["dimensions"]
+            if embedding == HASHED_EMBEDDING:
+                self._embed = lambda texts: hashed_embeddings(texts, dimensions)
+            else:
+                try:
+                    self._embed = load_embedding(embedding)
+                except (ImportError, AttributeError, ValueError) as e:
+                    raise ValueError(
+                        f"Index at {path} was built with the '{embedding}' embedding; pass its embed function"
+                    ) from e
+
+    @property
+    def count(self) -> int:
+        """Number of documents visible to searches."""
+        return self._state[0]
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def refresh(self) -> bool:
+        """
+        Re-map the index files if documents were added since they were last mapped.
+
+        Returns:
+            bool: Whether the index changed
+        """
+        stat = os.stat(self._file(MANIFEST))
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key == self._manifest_stat:
+            return False
+        with self._lock:
+            if key == self._manifest_stat:
+                return False
+            with open(self._file(MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+            count, dimensions = manifest["count"], manifest["dimensions"]
+            centroids = np.load(self._file(CENTROIDS), mmap_mode="r")
+            vectors = list_ids = list_offsets = offsets = docs = None
+            if count:
+                vectors = np.memmap(self._file(VECTORS), dtype=np.float32, mode="r", shape=(count, dimensions))
+                list_ids = np.memmap(self._file(LIST_IDS), dtype=np.int32, mode="r", shape=(count,))
+                list_offsets = np.memmap(
+                    self._file(LIST_OFFSETS),
+                    dtype=np.int64,
+                    mode="r",
+                    shape=(manifest["segments"], manifest["nlist"] + 1),
+                )
+                offsets = np.memmap(self._file(OFFSETS), dtype=np.int64, mode="r", shape=(count,))
+                with open(self._file(DOCS), "rb") as f:
+                    docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Searches in flight keep using the previous mappings until they finish
+            self._state = (count, centroids, vectors, list_ids, list_offsets, offsets, docs)
+            self.manifest = manifest
+            self._manifest_stat = key
+            return True
+
+    def search(self, query: str, top_k: Optional[int] = None) -> list[tuple[str, dict]]:
+        """
+        Find the documents most similar to a query.
+
+        Args:
+            query: The context query to search for
+            top_k: Number of results (default: the index's top_k)
+
+        Returns:
+            list[tuple[str, dict]]: (text, metadata) tuples, most similar first
+        """
+        return self.search_batch([query], top_k)[0]
+
+    def search_batch(self, queries: list[str], top_k: Optional[int] = None) -> list[list[tuple[str, dict]]]:
+        """
+        Find the documents most similar to each of several queries.
+
+        All queries are embedded in one call and matched against the centroids with one
+        matrix product. Only the documents of each query's probed lists are read and scored,
+        one slice of the inverted lists per list and segment.
+
+        Args:
+            queries: The context queries to search for
+            top_k: Number of results per query (default: the index's top_k)
+
+        Returns:
+            list: Per query, (text, metadata) tuples, most similar first
+        """
+        self.refresh()
+        count, centroids, vectors, list_ids, list_offsets, offsets, docs = self._state
+        if not count or not queries:
+            return [[] for _ in queries]
+        top_k = top_k or self.top_k
+
+        query_vectors = _normalize(self._embed(list(queries)))
+        nprobe = max(1, min(self.nprobe, len(centroids)))
+        probes = np.argpartition(-(query_vectors @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query_vector, probe in zip(query_vectors, probes):
+            candidates = np.concatenate(
+                [list_ids[starts[l] : starts[l + 1]] for starts in list_offsets for l in probe]
+            )
+            if not len(candidates):
+                results.append([])
+                continue
+            scores = vectors[candidates] @ query_vector
+            k = min(top_k, len(candidates))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best], kind="stable")]
+            results.append([self._document(docs, offsets, int(i)) for i in candidates[best]])
+        return results
+
+    @staticmethod
+    def _document(docs: mmap.mmap, offsets: np.ndarray, i: int) -> tuple[str, dict]:
+        start = int(offsets[i])
+        end = docs.find(b"\n", start)
+        record = json.loads(docs[start : end if end >= 0 else len(docs)])
+        return record["text"], record["metadata"]
+
+    def add(self, texts: list[str], metadatas: list[dict]) -> int:
+        """
+        Append documents to the index, assigning them to the existing lists.
+
+        The documents form a new segment of inverted lists and the centroids are not
+        retrained; rebuild the index once the added material makes up a large share of
+        it, or after many small adds (every search reads each segment's lists).
+
+        Args:
+            texts: Document texts
+            metadatas: Metadata dictionary of each document
+
+        Returns:
+            int: Number of documents in the index afterwards
+        """
+        if len(texts) != len(metadatas):
+            raise ValueError(f"Got {len(texts)} texts but {len(metadatas)} metadata dictionaries")
+        with self._write_lock:
+            with open(self._file(MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if texts:
+                vectors = _normalize(self._embed(list(texts)))
+                centroids = np.load(self._file(CENTROIDS))
+                _append(self.path, manifest, vectors, _nearest(vectors, centroids), texts, metadatas)
+        self.refresh()
+        return self.count
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        texts: list[str],
+        metadatas: list[dict],
+        nlist: Optional[int] = None,
+        embed: Optional[Callable[[list[str]], np.ndarray]] = None,
+        embedding: str = HASHED_EMBEDDING,
+        dimensions: int = 256,
+        **kwargs,
+    ) -> "ANNIndex":
+        """
+        Train the centroids on a set of documents and write a new index.
+
+        Build into a new directory and point ANN_INDEX_PATH at it; overwriting an index
+        that other processes have mapped is not supported.
+
+        Args:
+            path: New index directory
+            texts: Document texts
+            metadatas: Metadata dictionary of each document
+            nlist: Number of IVF lists (default: about the square root of the document count)
+            embed: Function embedding a list of texts as a matrix (default: imported from embedding)
+            embedding: Name of the embedding, stored in the manifest: "module:function" for the
+                index to import it when opened, or "hashed" for the local hashed embedding
+            dimensions: Size of the hashed embedding when embed is not given
+            **kwargs: Passed to ANNIndex
+
+        Returns:
+            ANNIndex: The new index, opened for searching
+        """
+        if not texts:
+            raise ValueError("Cannot build an index without documents")
+        if len(texts) != len(metadatas):
+            raise ValueError(f"Got {len(texts)} texts but {len(metadatas)} metadata dictionaries")
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            raise FileExistsError(f"An index already exists at {path}")
+        if embed is None and embedding == HASHED_EMBEDDING:
+            embed = lambda batch: hashed_embeddings(batch, dimensions)
+        elif embed is None:
+            embed = load_embedding(embedding)
+
+        vectors = _normalize(embed(list(texts)))
+        centroids = train_centroids(vectors, nlist or round(math.sqrt(len(texts))))
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, CENTROIDS), centroids)
+        manifest = {
+            "embedding": embedding,
+            "dimensions": int(vectors.shape[1]),
+            "nlist": len(centroids),
+            "count": 0,
+            "segments": 0,
+            "docs_bytes": 0,
+        }
+        _append(path, manifest, vectors, _nearest(vectors, centroids), texts, metadatas)
+        return cls(path, None if embedding == HASHED_EMBEDDING else embed, **kwargs)
+
+
+def _append(
+    path: str, manifest: dict, vectors: np.ndarray, labels: np.ndarray, texts: list[str], metadatas: list[dict]
+) -> None:
+    """Write documents and their segment of inverted lists after the ones in manifest, then publish it."""
+    count, docs_bytes, segments, nlist = manifest["count"], manifest["docs_bytes"], manifest["segments"], manifest["nlist"]
+    lines = [
+        (json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False) + "\n").encode("utf-8")
+        for text, metadata in zip(texts, metadatas)
+    ]
+    offsets = docs_bytes + np.concatenate(([0], np.cumsum([len(line) for line in lines])[:-1])).astype(np.int64)
+
+    _write_at(os.path.join(path, DOCS), docs_bytes, b"".join(lines))
+    _write_at(os.path.join(path, OFFSETS), count * 8, offsets.tobytes())
+    # Ids of the new documents grouped by list; the segment's list offsets index into all ids
+    list_ids = (count + np.argsort(labels, kind="stable")).astype(np.int32)
+    list_offsets = count + np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist)))).astype(np.int64)
+    _write_at(os.path.join(path, LIST_IDS), count * 4, list_ids.tobytes())
+    _write_at(os.path.join(path, LIST_OFFSETS), segments * (nlist + 1) * 8, list_offsets.tobytes())
+    _write_at(os.path.join(path, VECTORS), count * vectors.shape[1] * 4, vectors.astype(np.float32).tobytes())
+
+    manifest = dict(
+        manifest,
+        count=count + len(lines),
+        docs_bytes=docs_bytes + sum(len(line) for line in lines),
+        segments=segments + 1,
+    )
+    temporary = os.path.join(path, MANIFEST + ".tmp")
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temporary, os.path.join(path, MANIFEST))
+
+
+def load_documents(path: str) -> tuple[list[str], list[dict]]:
+    """Read a JSONL file of {"text": ..., "metadata": {...}} objects into texts and metadata."""
+    texts, metadatas = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(record["text"])
+                metadatas.append(record.get("metadata", {}))
+    return texts, metadatas
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build, extend and query an in-process ANN index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a new index from a JSONL file of documents")
+    build.add_argument("path", help="New index directory")
+    build.add_argument("docs", help="JSONL file with one {\"text\", \"metadata\"} object per line")
+    build.add_argument("--nlist", type=int, help="Number of IVF lists (default: sqrt of the document count)")
+    build.add_argument("--dimensions", type=int, default=256, help="Hashed embedding size (default: 256)")
+    build.add_argument(
+        "--embedding", default=HASHED_EMBEDDING, help="Embedding function as module:function (default: hashed)"
+    )
+    add = commands.add_parser("add", help="Append documents to an existing index")
+    add.add_argument("path", help="Index directory")
+    add.add_argument("docs", help="JSONL file with one {\"text\", \"metadata\"} object per line")
+    search = commands.add_parser("search", help="Print the documents closest to a query")
+    search.add_argument("path", help="Index directory")
+    search.add_argument("query", help="Context query")
+    search.add_argument("--top-k", type=int, default=5, help="Number of results (default: 5)")
+    search.add_argument("--nprobe", type=int, default=8, help="Lists searched (default: 8)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = ANNIndex.build(
+            args.path,
+            *load_documents(args.docs),
+            nlist=args.nlist,
+            embedding=args.embedding,
+            dimensions=args.dimensions,
+        )
+        print(f"Built {args.path}: {index.count} documents in {index.manifest['nlist']} lists")
+    elif args.command == "add":
+        index = ANNIndex(args.path)
+        before = index.count
+        index.add(*load_documents(args.docs))
+        print(f"Added {index.count - before} documents to {args.path}: {index.count} in total")
+    else:
+        index = ANNIndex(args.path, nprobe=args.nprobe, top_k=args.top_k)
+        for text, metadata in index.search(args.query):
+            print(json.dumps(metadata, ensure_ascii=False), text[:200].replace("\n", " "))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+from utils import clean_response, run_sync, log_info, log_success, log_warning, log_error
+from config import (
+    BATCH_CONCURRENCY,
+    BATCH_PACK_SIZE,
+    BATCH_USE_PROVIDER_BATCH,
+    CACHEABLE_INTENTS,
+    FAST_INTENT_ENABLED,
+    FAST_INTENT_MODES,
+    FAST_INTENT_THRESHOLD,
+    INTENT_LOG_PATH,
+    INTENT_MODEL_PATH,
+    RESPONSE_CACHE_ENABLED,
+    SUMMARIZE_CONTEXT,
+)
+from intent_classifier import get_classifier, log_classification
+from metrics import increment
+from models import BatchResult, ContextQueries, Intent, PackedContextQueriesList, PackedIntents
+from prompts import (
+    context_queries_messages,
+    intent_messages,
+    packed_context_queries_messages,
+    packed_intent_messages,
+    record_prompt_usage,
+)
+from tracing import span
+import pipeline
+
+
+async def _run_packed_stage(
+    stage: str,
+    items: list[tuple],
+    single: Callable[..., Awaitable[Any]],
+    single_messages: Callable[..., list[dict]],
+    result_model: type,
+    packed_messages: Callable[[list[tuple]], list[dict]],
+    packed_model: type,
+    pack_size: int,
+    concurrency: int,
+    use_provider_batch: bool,
+) -> list[Any]:
+    """
+    Run one cheap LLM stage for many items with as few calls as possible.
+
+    If the client offers a provider batch endpoint (``batch_chat``, taking a list of
+    message lists and returning a list of responses) every item is sent through it with
+    its usual single-item prompt. Otherwise items are packed pack_size at a time into one
+    prompt whose JSON output holds a result per item id. Items the batch or pack does not
+    answer usably fall back to the single-item stage function, one by one.
+
+    Args:
+        stage: Stage name used for token usage and metrics, e.g. "intent"
+        items: Argument tuples of the single-item stage, one per item
+        single: Single-item stage coroutine function, used as the fallback
+        single_messages: Builds the single-item prompt from an item's arguments
+        result_model: Model of a single-item result
+        packed_messages: Builds a packed prompt from a list of items
+        packed_model: Model of a packed response, with a "results" list of id-tagged results
+        pack_size: Maximum number of items per packed prompt
+        concurrency: Maximum number of packed calls in flight
+        use_provider_batch: Whether to use the client's batch endpoint when it has one
+
+    Returns:
+        list[Any]: A result_model instance or the exception raised for each item, in order
+    """
+    results: list[Any] = [None] * len(items)
+    pending: list[int] = []
+
+    batch_chat = getattr(pipeline.llm_client, "batch_chat", None) if use_provider_batch else None
+    if batch_chat is not None:
+        try:
+            responses = await asyncio.to_thread(batch_chat, [single_messages(*item) for item in items])
+        except Exception as e:
+            log_warning(f"Provider batch for {stage} failed, falling back to single calls", str(e))
+            responses = [e] * len(items)
+        increment(f"batch_provider_calls_{stage}")
+        for i, response in enumerate(responses):
+            try:
+                if isinstance(response, BaseException):
+                    raise response
+                record_prompt_usage(stage, response)
+                results[i] = clean_response(response, result_model)
+            except Exception:
+                pending.append(i)
+    else:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        packs = [list(range(start, min(start + pack_size, len(items)))) for start in range(0, len(items), max(1, pack_size))]
+
+        async def run_pack(pack: list[int]) -> None:
+            if len(pack) == 1:
+                pending.extend(pack)
+                return
+            messages = packed_messages([items[i] for i in pack])
+
+            async def call_llm():
+                return clean_response(await pipeline.chat_async(messages, f"{stage}_batch", packed_model), packed_model)
+
+            async with semaphore:
+                try:
+                    packed = await pipeline.retry_policy.acall(call_llm, endpoint="llm")
+                except Exception as e:
+                    log_warning(f"Packed {stage} call failed, falling back to single calls", str(e))
+                    pending.extend(pack)
+                    return
+            increment(f"batch_packed_calls_{stage}")
+            by_id = {entry.id: entry for entry in packed.results}
+            for number, i in enumerate(pack, 1):
+                entry = by_id.get(number)
+                if entry is None:
+                    pending.append(i)
+                else:
+                    results[i] = result_model(**entry.model_dump(exclude={"id"}))
+
+        await asyncio.gather(*(run_pack(pack) for pack in packs))
+
+    if pending:
+        increment(f"batch_fallbacks_{stage}", len(pending))
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run_single(i: int) -> None:
+            async with semaphore:
+                try:
+                    results[i] = await single(*items[i])
+                except Exception as e:
+                    results[i] = e
+
+        await asyncio.gather(*(run_single(i) for i in pending))
+    return results
+
+
+async def get_intents_batch_async(
+    items: list[tuple[str, list[dict]]],
+    pack_size: int = BATCH_PACK_SIZE,
+    concurrency: int = BATCH_CONCURRENCY,
+    use_provider_batch: bool = BATCH_USE_PROVIDER_BATCH,
+    use_fast_path: bool = FAST_INTENT_ENABLED,
+) -> list[Any]:
+    """
+    Classify the intent of many (query, chat history) items.
+
+    Items the local fast-path classifier is confident about skip the LLM, as in
+    get_intent_async; the rest go through _run_packed_stage.
+
+    Returns:
+        list[Any]: An Intent or the exception raised for each item, in order
+    """
+    results: list[Any] = [None] * len(items)
+    remaining = []
+    for i, (query, _) in enumerate(items):
+        if use_fast_path:
+            fast_intent, confidence = get_classifier(INTENT_MODEL_PATH).predict(query)
+            if fast_intent in FAST_INTENT_MODES and confidence >= FAST_INTENT_THRESHOLD:
+                increment("intent_fast_path_hits")
+                results[i] = Intent(intent=fast_intent)
+                continue
+            increment("intent_fast_path_misses")
+        remaining.append(i)
+
+    # Intents from the per-item fallback, which get_intent_async has already logged
+    logged: set[int] = set()
+
+    async def classify_single(query: str, chat_history: list[dict]) -> Intent:
+        intent = await pipeline.get_intent_async(query, chat_history, use_fast_path=False)
+        logged.add(id(intent))
+        return intent
+
+    with span("batch_intent", items=len(items), llm_items=len(remaining)):
+        classified = await _run_packed_stage(
+            "intent",
+            [items[i] for i in remaining],
+            classify_single,
+            intent_messages,
+            Intent,
+            packed_intent_messages,
+            PackedIntents,
+            pack_size,
+            concurrency,
+            use_provider_batch,
+        )
+    for i, intent in zip(remaining, classified):
+        results[i] = intent
+        if INTENT_LOG_PATH and isinstance(intent, Intent) and id(intent) not in logged:
+            log_classification(INTENT_LOG_PATH, items[i][0], intent.intent, intent.topic)
+    return results
+
+
+async def get_context_queries_batch_async(
+    items: list[tuple[str, list[dict], str]],
+    pack_size: int = BATCH_PACK_SIZE,
+    concurrency: int = BATCH_CONCURRENCY,
+    use_provider_batch: bool = BATCH_USE_PROVIDER_BATCH,
+) -> list[Any]:
+    """
+    Generate context queries for many (query, chat history, topic) items.
+
+    Returns:
+        list[Any]: A ContextQueries or the exception raised for each item, in order
+    """
+    with span("batch_context_queries", items=len(items)):
+        return await _run_packed_stage(
+            "context_queries",
+            items,
+            pipeline.get_context_queries_async,
+            context_queries_messages,
+            ContextQueries,
+            packed_context_queries_messages,
+            PackedContextQueriesList,
+            pack_size,
+            concurrency,
+            use_provider_batch,
+        )
+
+
+async def run_pipeline_batch_async(
+    items: list[tuple[str, list[dict]]],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    use_cache: bool = RESPONSE_CACHE_ENABLED,
+    pack_size: int = BATCH_PACK_SIZE,
+    concurrency: int = BATCH_CONCURRENCY,
+    use_provider_batch: bool = BATCH_USE_PROVIDER_BATCH,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> list[BatchResult]:
+    """
+    Run the pipeline for many conversations, stage by stage.
+
+    Meant for offline jobs where cost matters more than latency. Cached answers are
+    served first. Intent classification and context query generation then run for all
+    remaining items together, packed several items per prompt (or through the
+    provider's batch endpoint). Retrieval, response generation and validation follow
+    per item, with at most concurrency items in flight. A failing item is reported in
+    its result and does not affect the others.
+
+    Args:
+        items: (query, chat history) pairs
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        use_cache: Whether to look up and store responses in the semantic response cache (default: RESPONSE_CACHE_ENABLED)
+        pack_size: Maximum number of items per packed prompt (default: BATCH_PACK_SIZE)
+        concurrency: Maximum number of LLM calls or items in flight (default: BATCH_CONCURRENCY)
+        use_provider_batch: Whether to use the client's batch endpoint when it has one (default: BATCH_USE_PROVIDER_BATCH)
+        progress: Called with (completed items, total items) after every item
+
+    Returns:
+        list[BatchResult]: One result per item, in order, with either the response and
+            metadata or the error
+    """
+    total = len(items)
+    results: list[Optional[BatchResult]] = [None] * total
+    completed = 0
+    report_every = max(1, total // 10)
+
+    def finish(i: int, result: BatchResult) -> None:
+        nonlocal completed
+        results[i] = result
+        completed += 1
+        if result.error is not None:
+            increment("batch_items_failed")
+        if progress is not None:
+            progress(completed, total)
+        if completed % report_every == 0 or completed == total:
+            log_info("Batch Progress", lambda: f"{completed}/{total} items complete")
+
+    def failed(i: int, error: BaseException, intent: Optional[str] = None) -> None:
+        log_error(f"Batch item {i + 1} failed", f"Query: {items[i][0][:100]}", error=error)
+        finish(i, BatchResult(query=items[i][0], intent=intent, error=f"{type(error).__name__}: {error}"))
+
+    with span("pipeline_batch", items=total) as batch_span:
+        log_info("Batch Pipeline", lambda: f"Processing {total} items (pack size {pack_size}, concurrency {concurrency})")
+
+        histories: dict[int, list[dict]] = {}
+        for i, (query, chat_history) in enumerate(items):
+            try:
+                if use_cache:
+                    cached = pipeline.response_cache.lookup(query, chat_history)
+                    if cached is not None:
+                        increment("response_cache_hits")
+                        finish(i, BatchResult(query=query, response=cached[0], metadata=cached[1]))
+                        continue
+                    increment("response_cache_misses")
+                histories[i] = pipeline.history_manager.compact(chat_history)
+            except Exception as e:
+                failed(i, e)
+
+        open_items = list(histories)
+        intents = await get_intents_batch_async(
+            [(items[i][0], histories[i]) for i in open_items], pack_size, concurrency, use_provider_batch
+        )
+        intent_by_item = dict(zip(open_items, intents))
+
+        learning = [i for i in open_items if isinstance(intent_by_item[i], Intent) and intent_by_item[i].intent == "Learning Mode"]
+        context_queries = await get_context_queries_batch_async(
+            [(items[i][0], histories[i], intent_by_item[i].topic) for i in learning], pack_size, concurrency, use_provider_batch
+        )
+        queries_by_item = dict(zip(learning, context_queries))
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def answer(i: int) -> None:
+            query, chat_history = items[i]
+            intent = intent_by_item[i]
+            if isinstance(intent, BaseException):
+                failed(i, intent)
+                return
+            async with semaphore:
+                try:
+                    metadata = None
+                    if i in queries_by_item:
+                        queries = queries_by_item[i]
+                        if isinstance(queries, BaseException):
+                            raise queries
+                        context, metadata = await pipeline.get_context_async(
+                            queries.queries, histories[i], intent.topic, query, summarize=summarize
+                        )
+                        response = await pipeline.run_response_layer_async(query, histories[i], intent.topic, context)
+                    else:
+                        response = await pipeline.get_direct_response_async(query, histories[i])
+                except Exception as e:
+                    failed(i, e, intent.intent)
+                    return
+
+            final_metadata = metadata if metadata else None
+            if use_cache and intent.intent in CACHEABLE_INTENTS:
+                pipeline.response_cache.store(query, chat_history, intent.topic, response.response, final_metadata)
+            finish(i, BatchResult(query=query, response=response.response, metadata=final_metadata, intent=intent.intent))
+
+        await asyncio.gather(*(answer(i) for i in open_items))
+
+        failures = sum(1 for result in results if result.error is not None)
+        batch_span.set_attributes(failed=failures)
+        log_success("Batch Pipeline Complete", lambda: f"{total - failures}/{total} items answered, {failures} failed")
+    return results
+
+
+def run_pipeline_batch(
+    items: list[tuple[str, list[dict]]],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    use_cache: bool = RESPONSE_CACHE_ENABLED,
+    pack_size: int = BATCH_PACK_SIZE,
+    concurrency: int = BATCH_CONCURRENCY,
+    use_provider_batch: bool = BATCH_USE_PROVIDER_BATCH,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> list[BatchResult]:
+    """
+    Synchronous wrapper around run_pipeline_batch_async.
+
+    Args:
+        items: (query, chat history) pairs
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        use_cache: Whether to look up and store responses in the semantic response cache (default: RESPONSE_CACHE_ENABLED)
+        pack_size: Maximum number of items per packed prompt (default: BATCH_PACK_SIZE)
+        concurrency: Maximum number of LLM calls or items in flight (default: BATCH_CONCURRENCY)
+        use_provider_batch: Whether to use the client's batch endpoint when it has one (default: BATCH_USE_PROVIDER_BATCH)
+        progress: Called with (completed items, total items) after every item
+
+    Returns:
+        list[BatchResult]: One result per item, in order
+    """
+    return run_sync(
+        run_pipeline_batch_async(items, summarize, use_cache, pack_size, concurrency, use_provider_batch, progress)
+    )
@@ -0,0 +1,453 @@
+"""
+Offline benchmark of the pipeline orchestration.
+
+Replaces the LLM client and the knowledge base search with simulated ones (canned JSON
+per stage, log-normal latencies) and drives run_pipeline_async over a mix of intents at
+several concurrency levels. Reports throughput, turn latency, per-stage p50/p99 and LLM
+calls per turn, and can compare a run against a saved baseline to catch regressions:
+
+    python benchmark.py --turns 200 --concurrency 1,8,32 --mix learning=0.6,misc=0.2,normal=0.2 --save baseline.json
+    python benchmark.py --turns 200 --concurrency 1,8,32 --mix learning=0.6,misc=0.2,normal=0.2 --baseline baseline.json
+"""
+from typing import Optional
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import types
+
+
+# Median latency in seconds of each simulated call, before --time-scale is applied
+DEFAULT_LATENCIES = {
+    "intent": 0.6,
+    "context_queries": 0.7,
+    "context_summary": 1.5,
+    "response": 2.5,
+    "validation": 1.0,
+    "ranking": 1.2,
+    "direct_response": 1.5,
+    "history_summary": 1.5,
+    "search": 0.15,
+}
+
+INTENT_NAMES = {"learning": "Learning Mode", "misc": "Misc Mode", "normal": "Normal Mode"}
+
+MIXES = {
+    "learning": {"learning": 1.0},
+    "misc": {"misc": 1.0},
+    "normal": {"normal": 1.0},
+    "mixed": {"learning": 0.6, "misc": 0.2, "normal": 0.2},
+}
+
+TOPICS = ["Density", "Photosynthesis", "Momentum", "Osmosis", "Inflation", "Entropy", "Mitosis", "Gravity"]
+
+QUERY_TEMPLATES = {
+    "learning": [
+        "What is the formula of {topic}?",
+        "Can you explain how {topic} works with an example?",
+        "Why does {topic} matter in everyday life?",
+    ],
+    "misc": ["Thanks, that was helpful!", "hi", "ok cool", "Thank you so much"],
+    "normal": [
+        "Can you say that again more simply?",
+        "Summarize what we just talked about about {topic}.",
+        "What did you mean by your last sentence?",
+    ],
+}
+
+CHAT_HISTORY = [
+    {"role": "user", "content": "Hi, I am studying for my science exam."},
+    {"role": "assistant", "content": "Great! Which topic would you like to start with?"},
+]
+
+STAGES = (
+    "pipeline",
+    "intent",
+    "context_layer",
+    "context_queries",
+    "retrieve_many",
+    "context_summary",
+    "response_layer",
+    "response",
+    "validation",
+    "ranking",
+    "direct_response",
+    "llm.chat",
+)
+
+
+class LatencyModel:
+    """Log-normal latency distribution around per-operation medians."""
+
+    def __init__(self, medians: dict[str, float], sigma: float = 0.35, scale: float = 1.0, seed: int = 0):
+        self.medians = medians
+        self.sigma = sigma
+        self.scale = scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, operation: str) -> float:
+        with self._lock:
+            factor = self._random.lognormvariate(0, self.sigma)
+        return self.medians.get(operation, 0.5) * factor * self.scale
+
+    def chance(self, probability: float) -> bool:
+        with self._lock:
+            return self._random.random() < probability
+
+
+class FakeLLMClient:
+    """
+    Simulated LLMClient returning canned JSON for each pipeline stage.
+
+    The stage is recognized from the system prompt, the intent of a query comes from the
+    benchmark's query set, and the judge rates a response Optimal with probability
+    optimal_rate (a ranked set of candidates when any of them would be). Calls are
+    counted per stage.
+    """
+
+    def __init__(self, latency: LatencyModel, intents: dict[str, str], optimal_rate: float = 0.8):
+        from prompts import (
+            CONTEXT_QUERIES_SYSTEM_PROMPT,
+            CONTEXT_SUMMARY_SYSTEM_PROMPT,
+            DIRECT_RESPONSE_SYSTEM_PROMPT,
+            HISTORY_SUMMARY_SYSTEM_PROMPT,
+            INTENT_SYSTEM_PROMPT,
+            RANKING_SYSTEM_PROMPT,
+            RESPONSE_SYSTEM_PROMPT,
+            VALIDATION_SYSTEM_PROMPT,
+        )
+
+        self.latency = latency
+        self.intents = intents
+        self.optimal_rate = optimal_rate
+        self.stages = {
+            INTENT_SYSTEM_PROMPT: "intent",
+            CONTEXT_QUERIES_SYSTEM_PROMPT: "context_queries",
+            CONTEXT_SUMMARY_SYSTEM_PROMPT: "context_summary",
+            RESPONSE_SYSTEM_PROMPT: "response",
+            VALIDATION_SYSTEM_PROMPT: "validation",
+            RANKING_SYSTEM_PROMPT: "ranking",
+            DIRECT_RESPONSE_SYSTEM_PROMPT: "direct_response",
+            HISTORY_SUMMARY_SYSTEM_PROMPT: "history_summary",
+        }
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _query_of(self, text: str) -> str:
+        matches = [query for query in self.intents if query in text]
+        return max(matches, key=len) if matches else ""
+
+    def _topic_of(self, query: str) -> str:
+        return next((topic for topic in TOPICS if topic in query), "General Science")
+
+    def _output(self, stage: str, text: str) -> dict:
+        query = self._query_of(text)
+        topic = self._topic_of(query)
+        if stage == "intent":
+            return {"intent": self.intents.get(query, "Normal Mode"), "topic": topic}
+        if stage == "context_queries":
+            return {"queries": [topic, f"{topic} formula", f"{topic} examples"]}
+        if stage in ("context_summary", "history_summary"):
+            return {"summary": f"{topic} is a core concept; the key facts and formula of {topic} are covered."}
+        if stage == "validation":
+            if self.latency.chance(self.optimal_rate):
+                return {"quality": "Optimal", "reason": "None", "resolution": "None"}
+            return {"quality": "Suboptimal", "reason": "Missing an example.", "resolution": "Add an example."}
+        if stage == "ranking":
+            # The best of several candidates is Optimal more often than a single response
+            candidates = max(1, len(re.findall(r"\*\*Candidate \d+:", text)))
+            optimal = any(self.latency.chance(self.optimal_rate) for _ in range(candidates))
+            if optimal:
+                return {"best": candidates, "quality": "Optimal", "reason": "None", "resolution": "None"}
+            return {"best": 1, "quality": "Suboptimal", "reason": "Missing an example.", "resolution": "Add an example."}
+        if stage == "response":
+            return {
+                "response": f"{topic} is a core concept in science. The formula of {topic} relates the "
+                f"quantities described in the context, and a worked example of {topic} shows how it is "
+                f"applied. Do you have any questions about {topic}?"
+            }
+        return {"response": "Happy to help! Let me know what you would like to learn next."}
+
+    def _complete(self, messages: list[dict]) -> tuple[str, dict]:
+        stage = self.stages.get(messages[0]["content"], "direct_response")
+        with self._lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+        text = "\n".join(message["content"] for message in messages)
+        content = json.dumps(self._output(stage, text))
+        response = {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": len(content) // 4},
+        }
+        return stage, response
+
+    def chat(self, messages: list[dict]) -> dict:
+        stage, response = self._complete(messages)
+        time.sleep(self.latency.sample(stage))
+        return response
+
+    async def achat(self, messages: list[dict]) -> dict:
+        stage, response = self._complete(messages)
+        await asyncio.sleep(self.latency.sample(stage))
+        return response
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+
+class FakeSearch:
+    """Simulated semantic_search returning results_per_query documents about the query."""
+
+    def __init__(self, latency: LatencyModel, results_per_query: int = 3, chars_per_result: int = 400):
+        self.latency = latency
+        self.results_per_query = results_per_query
+        self.chars_per_result = chars_per_result
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, query: str) -> list[tuple[str, dict]]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency.sample("search"))
+        return self._results(query)
+
+    def batch(self, queries: list[str]) -> list[list[tuple[str, dict]]]:
+        """Simulated semantic_search_batch: one round trip for all queries."""
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency.sample("search"))
+        return [self._results(query) for query in queries]
+
+    def _results(self, query: str) -> list[tuple[str, dict]]:
+        sentence = f"{query} is a core concept in science, and its formula relates the quantities involved. "
+        text = (sentence * (self.chars_per_result // len(sentence) + 1))[: self.chars_per_result]
+        return [(text, {"source": f"{query}.pdf", "page": page}) for page in range(self.results_per_query)]
+
+
+def install_fakes(client: FakeLLMClient, search: FakeSearch) -> types.ModuleType:
+    """
+    Point the pipeline at the simulated client and search, importing it if needed.
+
+    The client and rag modules are replaced in sys.modules before the first import of
+    pipeline, so no provider credentials or knowledge base are required.
+
+    Returns:
+        types.ModuleType: The pipeline module
+    """
+    client_module = types.ModuleType("client")
+    client_module.LLMClient = lambda: client
+    rag_module = types.ModuleType("rag")
+    rag_module.semantic_search = search
+    rag_module.semantic_search_batch = search.batch
+    sys.modules["client"] = client_module
+    sys.modules["rag"] = rag_module
+
+    import pipeline
+    import retrieval
+
+    pipeline.llm_client = client
+    retrieval.semantic_search = search
+    retrieval.semantic_search_batch = search.batch
+    return pipeline
+
+
+def build_turns(mix: dict[str, float], turns: int, seed: int = 0) -> list[tuple[str, str]]:
+    """Draw (query, intent) pairs following the intent mix."""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    result = []
+    for _ in range(turns):
+        kind = rng.choices(kinds, weights)[0]
+        query = rng.choice(QUERY_TEMPLATES[kind]).format(topic=rng.choice(TOPICS))
+        result.append((query, INTENT_NAMES[kind]))
+    return result
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (0.0 for no values)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+async def run_load(
+    pipeline: types.ModuleType,
+    client: FakeLLMClient,
+    search: FakeSearch,
+    turns: list[tuple[str, str]],
+    concurrency: int,
+    use_cache: bool = False,
+) -> dict:
+    """
+    Run every turn through run_pipeline_async with at most concurrency turns in flight.
+
+    Returns:
+        dict: Throughput, turn latency percentiles, error count, per-stage p50/p99 and
+            LLM and search calls per turn
+    """
+    import metrics
+    from retrieval import retrieval_cache
+
+    metrics.reset()
+    retrieval_cache.clear()
+    pipeline.response_cache.clear()
+    client.calls.clear()
+    search.calls = 0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def turn(query: str) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await pipeline.run_pipeline_async(query, CHAT_HISTORY, use_cache=use_cache)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(turn(query) for query, _ in turns))
+    wall = time.perf_counter() - start
+
+    stages = {}
+    for stage in STAGES:
+        summary = metrics.quantiles("span_duration_seconds", {"span": stage})
+        if summary["count"]:
+            stages[stage] = {"count": summary["count"], "p50": summary["p50"], "p99": summary["p99"]}
+
+    return {
+        "turns": len(turns),
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput": len(turns) / wall if wall else 0.0,
+        "turn_p50": percentile(latencies, 0.5),
+        "turn_p99": percentile(latencies, 0.99),
+        "llm_calls_per_turn": client.total_calls() / len(turns),
+        "llm_calls_by_stage": dict(client.calls),
+        "searches_per_turn": search.calls / len(turns),
+        "stages": stages,
+    }
+
+
+def print_report(name: str, result: dict) -> None:
+    print(f"\n== {name}: {result['turns']} turns, concurrency {result['concurrency']} ==")
+    print(
+        f"throughput {result['throughput']:.1f} turns/s | turn p50 {result['turn_p50'] * 1000:.0f}ms "
+        f"p99 {result['turn_p99'] * 1000:.0f}ms | errors {result['errors']}"
+    )
+    print(
+        f"LLM calls/turn {result['llm_calls_per_turn']:.2f} {result['llm_calls_by_stage']} | "
+        f"searches/turn {result['searches_per_turn']:.2f}"
+    )
+    print(f"{'stage':<18}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, summary in result["stages"].items():
+        print(f"{stage:<18}{summary['count']:>7}{summary['p50'] * 1000:>10.1f}{summary['p99'] * 1000:>10.1f}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    List regressions of results against a baseline run with the same settings.
+
+    A run regresses when its turn p99 or LLM calls per turn grow, or its throughput
+    drops, by more than tolerance (a fraction, e.g. 0.2 for 20%).
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["turn_p99"] > base["turn_p99"] * (1 + tolerance):
+            regressions.append(f"{name}: turn p99 {base['turn_p99']:.3f}s -> {result['turn_p99']:.3f}s")
+        if result["llm_calls_per_turn"] > base["llm_calls_per_turn"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: LLM calls/turn {base['llm_calls_per_turn']:.2f} -> {result['llm_calls_per_turn']:.2f}"
+            )
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput']:.1f} -> {result['throughput']:.1f} turns/s")
+    return regressions
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse a named mix ("mixed") or weights ("learning=0.6,misc=0.2,normal=0.2")."""
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in INTENT_NAMES:
+            raise argparse.ArgumentTypeError(f"Unknown intent '{kind}', expected one of {', '.join(INTENT_NAMES)}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100, help="Turns per run (default: 100)")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels (default: 1,8,32)")
+    parser.add_argument("--mix", action="append", help="Intent mix: a name (learning, misc, normal, mixed) or weights; repeatable (default: mixed)")
+    parser.add_argument("--time-scale", type=float, default=0.05, help="Multiplier applied to every simulated latency (default: 0.05)")
+    parser.add_argument("--sigma", type=float, default=0.35, help="Log-normal spread of simulated latencies (default: 0.35)")
+    parser.add_argument("--latency", action="append", default=[], help="Override a median latency, e.g. response=3.0; repeatable")
+    parser.add_argument("--optimal-rate", type=float, default=0.8, help="Probability that the judge rates a response Optimal (default: 0.8)")
+    parser.add_argument("--cache", action="store_true", help="Enable the semantic response cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against results saved with --save; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression against the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    medians = dict(DEFAULT_LATENCIES)
+    for override in args.latency:
+        operation, _, seconds = override.partition("=")
+        medians[operation] = float(seconds)
+
+    mixes = args.mix or ["mixed"]
+    latency = LatencyModel(medians, args.sigma, args.time_scale, args.seed)
+    all_turns = {name: build_turns(parse_mix(name), args.turns, args.seed) for name in mixes}
+    intents = {query: intent for turns in all_turns.values() for query, intent in turns}
+    client = FakeLLMClient(latency, intents, args.optimal_rate)
+    search = FakeSearch(latency)
+    pipeline = install_fakes(client, search)
+
+    from utils import configure_logging, flush_logs
+
+    configure_logging(level="ERROR")
+
+    results = {}
+    for name, turns in all_turns.items():
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            result = asyncio.run(run_load(pipeline, client, search, turns, concurrency, args.cache))
+            flush_logs()
+            results[f"{name}@{concurrency}"] = result
+            print_report(f"{name}@{concurrency}", result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Record/replay cassettes for LLM and knowledge base calls.
+
+In record mode every llm_client chat call and every semantic_search call is passed
+through to the real backend and stored, with its latency, in a cassette file (JSON
+lines, gzip-compressed when the path ends in .gz). Pipeline turns are stored too, so a
+day of traffic can later be replayed through run_pipeline without network access:
+
+    CASSETTE_MODE=record CASSETTE_PATH=day.jsonl.gz <run the service>
+    python cassette.py day.jsonl.gz --latency --concurrency 8
+"""
+from collections import defaultdict
+from typing import Any, Callable, Optional
+import argparse
+import asyncio
+import gzip
+import hashlib
+import inspect
+import json
+import sys
+import threading
+import time
+import types
+
+
+# Attributes of the LLM client that shape the requests it is sent (e.g. the context budget
+# of its model), recorded so that replay builds the same prompts. Never credentials.
+CLIENT_ATTRIBUTES = ("model",)
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request that is not in the cassette."""
+
+    # Looks like a non-retryable client error to the retry policy
+    status_code = 404
+
+
+class RecordedError(RuntimeError):
+    """Replays an exception that the backend raised while recording."""
+
+
+def request_key(kind: str, payload: Any) -> str:
+    """Stable hash of a request (the prompt messages, or the search query)."""
+    encoded = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    One cassette file, opened for recording or for replay.
+
+    Recorded calls are keyed by request_key. The same prompt can be recorded more than
+    once (retries, sampling); replay serves its recordings in their original order and
+    keeps repeating the last one after that.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", reproduce_latency: bool = False):
+        """
+        Args:
+            path: Cassette file, gzip-compressed if it ends in .gz
+            mode: "record" to append to the cassette, "replay" to serve from it
+            reproduce_latency: In replay mode, wait as long as each recorded call took
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}', expected 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.reproduce_latency = reproduce_latency
+        self.turns: list[dict] = []
+        self.client: Optional[dict] = None
+        self.misses = 0
+        self._recordings: dict[str, list[dict]] = defaultdict(list)
+        self._cursors: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self) -> None:
+        with self._open("r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["type"] == "turn":
+                    self.turns.append(entry)
+                elif entry["type"] == "client":
+                    self.client = entry
+                else:
+                    self._recordings[entry["key"]].append(entry)
+
+    def _append(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock, self._open("a") as f:
+            f.write(line)
+
+    def record_turn(self, query: str, chat_history: list[dict]) -> None:
+        """Store a pipeline turn so that it can be replayed later."""
+        if self.recording:
+            self._append({"type": "turn", "time": time.time(), "query": query, "chat_history": chat_history})
+
+    def record_client(self, methods: dict[str, Optional[list[list]]], attributes: dict[str, Any]) -> None:
+        """Store the chat method signatures and attributes of the recorded LLM client."""
+        if self.recording:
+            self._append({"type": "client", "methods": methods, "attributes": attributes})
+
+    def _record(self, kind: str, key: str, latency: float, result: Any = None, error: BaseException = None) -> None:
+        entry = {"type": kind, "key": key, "latency": round(latency, 4)}
+        if error is not None:
+            entry["error"] = f"{type(error).__name__}: {error}"
+        else:
+            entry["result"] = result
+        self._append(entry)
+
+    def _next(self, key: str) -> dict:
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                self.misses += 1
+                raise CassetteMiss(f"No recording for request {key[:12]} in {self.path}")
+            index = min(self._cursors[key], len(recordings) - 1)
+            self._cursors[key] += 1
+            return recordings[index]
+
+    @staticmethod
+    def _result(entry: dict) -> Any:
+        if "error" in entry:
+            raise RecordedError(entry["error"])
+        return entry["result"]
+
+    def wrap_client(self, client: Any) -> "CassetteClient":
+        """Wrap an LLM client so that its chat calls are recorded or replayed."""
+        return CassetteClient(self, client)
+
+    def wrap_search(self, search: Callable[[str], list[tuple[str, dict]]]) -> Callable[[str], list[tuple[str, dict]]]:
+        """Wrap a semantic_search function so that its calls are recorded or replayed."""
+
+        def cassette_search(query: str) -> list[tuple[str, dict]]:
+            key = request_key("search", query)
+            if not self.recording:
+                entry = self._next(key)
+                if self.reproduce_latency:
+                    time.sleep(entry["latency"])
+                return [tuple(item) for item in self._result(entry)]
+
+            start = time.perf_counter()
+            try:
+                results = search(query)
+            except Exception as e:
+                self._record("search", key, time.perf_counter() - start, error=e)
+                raise
+            self._record("search", key, time.perf_counter() - start, [list(item) for item in results])
+            return results
+
+        return cassette_search
+
+
+def _parameters(method: Optional[Callable]) -> Optional[list[list]]:
+    """[name, kind, has default] of each parameter of a method, or None if there is no method."""
+    if method is None:
+        return None
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return [["messages", "POSITIONAL_OR_KEYWORD", False], ["kwargs", "VAR_KEYWORD", False]]
+    return [[p.name, p.kind.name, p.default is not inspect.Parameter.empty] for p in parameters]
+
+
+def _signature(parameters: list[list]) -> inspect.Signature:
+    return inspect.Signature(
+        [
+            inspect.Parameter(
+                name, getattr(inspect.Parameter, kind), default=None if has_default else inspect.Parameter.empty
+            )
+            for name, kind, has_default in parameters
+        ]
+    )
+
+
+class CassetteClient:
+    """
+    LLM client wrapper that records chat calls to, or replays them from, a cassette.
+
+    Only chat (and achat, when the wrapped client has it) is provided, so streaming
+    stages fall back to a single completion while a cassette is in use. The wrapper
+    presents the signatures of the recorded client's chat methods and its
+    CLIENT_ATTRIBUTES, stored in the cassette when recording, so the pipeline sends
+    the same arguments (response_format, temperature) when recording and replaying as
+    it does without a cassette.
+    """
+
+    def __init__(self, cassette: Cassette, client: Any):
+        self.cassette = cassette
+        self.client = client
+        if cassette.recording:
+            methods = {name: _parameters(getattr(client, name, None)) for name in ("chat", "achat")}
+            attributes = {name: getattr(client, name) for name in CLIENT_ATTRIBUTES if hasattr(client, name)}
+            cassette.record_client(methods, attributes)
+        elif cassette.client is not None:
+            methods, attributes = cassette.client["methods"], cassette.client["attributes"]
+        else:
+            # Cassette recorded without client details: present the replaying client's
+            methods = {name: _parameters(getattr(client, name, None)) for name in ("chat", "achat")}
+            attributes = {}
+        self._attributes = attributes
+        self.chat = self._mirror(self._chat, methods["chat"])
+        if cassette.recording and methods["achat"] is None:
+            # Blocking clients are run in a thread by the pipeline; keep it that way
+            self.achat = None
+        else:
+            self.achat = self._mirror(self._achat, methods["achat"] or methods["chat"])
+
+    @staticmethod
+    def _mirror(method: Callable, parameters: list[list]) -> Callable:
+        """Wrap a chat method so that inspect.signature reports the recorded client's parameters."""
+        if inspect.iscoroutinefunction(method):
+
+            async def mirrored(*args, **kwargs):
+                return await method(*args, **kwargs)
+
+        else:
+
+            def mirrored(*args, **kwargs):
+                return method(*args, **kwargs)
+
+        mirrored.__signature__ = _signature(parameters)
+        return mirrored
+
+    def __getattr__(self, name: str) -> Any:
+        # Only the recorded attributes; other client methods (stream, batch_chat) would bypass the cassette
+        attributes = self.__dict__.get("_attributes", {})
+        if name not in attributes:
+            raise AttributeError(name)
+        return attributes[name]
+
+    def _chat(self, messages: list[dict], **kwargs) -> dict:
+        key = request_key("chat", [messages, kwargs])
+        if not self.cassette.recording:
+            entry = self.cassette._next(key)
+            if self.cassette.reproduce_latency:
+                time.sleep(entry["latency"])
+            return self.cassette._result(entry)
+
+        start = time.perf_counter()
+        try:
+            response = self.client.chat(messages, **kwargs)
+        except Exception as e:
+            self.cassette._record("chat", key, time.perf_counter() - start, error=e)
+            raise
+        self.cassette._record("chat", key, time.perf_counter() - start, response)
+        return response
+
+    async def _achat(self, messages: list[dict], **kwargs) -> dict:
+        key = request_key("chat", [messages, kwargs])
+        if not self.cassette.recording:
+            entry = self.cassette._next(key)
+            if self.cassette.reproduce_latency:
+                await asyncio.sleep(entry["latency"])
+            return self.cassette._result(entry)
+
+        start = time.perf_counter()
+        try:
+            response = await self.client.achat(messages, **kwargs)
+        except Exception as e:
+            self.cassette._record("chat", key, time.perf_counter() - start, error=e)
+            raise
+        self.cassette._record("chat", key, time.perf_counter() - start, response)
+        return response
+
+
+def open_cassette(mode: str, path: str, reproduce_latency: bool = False) -> Optional[Cassette]:
+    """Open the cassette configured by CASSETTE_MODE, or return None when it is unset."""
+    if not mode:
+        return None
+    return Cassette(path, mode, reproduce_latency)
+
+
+def _offline_modules() -> None:
+    """Register client and rag modules that refuse to make real calls."""
+
+    class OfflineLLMClient:
+        def chat(self, messages, **kwargs):
+            raise CassetteMiss("Replay is offline: the real LLM client is disabled")
+
+    def offline_search(query):
+        raise CassetteMiss("Replay is offline: the real semantic search is disabled")
+
+    client_module = types.ModuleType("client")
+    client_module.LLMClient = OfflineLLMClient
+    rag_module = types.ModuleType("rag")
+    rag_module.semantic_search = offline_search
+    sys.modules.setdefault("client", client_module)
+    sys.modules.setdefault("rag", rag_module)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay the turns of a cassette through run_pipeline offline")
+    parser.add_argument("path", help="Cassette recorded with CASSETTE_MODE=record")
+    parser.add_argument("--latency", action="store_true", help="Reproduce the recorded latency of every call")
+    parser.add_argument("--concurrency", type=int, default=1, help="Turns replayed at the same time (default: 1)")
+    parser.add_argument("--limit", type=int, help="Replay only the first N turns")
+    args = parser.parse_args(argv)
+
+    cassette = Cassette(args.path, "replay", args.latency)
+    turns = cassette.turns[: args.limit] if args.limit else cassette.turns
+
+    _offline_modules()
+    import metrics
+    import pipeline
+    import retrieval
+
+    pipeline.cassette = None
+    pipeline.history_manager.background = False
+    pipeline.grounding_audit_rate = 0.0
+    pipeline.retry_policy.jitter = False
+    pipeline.llm_client = cassette.wrap_client(pipeline.llm_client)
+    retrieval.semantic_search = cassette.wrap_search(retrieval.semantic_search)
+    retrieval.semantic_search_batch = None
+
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    latencies: list[float] = []
+    failures = 0
+
+    async def replay(turn: dict) -> None:
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await pipeline.run_pipeline_async(turn["query"], turn["chat_history"])
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    async def replay_all() -> None:
+        await asyncio.gather(*(replay(turn) for turn in turns))
+
+    start = time.perf_counter()
+    asyncio.run(replay_all())
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+    print(
+        f"Replayed {len(turns)} turns in {wall:.2f}s ({len(turns) / wall if wall else 0:.1f} turns/s), "
+        f"p50 {p50:.3f}s, p99 {p99:.3f}s, {failures} failed, {cassette.misses} cassette misses"
+    )
+    print(metrics.prometheus_text(), end="")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import os
+
+# Maximum number of knowledge base searches run at the same time for one turn
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "3"))
+
+# Summarize retrieved context before response generation (can be overridden per request)
+SUMMARIZE_CONTEXT = os.getenv("SUMMARIZE_CONTEXT", "true").lower() in ("1", "true", "yes")
+
+# Retrieved text for a context query shorter than this (in characters) is used as-is
+SUMMARY_MIN_CHARS = int(os.getenv("SUMMARY_MIN_CHARS", "1500"))
+
+# Start context retrieval alongside intent classification, betting on Learning Mode
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+
+# Classify obvious turns locally instead of calling the LLM in get_intent
+FAST_INTENT_ENABLED = os.getenv("FAST_INTENT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Minimum local classifier confidence needed to skip the LLM
+FAST_INTENT_THRESHOLD = float(os.getenv("FAST_INTENT_THRESHOLD", "0.9"))
+
+# Intents the fast path may return. It cannot extract a topic, so by default it is limited
+# to intents whose pipelines do not use one.
+FAST_INTENT_MODES = tuple(
+    mode.strip() for mode in os.getenv("FAST_INTENT_MODES", "Misc Mode,Normal Mode").split(",")
+)
+
+# Trained Naive Bayes model for the fast path (keyword rules only when unset)
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH")
+
+# Append every LLM intent classification to this JSONL file, to train the fast path from
+INTENT_LOG_PATH = os.getenv("INTENT_LOG_PATH")
+
+# Serve repeated questions from the semantic response cache. Off by default: the local
+# hashed embedding cannot tell unrelated queries apart reliably.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.9"))
+
+# Minimum Jaccard overlap of content words between a query and a cached one (1.0: same words).
+# Lower it only with a real embedding behind the cache.
+RESPONSE_CACHE_WORD_OVERLAP = float(os.getenv("RESPONSE_CACHE_WORD_OVERLAP", "1.0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+# Number of most recent chat history messages that scope a cached response
+RESPONSE_CACHE_HISTORY_TURNS = int(os.getenv("RESPONSE_CACHE_HISTORY_TURNS", "2"))
+
+# Only responses for these intents are cached; others depend on the wider conversation
+CACHEABLE_INTENTS = ("Learning Mode",)
+
+# Cache semantic search results per normalized context query
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2048"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+
+# Version stamp of the knowledge base; cached search results from another version are discarded
+KB_VERSION = os.getenv("KB_VERSION", "0")
+
+# Chat history messages kept verbatim; older ones are folded into a rolling summary
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "10"))
+
+# Maximum number of rolling history summaries kept in memory
+HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "10000"))
+
+# Approximate token budget for the rendered chat history in each stage's prompt
+HISTORY_TOKEN_BUDGETS = {
+    "intent": 600,
+    "context_queries": 600,
+    "context_summary": 400,
+    "response": 1500,
+    "validation": 800,
+    "ranking": 800,
+    "direct_response": 1500,
+}
+
+# Judge streamed Learning Mode responses after they have been sent (no refinement)
+STREAM_VALIDATE = os.getenv("STREAM_VALIDATE", "false").lower() in ("1", "true", "yes")
+
+# Score responses against the retrieved context locally before calling the LLM judge
+GROUNDING_CHECK_ENABLED = os.getenv("GROUNDING_CHECK_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Local grounding scores at or above ACCEPT are Optimal and below REJECT are Suboptimal
+# without asking the LLM judge; scores in between go to the judge
+GROUNDING_ACCEPT_THRESHOLD = float(os.getenv("GROUNDING_ACCEPT_THRESHOLD", "0.8"))
+GROUNDING_REJECT_THRESHOLD = float(os.getenv("GROUNDING_REJECT_THRESHOLD", "0.3"))
+
+# Let the local check accept responses that score above ACCEPT, pass the length, format and
+# citation coverage checks and address the query's content words; off leaves accepting to the judge
+GROUNDING_LOCAL_ACCEPT = os.getenv("GROUNDING_LOCAL_ACCEPT", "true").lower() in ("1", "true", "yes")
+
+# Share of locally decided responses that are still sent to the judge to measure agreement
+GROUNDING_AUDIT_RATE = float(os.getenv("GROUNDING_AUDIT_RATE", "0.05"))
+
+# Responses outside this length range (in characters) fail the local format check
+GROUNDING_MIN_CHARS = int(os.getenv("GROUNDING_MIN_CHARS", "80"))
+GROUNDING_MAX_CHARS = int(os.getenv("GROUNDING_MAX_CHARS", "8000"))
+
+# Shared retry policy for LLM calls
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+RETRY_MAX_PARSE_RETRIES = int(os.getenv("RETRY_MAX_PARSE_RETRIES", "1"))
+
+# Retries allowed per call across the process (token bucket ratio and burst size)
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MAX_TOKENS = float(os.getenv("RETRY_BUDGET_MAX_TOKENS", "10"))
+
+# Consecutive failures that open an endpoint's circuit, and how long it stays open (seconds)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# End-to-end latency budget for one pipeline request in seconds (0 disables the deadline)
+PIPELINE_DEADLINE_SECONDS = float(os.getenv("PIPELINE_DEADLINE_SECONDS", "30"))
+
+# Seconds that must remain to start another refine round (generate + validate)
+DEADLINE_REFINE_MIN_SECONDS = float(os.getenv("DEADLINE_REFINE_MIN_SECONDS", "10"))
+
+# Seconds that must remain to validate a generated response
+DEADLINE_VALIDATE_MIN_SECONDS = float(os.getenv("DEADLINE_VALIDATE_MIN_SECONDS", "4"))
+
+# Seconds that must remain after intent classification to retrieve context and generate from it
+DEADLINE_RETRIEVAL_MIN_SECONDS = float(os.getenv("DEADLINE_RETRIEVAL_MIN_SECONDS", "12"))
+
+# Seconds kept back from context retrieval so a direct response can still be generated if it overruns
+DEADLINE_DIRECT_RESERVE_SECONDS = float(os.getenv("DEADLINE_DIRECT_RESERVE_SECONDS", "4"))
+
+# Threads running blocking (non-async) LLM client chat calls, i.e. the most chat calls in flight
+# at once. Never fewer than BATCH_CONCURRENCY, SEARCH_CONCURRENCY or RESPONSE_CANDIDATES.
+LLM_CHAT_THREADS = int(os.getenv("LLM_CHAT_THREADS", "64"))
+
+# Span export: "jsonl" (one span per line), "otlp" (OTLP/JSON, one trace per line) or empty to disable
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "").lower()
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces.jsonl")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "chatbot-pipeline")
+
+# Minimum level of the log helpers: DEBUG, INFO, SUCCESS, WARNING or ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+
+# Log output: "color" (ANSI, development), "plain" or "json" (one line per message, production)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color").lower()
+
+# Log records waiting to be written before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Record/replay of LLM and search calls: "record", "replay" or empty to call the real backends
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassette.jsonl.gz")
+
+# In replay mode, wait as long as each recorded call originally took
+CASSETTE_REPLAY_LATENCY = os.getenv("CASSETTE_REPLAY_LATENCY", "false").lower() in ("1", "true", "yes")
+
+# Batch runs: items packed into one intent / context query prompt, and items processed at the same time
+BATCH_PACK_SIZE = int(os.getenv("BATCH_PACK_SIZE", "8"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+
+# Send batch prompts through the provider's batch endpoint when the client has one (batch_chat)
+BATCH_USE_PROVIDER_BATCH = os.getenv("BATCH_USE_PROVIDER_BATCH", "true").lower() in ("1", "true", "yes")
+
+# In-process ANN index directory built with ann_index.py; when set it replaces rag.semantic_search
+ANN_INDEX_PATH = os.getenv("ANN_INDEX_PATH", "")
+
+# Function embedding query texts for the ANN index, as "module:function" (default: the
+# embedding the index was built with, as recorded in its manifest)
+ANN_EMBEDDING = os.getenv("ANN_EMBEDDING", "")
+
+# Results per query, and IVF lists probed per query (more lists: better recall, slower search)
+ANN_TOP_K = int(os.getenv("ANN_TOP_K", "5"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+
+# Knowledge base search: "semantic" (vector search), "lexical" (BM25 index only, no embedding
+# call) or "hybrid" (both, fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "semantic").lower()
+
+# BM25 index directory built with lexical_index.py, loaded on first use in lexical and hybrid modes
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index")
+
+# Results per query from the BM25 index, and after hybrid fusion
+LEXICAL_TOP_K = int(os.getenv("LEXICAL_TOP_K", "5"))
+
+# Reciprocal rank fusion constant; larger values weigh lower ranks closer to the top ones
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Drop retrieved chunks whose simhash similarity to an earlier chunk is at least this
+# (1.0 keeps near-duplicates and only drops exact ones)
+CONTEXT_DEDUP_SIMILARITY = float(os.getenv("CONTEXT_DEDUP_SIMILARITY", "0.9"))
+
+# Pack retrieved context into a token budget (ranked by relevance and diversity) before generation
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Approximate context token budget, overridable per model as "model=tokens,model=tokens"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_BUDGETS = {
+    model.strip(): int(tokens)
+    for model, _, tokens in (
+        entry.partition("=") for entry in os.getenv("CONTEXT_TOKEN_BUDGETS", "").split(",") if "=" in entry
+    )
+}
+
+# Weight of the redundancy penalty when ordering context chunks (0: relevance only)
+CONTEXT_PACK_DIVERSITY = float(os.getenv("CONTEXT_PACK_DIVERSITY", "0.3"))
+
+# Constrain LLM output to the expected JSON: "schema" (JSON schema of the stage's model),
+# "json" (any JSON object), "off", or "auto" (schema when the client's chat method declares
+# a response_format parameter)
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "auto").lower()
+
+# Learning Mode responses generated concurrently and ranked by one judge call before any
+# sequential refinement (1 keeps generate -> validate -> refine)
+RESPONSE_CANDIDATES = int(os.getenv("RESPONSE_CANDIDATES", "1"))
+
+# Sampling temperature of each candidate, cycled, when the client's chat method takes one
+RESPONSE_CANDIDATE_TEMPERATURES = tuple(
+    float(value) for value in os.getenv("RESPONSE_CANDIDATE_TEMPERATURES", "0.3,0.7,1.0").split(",") if value.strip()
+)
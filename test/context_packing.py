@@ -0,0 +1,103 @@
+from typing import Optional
+from history import estimate_tokens
+from metrics import increment, observe
+from nlp import cosine_similarity, embed_text
+
+
+# Chunks that would have to be cut below this many tokens to fit are left out instead
+MIN_TRIMMED_TOKENS = 48
+
+
+def source_tag(sources: list[int]) -> str:
+    """Tag citing metadata entries by their 1-based position, e.g. "[S1,S3]"."""
+    return "[" + ",".join(f"S{source + 1}" for source in sources) + "]" if sources else ""
+
+
+def trim_to_tokens(text: str, budget_tokens: int) -> str:
+    """Cut text to about budget_tokens, preferring the end of a sentence, then of a word."""
+    limit = budget_tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    sentence_end = cut.rfind(". ")
+    if sentence_end >= limit // 2:
+        return cut[: sentence_end + 1]
+    word_end = cut.rfind(" ")
+    return (cut[:word_end] if word_end > 0 else cut) + "..."
+
+
+def pack_context(
+    query: str,
+    chunks: list[tuple[str, list[int], int]],
+    budget_tokens: int,
+    diversity: float = 0.3,
+) -> list[str]:
+    """
+    Select, order and trim context chunks to fit a token budget.
+
+    Chunks are picked greedily by maximal marginal relevance: (1 - diversity) times
+    their relevance (hashed-embedding similarity to the query averaged with a prior from
+    the chunk's search rank) minus diversity times their highest similarity to an
+    already picked chunk, so near-repeats of picked material go last. Chunks that no
+    longer fit are cut at a sentence boundary when enough budget is left, and left out
+    otherwise. Every chunk is prefixed with the tag of the metadata entries it came from.
+
+    Args:
+        query: The user query (and topic) the context should answer
+        chunks: (text, indices into the turn's metadata list, rank in its search results) per chunk
+        budget_tokens: Approximate maximum size of the packed context
+        diversity: Weight of the redundancy penalty, 0 to rank by relevance only
+
+    Returns:
+        list[str]: Tagged chunks, most useful first
+    """
+    chunks = [chunk for chunk in chunks if chunk[0].strip()]
+    if not chunks:
+        return []
+
+    query_vector = embed_text(query)
+    vectors = [embed_text(text) for text, _, _ in chunks]
+    relevance = [
+        0.5 * cosine_similarity(vector, query_vector) + 0.5 / (1 + rank)
+        for vector, (_, _, rank) in zip(vectors, chunks)
+    ]
+    redundancy = [0.0] * len(chunks)
+    remaining = list(range(len(chunks)))
+    total_tokens = sum(estimate_tokens(text) for text, _, _ in chunks)
+
+    packed: list[str] = []
+    budget = budget_tokens
+    trimmed = dropped = 0
+    while remaining:
+        best = max(remaining, key=lambda i: (1 - diversity) * relevance[i] - diversity * redundancy[i])
+        remaining.remove(best)
+        text, sources, _ = chunks[best]
+        tag = source_tag(sources)
+        cost = estimate_tokens(f"{tag} {text}")
+        if cost > budget:
+            room = budget - estimate_tokens(tag) - 1
+            if room < MIN_TRIMMED_TOKENS:
+                dropped += 1
+                continue
+            text = trim_to_tokens(text, room)
+            cost = estimate_tokens(f"{tag} {text}")
+            trimmed += 1
+        packed.append(f"{tag} {text}" if tag else text)
+        budget -= cost
+        for i in remaining:
+            redundancy[i] = max(redundancy[i], cosine_similarity(vectors[i], vectors[best]))
+
+    packed_tokens = budget_tokens - budget
+    observe("context_tokens", packed_tokens)
+    if trimmed:
+        increment("context_pack_trimmed", trimmed)
+    if dropped:
+        increment("context_pack_dropped", dropped)
+    if total_tokens > packed_tokens:
+        increment("context_pack_tokens_removed", total_tokens - packed_tokens)
+    return packed
+
+
+def context_budget(model: Optional[str], budgets: dict[str, int], default: int) -> int:
+    """Context token budget for a model, falling back to the default for unknown models."""
+    return budgets.get(model, default) if model else default
@@ -0,0 +1,100 @@
+from contextvars import ContextVar
+from typing import Optional
+import threading
+import time
+from metrics import increment
+from utils import log_warning
+
+
+# Degradation steps, from least to most drastic
+SKIP_REFINEMENT = "skip_refinement"
+SKIP_VALIDATION = "skip_validation"
+SKIP_RETRIEVAL = "skip_retrieval"
+# Streaming only: the response stream was cut off at the deadline after some text was sent
+TRUNCATE_RESPONSE = "truncate_response"
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's latency budget runs out before an LLM call completes."""
+
+
+class Deadline:
+    """
+    End-to-end latency budget for one pipeline request.
+
+    The deadline is installed in a context variable for the duration of the request, so
+    every stage (and every task or thread spawned from it) sees the same budget without
+    it being threaded through each call. Stages consult remaining() to decide whether to
+    degrade, and record each step they take with degrade(); the caller can read the
+    steps back from degradations once the request finishes.
+    """
+
+    def __init__(self, budget_seconds: Optional[float] = None):
+        """
+        Args:
+            budget_seconds: Seconds allowed from now, or None (or <= 0) for no deadline
+        """
+        self.budget_seconds = budget_seconds if budget_seconds and budget_seconds > 0 else None
+        self.started_at = time.time()
+        self.expires_at = self.started_at + self.budget_seconds if self.budget_seconds else None
+        self.degradations: list[str] = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (infinite when there is none, never negative)."""
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """Whether at least this many seconds are left."""
+        return self.remaining() >= seconds
+
+    def timeout(self, reserve: float = 0) -> Optional[float]:
+        """
+        Timeout to pass to asyncio.wait_for for work that must finish in time.
+
+        Args:
+            reserve: Seconds to keep back for whatever runs after this work
+
+        Returns:
+            Optional[float]: Seconds until the deadline minus the reserve, or None if there is no deadline
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.remaining() - reserve)
+
+    def degrade(self, step: str, reason: str = None) -> None:
+        """Record that the request took a degradation step (each step is recorded once)."""
+        with self._lock:
+            if step in self.degradations:
+                return
+            self.degradations.append(step)
+        increment(f"degraded_{step}")
+        log_warning(f"Deadline degradation: {step}", reason or f"{self.remaining():.2f}s left")
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+_no_deadline = Deadline()
+
+
+def current_deadline() -> Deadline:
+    """Return the deadline of the request being processed (an unbounded one outside a request)."""
+    return _current_deadline.get() or _no_deadline
+
+
+def set_deadline(deadline: Deadline):
+    """Install deadline for the current context; returns a token for reset_deadline."""
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token) -> None:
+    """Restore the deadline that was current before the matching set_deadline call."""
+    try:
+        _current_deadline.reset(token)
+    except ValueError:
+        # An async generator finalized from another task runs in a different context
+        _current_deadline.set(None)
@@ -0,0 +1,188 @@
+from typing import Optional
+import re
+from models import ResponseValidation
+from nlp import STOPWORDS, cosine_similarity, embed_text, tokenize
+
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Minimum share of a sentence's content words found in one context chunk for it to count as supported
+SENTENCE_SUPPORT_THRESHOLD = 0.5
+
+# Sentences with fewer content words (greetings, "Any questions?") are not checked for support
+MIN_SENTENCE_WORDS = 4
+
+# Minimum share of the query's content words a response must address to be accepted locally
+QUERY_RELEVANCE_THRESHOLD = 0.5
+
+# Words that say how something is asked rather than what about; left out of query relevance
+QUESTION_WORDS = {
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how", "explain", "describe",
+    "define", "definition", "meaning", "mean", "means", "give", "show", "help", "know", "understand",
+}
+
+
+def _content_words(text: str) -> list[str]:
+    return [token for token in tokenize(text) if token not in STOPWORDS and len(token) > 2]
+
+
+def _stems(words) -> set[str]:
+    # A crude stem ("densities", "density" -> "densi") so inflections still match
+    return {word[:5] for word in words}
+
+
+def query_relevance(response: str, query: str) -> Optional[float]:
+    """
+    Share of the query's content words that the response addresses.
+
+    Args:
+        response: The generated response text
+        query: The user query the response should answer
+
+    Returns:
+        Optional[float]: Score in [0, 1], or None when the query has no content words
+            (e.g. "Why?") and relevance cannot be judged locally
+    """
+    query_words = [word for word in _content_words(query) if word not in QUESTION_WORDS]
+    if not query_words:
+        return None
+    response_stems = _stems(_content_words(response))
+    return sum(1 for stem in _stems(query_words) if stem in response_stems) / len(_stems(query_words))
+
+
+def score_grounding(
+    response: str, context: list[str], min_chars: int = 80, max_chars: int = 8000
+) -> tuple[float, dict]:
+    """
+    Score how well a response is grounded in the retrieved context, without an LLM.
+
+    Combines the share of the response's content words that occur in the context
+    (lexical overlap), the hashed-embedding similarity of response and context, and the
+    share of substantive response sentences supported by a single context chunk
+    (citation coverage). Responses that fail the length or format checks have their
+    score halved.
+
+    Args:
+        response: The generated response text
+        context: Context strings the response was generated from
+        min_chars: Minimum acceptable response length in characters
+        max_chars: Maximum acceptable response length in characters
+
+    Returns:
+        Tuple containing:
+            - Score in [0, 1]
+            - Dict with the individual signals, useful for logging and tuning
+    """
+    chunks = [chunk for chunk in context if chunk and chunk.strip()]
+    response_words = _content_words(response)
+    context_words = set(_content_words(" ".join(chunks)))
+
+    lexical = (
+        sum(1 for word in response_words if word in context_words) / len(response_words)
+        if response_words
+        else 0.0
+    )
+    embedding = max(0.0, cosine_similarity(embed_text(response), embed_text(" ".join(chunks))))
+
+    chunk_words = [set(_content_words(chunk)) for chunk in chunks]
+    sentences = [
+        words
+        for words in (_content_words(sentence) for sentence in _SENTENCE_RE.split(response))
+        if len(words) >= MIN_SENTENCE_WORDS
+    ]
+    supported = sum(
+        1
+        for words in sentences
+        if any(
+            sum(1 for word in words if word in chunk) / len(words) >= SENTENCE_SUPPORT_THRESHOLD
+            for chunk in chunk_words
+        )
+    )
+    # Short answers without substantive sentences fall back to plain lexical overlap
+    coverage = supported / len(sentences) if sentences else lexical
+
+    length_ok = min_chars <= len(response.strip()) <= max_chars
+    format_ok = not re.search(r'^\s*[{\[]|"response"\s*:', response)
+
+    score = 0.35 * lexical + 0.25 * embedding + 0.4 * coverage
+    if not (length_ok and format_ok):
+        score *= 0.5
+
+    signals = {
+        "lexical": round(lexical, 3),
+        "embedding": round(embedding, 3),
+        "coverage": round(coverage, 3),
+        "length_ok": length_ok,
+        "format_ok": format_ok,
+    }
+    return score, signals
+
+
+def local_verdict(
+    response: str,
+    context: list[str],
+    accept_threshold: float,
+    reject_threshold: float,
+    min_chars: int = 80,
+    max_chars: int = 8000,
+    query: Optional[str] = None,
+    accept: bool = True,
+) -> tuple[Optional[ResponseValidation], float, dict]:
+    """
+    Judge a response locally when its grounding score is decisive.
+
+    Grounding alone cannot tell whether a response answers the question: a paraphrase
+    of the context scores high either way. A high score is therefore only accepted when
+    the response also passes the length and format checks, has most of its statements
+    supported by the context, and addresses at least QUERY_RELEVANCE_THRESHOLD of the
+    query's content words; otherwise the LLM judge decides.
+
+    Args:
+        response: The generated response text
+        context: Context strings the response was generated from
+        accept_threshold: Scores at or above this are judged Optimal (when accept is set)
+        reject_threshold: Scores below this are judged Suboptimal
+        min_chars: Minimum acceptable response length in characters
+        max_chars: Maximum acceptable response length in characters
+        query: The user query, required for a local Optimal verdict
+        accept: Whether a high score may return Optimal without the judge (default: True)
+
+    Returns:
+        Tuple containing:
+            - ResponseValidation, or None when the score falls in the uncertain band
+              (or there is no context to check against) and the LLM judge should decide
+            - The grounding score
+            - The individual signals from score_grounding
+    """
+    if not any(chunk and chunk.strip() for chunk in context):
+        return None, 0.0, {}
+
+    score, signals = score_grounding(response, context, min_chars, max_chars)
+    relevance = query_relevance(response, query) if query else None
+    signals["relevance"] = None if relevance is None else round(relevance, 3)
+    if score >= accept_threshold:
+        if (
+            accept
+            and signals["length_ok"]
+            and signals["format_ok"]
+            and signals["coverage"] >= SENTENCE_SUPPORT_THRESHOLD
+            and relevance is not None
+            and relevance >= QUERY_RELEVANCE_THRESHOLD
+        ):
+            return ResponseValidation(quality="Optimal", reason="None", resolution="None"), score, signals
+        return None, score, signals
+    if score < reject_threshold:
+        problems = []
+        if not signals["length_ok"]:
+            problems.append(f"its length is outside {min_chars}-{max_chars} characters")
+        if not signals["format_ok"]:
+            problems.append("it contains raw JSON instead of plain text")
+        if signals["coverage"] < SENTENCE_SUPPORT_THRESHOLD:
+            problems.append("most of its statements are not supported by the provided context")
+        reason = "The response is poorly grounded: " + ("; ".join(problems) or "it shares little with the provided context") + "."
+        resolution = (
+            "Answer the user's query using the facts in the provided context, stay close to its "
+            "wording for key facts, and output only the response text."
+        )
+        return ResponseValidation(quality="Suboptimal", reason=reason, resolution=resolution), score, signals
+    return None, score, signals
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import hashlib
+import json
+import threading
+from utils import log_error, log_info
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+ROLE_LABELS = {"user": "User", "assistant": "Bot", "system": "Summary"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens in text (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def render_history(chat_history: list[dict], budget_tokens: Optional[int] = None) -> str:
+    """
+    Render chat history as compact "User: ..." / "Bot: ..." lines for a prompt.
+
+    Messages are taken newest first until the token budget is used up; the oldest
+    message that only partly fits is cut short, and everything older is dropped.
+
+    Args:
+        chat_history: List of conversation messages in dict format with 'role' and 'content' keys
+        budget_tokens: Approximate maximum size of the rendering, unlimited when None
+
+    Returns:
+        str: One line per message in chronological order ("None" for an empty history)
+    """
+    lines = []
+    remaining = budget_tokens
+    for message in reversed(chat_history):
+        role = message.get("role", "user")
+        content = " ".join(str(message.get("content", "")).split())
+        if role == "system" and content.startswith(SUMMARY_PREFIX):
+            content = content[len(SUMMARY_PREFIX):]
+        line = f"{ROLE_LABELS.get(role, role.capitalize())}: {content}"
+
+        if remaining is not None:
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                if remaining > 16:
+                    lines.append(line[: remaining * 4] + "...")
+                break
+            remaining -= cost
+        lines.append(line)
+
+    if not lines:
+        return "None"
+    return "\n".join(reversed(lines))
+
+
+class HistoryManager:
+    """
+    Keeps the prompt-side chat history bounded.
+
+    The last recent_turns messages are kept verbatim. Older messages are folded into a
+    rolling summary produced by summarize(previous_summary, new_messages). Summaries are
+    cached by a chained hash of the messages they cover, so each turn only folds in the
+    messages that fell out of the window since the last summary instead of re-summarizing
+    the whole conversation. Folding runs in a background thread: compact never waits for
+    the LLM and uses the most recent summary available, keeping not-yet-summarized
+    messages verbatim until the fold completes. With background off, compact folds before
+    returning, so the summary calls happen at a fixed point of every turn (as record and
+    replay of a cassette need).
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[Optional[str], list[dict]], str],
+        recent_turns: int = 10,
+        max_summaries: int = 10000,
+        background: bool = True,
+    ):
+        self.summarize = summarize
+        self.recent_turns = recent_turns
+        self.max_summaries = max_summaries
+        self.background = background
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+    def compact(self, chat_history: list[dict]) -> list[dict]:
+        """
+        Return a compacted copy of chat_history.
+
+        Args:
+            chat_history: Full list of previous conversation messages in dict format
+
+        Returns:
+            list[dict]: An optional summary message (role "system") followed by the messages
+                not covered by it, ending with the last recent_turns messages verbatim
+        """
+        if len(chat_history) <= self.recent_turns:
+            return list(chat_history)
+
+        split = len(chat_history) - self.recent_turns
+        older = chat_history[:split]
+        prefix_keys = self._prefix_keys(older)
+
+        covered, summary = 0, None
+        with self._lock:
+            for count in range(len(older), 0, -1):
+                cached = self._summaries.get(prefix_keys[count - 1])
+                if cached is not None:
+                    self._summaries.move_to_end(prefix_keys[count - 1])
+                    covered, summary = count, cached
+                    break
+
+            target_key = prefix_keys[-1]
+            fold = covered < len(older) and target_key not in self._pending
+            if fold:
+                self._pending.add(target_key)
+                if self.background:
+                    self._executor.submit(self._fold, target_key, summary, older[covered:])
+
+        if fold and not self.background:
+            self._fold(target_key, summary, older[covered:])
+            with self._lock:
+                folded = self._summaries.get(target_key)
+            if folded is not None:
+                covered, summary = len(older), folded
+
+        compacted = []
+        if summary is not None:
+            compacted.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+        compacted.extend(chat_history[covered:])
+        return compacted
+
+    def _fold(self, key: str, previous_summary: Optional[str], new_messages: list[dict]) -> None:
+        try:
+            summary = self.summarize(previous_summary, new_messages)
+            with self._lock:
+                self._summaries[key] = summary
+                self._summaries.move_to_end(key)
+                while len(self._summaries) > self.max_summaries:
+                    self._summaries.popitem(last=False)
+            log_info("Chat History Summary Updated", lambda: f"Folded {len(new_messages)} messages")
+        except Exception as e:
+            log_error("Chat history summarization failed", error=e)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    @staticmethod
+    def _prefix_keys(messages: list[dict]) -> list[str]:
+        keys = []
+        digest = b""
+        for message in messages:
+            canonical = json.dumps([message.get("role"), message.get("content")], default=str)
+            digest = hashlib.sha1(digest + canonical.encode("utf-8")).digest()
+            keys.append(digest.hex())
+        return keys
@@ -0,0 +1,179 @@
+from typing import Optional
+import json
+import math
+import os
+import threading
+from nlp import tokenize
+
+
+# Conversational filler that never needs an LLM to classify. A query made up only of these
+# words, with at least one of the "strong" ones, is Misc Mode.
+FILLER_TOKENS = {
+    "a", "alright", "awesome", "bot", "bye", "cheers", "cool", "cya", "evening", "got",
+    "good", "goodbye", "great", "hello", "hey", "hi", "hiya", "it", "later", "lot", "morning",
+    "much", "nice", "night", "ok", "okay", "perfect", "see", "so", "sounds", "sure", "thank",
+    "thanks", "there", "thx", "ty", "very", "you", "ya", "yo", "afternoon",
+}
+STRONG_FILLER_TOKENS = {
+    "awesome", "bye", "cheers", "cool", "cya", "goodbye", "great", "hello", "hey", "hi", "hiya",
+    "ok", "okay", "perfect", "thank", "thanks", "thx", "ty", "yo",
+}
+MAX_FILLER_TOKENS = 8
+
+
+class FastIntentClassifier:
+    """
+    Local intent classifier used in front of the LLM-based get_intent.
+
+    Combines keyword rules for conversational filler with a multinomial Naive Bayes
+    model trained from logged LLM classifications. Predictions come with a confidence
+    so the caller can fall back to the LLM when the local model is unsure.
+    """
+
+    def __init__(self):
+        self.class_counts: dict[str, int] = {}
+        self.token_counts: dict[str, dict[str, int]] = {}
+        self.vocabulary: set[str] = set()
+
+    @property
+    def is_trained(self) -> bool:
+        return bool(self.class_counts)
+
+    def train(self, examples: list[tuple[str, str]]) -> None:
+        """
+        Fit the Naive Bayes model on (query, intent) pairs, replacing any previous fit.
+
+        Args:
+            examples: Pairs of user query and the intent the LLM assigned to it
+        """
+        self.class_counts = {}
+        self.token_counts = {}
+        self.vocabulary = set()
+        for query, intent in examples:
+            self.class_counts[intent] = self.class_counts.get(intent, 0) + 1
+            counts = self.token_counts.setdefault(intent, {})
+            for token in tokenize(query):
+                counts[token] = counts.get(token, 0) + 1
+                self.vocabulary.add(token)
+
+    def predict(self, query: str) -> tuple[Optional[str], float]:
+        """
+        Classify a query locally.
+
+        Args:
+            query: The current user query
+
+        Returns:
+            Tuple of the predicted intent (None if no prediction can be made) and its confidence in [0, 1]
+        """
+        tokens = tokenize(query)
+        if (
+            tokens
+            and len(tokens) <= MAX_FILLER_TOKENS
+            and all(token in FILLER_TOKENS for token in tokens)
+            and any(token in STRONG_FILLER_TOKENS for token in tokens)
+        ):
+            return "Misc Mode", 1.0
+
+        if not self.is_trained or not tokens:
+            return None, 0.0
+
+        total_examples = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary) + 1
+        log_scores = {}
+        for intent, class_count in self.class_counts.items():
+            counts = self.token_counts.get(intent, {})
+            total_tokens = sum(counts.values())
+            score = math.log(class_count / total_examples)
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / (total_tokens + vocabulary_size))
+            log_scores[intent] = score
+
+        best_score = max(log_scores.values())
+        normalizer = sum(math.exp(score - best_score) for score in log_scores.values())
+        best_intent = max(log_scores, key=log_scores.get)
+        return best_intent, 1.0 / normalizer
+
+    def save(self, path: str) -> None:
+        """Write the trained model to a JSON file."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "class_counts": self.class_counts,
+                    "token_counts": self.token_counts,
+                    "vocabulary": sorted(self.vocabulary),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "FastIntentClassifier":
+        """Read a model written by save."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        classifier = cls()
+        classifier.class_counts = data["class_counts"]
+        classifier.token_counts = data["token_counts"]
+        classifier.vocabulary = set(data["vocabulary"])
+        return classifier
+
+
+def load_classification_log(path: str) -> list[tuple[str, str]]:
+    """
+    Read logged LLM intent classifications.
+
+    Args:
+        path: JSONL file with one {"query": ..., "intent": ...} object per line
+
+    Returns:
+        list[tuple[str, str]]: (query, intent) pairs suitable for FastIntentClassifier.train
+    """
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record["query"], record["intent"]))
+    return examples
+
+
+_log_lock = threading.Lock()
+
+
+def log_classification(path: str, query: str, intent: str, topic: Optional[str]) -> None:
+    """Append one LLM classification to the training log at path."""
+    line = json.dumps({"query": query, "intent": intent, "topic": topic})
+    with _log_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def train_from_log(log_path: str, model_path: str) -> FastIntentClassifier:
+    """Train a classifier from a classification log and save it to model_path."""
+    classifier = FastIntentClassifier()
+    classifier.train(load_classification_log(log_path))
+    classifier.save(model_path)
+    return classifier
+
+
+_default_classifier: Optional[FastIntentClassifier] = None
+
+
+def get_classifier(model_path: Optional[str] = None) -> FastIntentClassifier:
+    """
+    Return the process-wide classifier, loading the trained model on first use.
+
+    Args:
+        model_path: JSON model written by FastIntentClassifier.save. Without a model
+            (or if the file does not exist) only the keyword rules are used.
+
+    Returns:
+        FastIntentClassifier: The shared classifier instance
+    """
+    global _default_classifier
+    if _default_classifier is None:
+        if model_path and os.path.exists(model_path):
+            _default_classifier = FastIntentClassifier.load(model_path)
+        else:
+            _default_classifier = FastIntentClassifier()
+    return _default_classifier
@@ -0,0 +1,228 @@
+"""
+BM25 inverted index over the knowledge base, for lexical retrieval without embeddings.
+
+Context queries are short keyword phrases ("Singly Linked List"), which term matching
+handles well. The index is precomputed into a directory of flat files: a term
+dictionary, then document ids, term frequencies and document lengths as packed
+integer arrays memory-mapped on open, plus the documents themselves:
+
+    python lexical_index.py build kb_lexical docs.jsonl
+    python lexical_index.py search kb_lexical "Singly Linked List"
+
+docs.jsonl holds one {"text": ..., "metadata": {...}} object per line, the same
+format ann_index.py reads (and stores as docs.jsonl in its index directory).
+"""
+from collections import Counter
+from typing import Optional
+import argparse
+import json
+import math
+import mmap
+import os
+import sys
+import numpy as np
+from ann_index import load_documents
+from nlp import STOPWORDS, tokenize
+
+
+MANIFEST = "bm25.json"
+TERMS = "terms.json"
+POSTINGS = "postings.i32"
+FREQUENCIES = "frequencies.u16"
+LENGTHS = "lengths.u32"
+OFFSETS = "offsets.i64"
+DOCS = "docs.jsonl"
+
+
+def index_terms(text: str) -> list[str]:
+    """Tokens of text that are indexed and searched (stopwords removed)."""
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 index opened from a directory written by BM25Index.build.
+
+    Opening reads the manifest and term dictionary; postings, lengths and documents
+    are memory-mapped, so only the pages of the terms that are searched get read.
+    """
+
+    def __init__(self, path: str, top_k: int = 5):
+        """
+        Args:
+            path: Index directory
+            top_k: Default number of results per query
+        """
+        self.path = path
+        self.top_k = top_k
+        with open(self._file(MANIFEST), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(self._file(TERMS), encoding="utf-8") as f:
+            self.terms: dict[str, list[int]] = json.load(f)
+        self.count = self.manifest["count"]
+        self.k1 = self.manifest["k1"]
+        self.b = self.manifest["b"]
+        self.average_length = self.manifest["average_length"] or 1.0
+        postings = self.manifest["postings"]
+        self.postings = self._map(POSTINGS, np.int32, postings)
+        self.frequencies = self._map(FREQUENCIES, np.uint16, postings)
+        self.lengths = self._map(LENGTHS, np.uint32, self.count)
+        self.offsets = self._map(OFFSETS, np.int64, self.count)
+        with open(self._file(DOCS), "rb") as f:
+            self.docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _map(self, name: str, dtype: type, length: int) -> np.ndarray:
+        # An empty file cannot be memory-mapped (e.g. no postings for a corpus of stopwords)
+        if not length:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=(length,))
+
+    def scores(self, query: str) -> Optional[np.ndarray]:
+        """BM25 score of every document for query, or None if no query term is in the index."""
+        scores = None
+        for term in dict.fromkeys(index_terms(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            start, document_frequency = entry
+            ids = self.postings[start : start + document_frequency]
+            frequencies = self.frequencies[start : start + document_frequency].astype(np.float32)
+            idf = math.log(1 + (self.count - document_frequency + 0.5) / (document_frequency + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * self.lengths[ids] / self.average_length)
+            if scores is None:
+                scores = np.zeros(self.count, dtype=np.float32)
+            scores[ids] += idf * frequencies * (self.k1 + 1) / (frequencies + norms)
+        return scores
+
+    def search(self, query: str, top_k: Optional[int] = None) -> list[tuple[str, dict]]:
+        """
+        Find the documents that best match the terms of a query.
+
+        Args:
+            query: The context query to search for
+            top_k: Number of results (default: the index's top_k)
+
+        Returns:
+            list[tuple[str, dict]]: (text, metadata) tuples, best match first
+        """
+        scores = self.scores(query)
+        if scores is None:
+            return []
+        matched = np.flatnonzero(scores > 0)
+        k = min(top_k or self.top_k, len(matched))
+        if not k:
+            return []
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [self._document(int(i)) for i in best]
+
+    def _document(self, i: int) -> tuple[str, dict]:
+        start = int(self.offsets[i])
+        end = self.docs.find(b"\n", start)
+        record = json.loads(self.docs[start : end if end >= 0 else len(self.docs)])
+        return record["text"], record["metadata"]
+
+    @classmethod
+    def build(
+        cls, path: str, texts: list[str], metadatas: list[dict], k1: float = 1.2, b: float = 0.75, **kwargs
+    ) -> "BM25Index":
+        """
+        Write a new index for a set of documents.
+
+        Args:
+            path: New index directory
+            texts: Document texts
+            metadatas: Metadata dictionary of each document
+            k1: Term frequency saturation
+            b: Document length normalization
+            **kwargs: Passed to BM25Index
+
+        Returns:
+            BM25Index: The new index, opened for searching
+        """
+        if not texts:
+            raise ValueError("Cannot build an index without documents")
+        if len(texts) != len(metadatas):
+            raise ValueError(f"Got {len(texts)} texts but {len(metadatas)} metadata dictionaries")
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            raise FileExistsError(f"An index already exists at {path}")
+
+        postings_by_term: dict[str, list[tuple[int, int]]] = {}
+        lengths = np.zeros(len(texts), dtype=np.uint32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(index_terms(text))
+            lengths[doc_id] = sum(counts.values())
+            for term, frequency in counts.items():
+                postings_by_term.setdefault(term, []).append((doc_id, min(frequency, 65535)))
+
+        terms: dict[str, list[int]] = {}
+        postings = np.zeros(sum(len(items) for items in postings_by_term.values()), dtype=np.int32)
+        frequencies = np.zeros(len(postings), dtype=np.uint16)
+        start = 0
+        for term in sorted(postings_by_term):
+            items = postings_by_term[term]
+            terms[term] = [start, len(items)]
+            postings[start : start + len(items)] = [doc_id for doc_id, _ in items]
+            frequencies[start : start + len(items)] = [frequency for _, frequency in items]
+            start += len(items)
+
+        lines = [
+            (json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False) + "\n").encode("utf-8")
+            for text, metadata in zip(texts, metadatas)
+        ]
+        offsets = np.zeros(len(lines), dtype=np.int64)
+        offsets[1:] = np.cumsum([len(line) for line in lines])[:-1]
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, DOCS), "wb") as f:
+            f.write(b"".join(lines))
+        offsets.tofile(os.path.join(path, OFFSETS))
+        lengths.tofile(os.path.join(path, LENGTHS))
+        postings.tofile(os.path.join(path, POSTINGS))
+        frequencies.tofile(os.path.join(path, FREQUENCIES))
+        with open(os.path.join(path, TERMS), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False, separators=(",", ":"))
+        # Written last: an interrupted build leaves no index behind
+        with open(os.path.join(path, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "count": len(texts),
+                    "postings": len(postings),
+                    "average_length": float(lengths.mean()),
+                    "k1": k1,
+                    "b": b,
+                },
+                f,
+            )
+        return cls(path, **kwargs)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build and query a BM25 index of the knowledge base")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build a new index from a JSONL file of documents")
+    build.add_argument("path", help="New index directory")
+    build.add_argument("docs", help="JSONL file with one {\"text\", \"metadata\"} object per line")
+    build.add_argument("--k1", type=float, default=1.2, help="Term frequency saturation (default: 1.2)")
+    build.add_argument("--b", type=float, default=0.75, help="Document length normalization (default: 0.75)")
+    search = commands.add_parser("search", help="Print the documents best matching a query")
+    search.add_argument("path", help="Index directory")
+    search.add_argument("query", help="Context query")
+    search.add_argument("--top-k", type=int, default=5, help="Number of results (default: 5)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = BM25Index.build(args.path, *load_documents(args.docs), k1=args.k1, b=args.b)
+        print(f"Built {args.path}: {index.count} documents, {len(index.terms)} terms")
+    else:
+        index = BM25Index(args.path, top_k=args.top_k)
+        for text, metadata in index.search(args.query):
+            print(json.dumps(metadata, ensure_ascii=False), text[:200].replace("\n", " "))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+from collections import defaultdict, deque
+import math
+import re
+import threading
+
+
+# Latency samples kept per histogram; quantiles are computed over this sliding window
+HISTOGRAM_WINDOW = 4096
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_histograms: dict[tuple[str, tuple], "Histogram"] = {}
+
+
+class Histogram:
+    """Count, sum and a sliding window of recent samples for one metric/label set."""
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.count = 0
+        self.sum = 0.0
+        self.samples: deque = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float:
+        """Nearest-rank quantile of the sample window (0.0 when empty)."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Add value to the named process-wide counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def get_counter(name: str) -> float:
+    """Return the current value of the named counter (0 if it was never incremented)."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def hit_rate(prefix: str) -> dict:
+    """
+    Summarize a pair of '<prefix>_hits' / '<prefix>_misses' counters.
+
+    Args:
+        prefix: Common prefix of the hit and miss counters, e.g. "speculation"
+
+    Returns:
+        dict: Hits, misses and the hit rate (0.0 when nothing has been recorded yet)
+    """
+    with _lock:
+        hits = _counters.get(f"{prefix}_hits", 0)
+        misses = _counters.get(f"{prefix}_misses", 0)
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+def observe(name: str, value: float, labels: dict = None) -> None:
+    """Record one sample (e.g. a duration in seconds) in the named histogram."""
+    key = (name, tuple(sorted((labels or {}).items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def quantiles(name: str, labels: dict = None) -> dict:
+    """
+    Summarize one histogram.
+
+    Args:
+        name: Histogram name, e.g. "span_duration_seconds"
+        labels: Label set the samples were recorded with, e.g. {"span": "intent"}
+
+    Returns:
+        dict: Sample count, sum and the p50/p95/p99 of the recent sample window
+    """
+    key = (name, tuple(sorted((labels or {}).items())))
+    with _lock:
+        histogram = _histograms.get(key) or Histogram()
+        summary = {"count": histogram.count, "sum": histogram.sum}
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}"] = histogram.quantile(q)
+    return summary
+
+
+def histogram_snapshot() -> dict[str, dict]:
+    """Return quantiles() for every histogram, keyed by name{label="value",...}."""
+    with _lock:
+        keys = list(_histograms)
+    return {
+        f"{name}{_format_labels(dict(labels))}": quantiles(name, dict(labels))
+        for name, labels in keys
+    }
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{_metric_name(key)}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def prometheus_text() -> str:
+    """
+    Render all counters and histograms in the Prometheus text exposition format.
+
+    Counters are exported as counters with a _total suffix. Histograms are exported as
+    summaries: p50/p95/p99 quantiles of the recent sample window, plus _sum and _count.
+
+    Returns:
+        str: Exposition text, suitable for serving from a /metrics endpoint
+    """
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+        for name, value in counters:
+            metric = _metric_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        typed = set()
+        for (name, labels), histogram in histograms:
+            metric = _metric_name(name)
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            labels = dict(labels)
+            for q in QUANTILES:
+                lines.append(f"{metric}{_format_labels({**labels, 'quantile': q})} {histogram.quantile(q)}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict[str, float]:
+    """Return a copy of all counters."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    """Clear all counters and histograms."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
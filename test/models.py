@@ -21,5 +21,45 @@ class ResponseValidation(BaseModel):
     resolution: str
 
 
+class ResponseRanking(ResponseValidation):
+    best: int
+
+
 class Response(BaseModel):
     response: str
+
+
+class HistorySummary(BaseModel):
+    summary: str
+
+
+class StreamChunk(BaseModel):
+    delta: str = ""
+    done: bool = False
+    response: Optional[str] = None
+    metadata: Optional[list[dict]] = None
+    validation: Optional[ResponseValidation] = None
+
+
+class PackedIntent(Intent):
+    id: int
+
+
+class PackedIntents(BaseModel):
+    results: list[PackedIntent]
+
+
+class PackedContextQueries(ContextQueries):
+    id: int
+
+
+class PackedContextQueriesList(BaseModel):
+    results: list[PackedContextQueries]
+
+
+class BatchResult(BaseModel):
+    query: str
+    response: Optional[str] = None
+    metadata: Optional[list[dict]] = None
+    intent: Optional[str] = None
+    error: Optional[str] = None
@@ -0,0 +1,99 @@
+import hashlib
+import math
+import re
+import zlib
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Function words that carry little meaning for similarity ("the formula of density" vs
+# "formula for density"). Question words are kept since they change what is being asked.
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "could", "do", "does", "for",
+    "from", "i", "in", "is", "it", "me", "my", "of", "on", "or", "please", "s", "tell",
+    "that", "the", "this", "to", "was", "were", "with", "would", "you",
+}
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text and collapse punctuation and whitespace into single spaces."""
+    return " ".join(tokenize(text))
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase alphanumeric tokens."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def content_words(text: str) -> frozenset[str]:
+    """Set of the non-stopword tokens of text."""
+    return frozenset(token for token in tokenize(text) if token not in STOPWORDS)
+
+
+def embed_text(text: str, dimensions: int = 256) -> list[float]:
+    """
+    Embed text as an L2-normalized hashed bag of content words.
+
+    A cheap local stand-in for a neural embedding: no model or network call, stable
+    across processes (crc32 rather than the salted built-in hash), and good enough to
+    match paraphrases that share most of their content words.
+
+    Args:
+        text: Text to embed
+        dimensions: Size of the output vector (default: 256)
+
+    Returns:
+        list[float]: Unit-length vector (all zeros for text without tokens)
+    """
+    vector = [0.0] * dimensions
+    for token in tokenize(text):
+        if token in STOPWORDS:
+            continue
+        digest = zlib.crc32(token.encode("utf-8"))
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        vector[digest % dimensions] += sign
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm:
+        vector = [value / norm for value in vector]
+    return vector
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    """Cosine similarity of two vectors (0.0 if either is all zeros)."""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def content_hash(text: str) -> str:
+    """Hash of the normalized text, equal for passages differing only in case, punctuation or spacing."""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def simhash(text: str, bits: int = 64) -> int:
+    """
+    Locality-sensitive fingerprint of the content words and word pairs of text.
+
+    Texts sharing most of their wording get fingerprints differing in few bits, so the
+    Hamming distance of two fingerprints estimates how different the texts are.
+
+    Args:
+        text: Text to fingerprint
+        bits: Size of the fingerprint, at most 64
+
+    Returns:
+        int: The fingerprint
+    """
+    tokens = [token for token in tokenize(text) if token not in STOPWORDS]
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    weights = [0] * bits
+    for feature in features:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if digest >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def simhash_similarity(a: int, b: int, bits: int = 64) -> float:
+    """Share of equal bits in two simhash fingerprints (1.0 for identical ones)."""
+    return 1.0 - bin(a ^ b).count("1") / bits
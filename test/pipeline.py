@@ -1,126 +1,337 @@
 from client import LLMClient
-from typing import Optional
-from utils import clean_response, call_with_retry, log_info, log_success, log_warning, log_error, log_debug, log_step, log_timing, log_pipeline_start, log_pipeline_end
+from typing import AsyncIterator, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+from utils import JSONStringFieldDecoder, clean_response, iterate_sync, parse_model, run_sync, log_info, log_success, log_warning, log_error, log_debug, log_step, log_timing, log_pipeline_start, log_pipeline_end
+import asyncio
+import functools
+import inspect
+import random
 import time
-from rag import semantic_search
-from models import Intent, ContextQueries, ContextSummary, Response, ResponseValidation
+from config import (
+    BATCH_CONCURRENCY,
+    CACHEABLE_INTENTS,
+    CASSETTE_MODE,
+    CASSETTE_PATH,
+    CASSETTE_REPLAY_LATENCY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    CONTEXT_PACK_DIVERSITY,
+    CONTEXT_PACKING_ENABLED,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOKEN_BUDGETS,
+    DEADLINE_DIRECT_RESERVE_SECONDS,
+    DEADLINE_REFINE_MIN_SECONDS,
+    DEADLINE_RETRIEVAL_MIN_SECONDS,
+    DEADLINE_VALIDATE_MIN_SECONDS,
+    FAST_INTENT_ENABLED,
+    FAST_INTENT_MODES,
+    FAST_INTENT_THRESHOLD,
+    GROUNDING_ACCEPT_THRESHOLD,
+    GROUNDING_AUDIT_RATE,
+    GROUNDING_CHECK_ENABLED,
+    GROUNDING_LOCAL_ACCEPT,
+    GROUNDING_MAX_CHARS,
+    GROUNDING_MIN_CHARS,
+    GROUNDING_REJECT_THRESHOLD,
+    HISTORY_RECENT_TURNS,
+    HISTORY_SUMMARY_CACHE_SIZE,
+    INTENT_LOG_PATH,
+    INTENT_MODEL_PATH,
+    LLM_CHAT_THREADS,
+    LLM_STRUCTURED_OUTPUT,
+    PIPELINE_DEADLINE_SECONDS,
+    RESPONSE_CANDIDATE_TEMPERATURES,
+    RESPONSE_CANDIDATES,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_HISTORY_TURNS,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_THRESHOLD,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_WORD_OVERLAP,
+    RETRY_BASE_DELAY,
+    RETRY_BUDGET_MAX_TOKENS,
+    RETRY_BUDGET_RATIO,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+    RETRY_MAX_PARSE_RETRIES,
+    SEARCH_CONCURRENCY,
+    SPECULATIVE_RETRIEVAL,
+    STREAM_VALIDATE,
+    SUMMARIZE_CONTEXT,
+    SUMMARY_MIN_CHARS,
+)
+from intent_classifier import get_classifier, log_classification
+from response_cache import ResponseCache
+from retrieval import retrieve_many
+from context_packing import context_budget, pack_context
+from cassette import open_cassette
+import retrieval
+from retry import RetryBudget, RetryPolicy
+from tracing import span
+from deadline import SKIP_REFINEMENT, SKIP_RETRIEVAL, SKIP_VALIDATION, TRUNCATE_RESPONSE, Deadline, DeadlineExceeded, current_deadline, reset_deadline, set_deadline
+from metrics import increment, hit_rate
+from grounding import local_verdict
+from history import HistoryManager
+from pydantic import BaseModel
+from models import Intent, ContextQueries, ContextSummary, HistorySummary, Response, ResponseRanking, ResponseValidation, StreamChunk
+from prompts import (
+    context_queries_messages,
+    context_summary_messages,
+    direct_response_messages,
+    history_summary_messages,
+    intent_messages,
+    ranking_messages,
+    record_prompt_usage,
+    response_messages,
+    validation_messages,
+)
 
 llm_client = LLMClient()
+cassette = open_cassette(CASSETTE_MODE, CASSETTE_PATH, CASSETTE_REPLAY_LATENCY)
+if cassette is not None:
+    llm_client = cassette.wrap_client(llm_client)
+    retrieval.semantic_search = cassette.wrap_search(retrieval.semantic_search)
+    # The cassette records single-query searches only
+    retrieval.semantic_search_batch = None
+response_cache = ResponseCache(
+    similarity_threshold=RESPONSE_CACHE_THRESHOLD,
+    min_word_overlap=RESPONSE_CACHE_WORD_OVERLAP,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=RESPONSE_CACHE_TTL,
+    history_turns=RESPONSE_CACHE_HISTORY_TURNS,
+)
+retry_policy = RetryPolicy(
+    max_attempts=RETRY_MAX_ATTEMPTS,
+    base_delay=RETRY_BASE_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    max_parse_retries=RETRY_MAX_PARSE_RETRIES,
+    budget=RetryBudget(ratio=RETRY_BUDGET_RATIO, max_tokens=RETRY_BUDGET_MAX_TOKENS),
+    breaker_failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    breaker_reset_timeout=CIRCUIT_RESET_TIMEOUT,
+    # Randomness would make replayed turns diverge from the recorded ones
+    jitter=cassette is None,
+)
+# Share of locally judged responses audited by the LLM judge; no random audits under a cassette,
+# where an audit call that was not recorded would miss
+grounding_audit_rate = GROUNDING_AUDIT_RATE if cassette is None else 0.0
+# Blocking chat calls run here rather than in the loop's default executor, which asyncio.run
+# waits for on exit: a call abandoned at the deadline must not hold up the sync wrappers.
+chat_executor = ThreadPoolExecutor(
+    max_workers=max(LLM_CHAT_THREADS, BATCH_CONCURRENCY, SEARCH_CONCURRENCY, RESPONSE_CANDIDATES),
+    thread_name_prefix="llm-chat",
+)
+
+
+def accepts_argument(method, name: str) -> bool:
+    """Whether a client method declares a parameter, so it can be passed without a TypeError."""
+    try:
+        return name in inspect.signature(method).parameters
+    except (TypeError, ValueError):
+        return False
 
 
-def get_intent(query: str, chat_history: list[dict] = []) -> Intent:
+def response_format(schema: Optional[type[BaseModel]], method) -> Optional[dict]:
     """
-    Analyze user query and chat history to determine intent and topic for educational chatbot.
-
-    Classifies user intent into one of five categories: Learning Mode, Revision Mode,
-    Cheatsheet Mode, Normal Mode, or Misc Mode. Also extracts the main conversation topic.
+    The response_format argument constraining a chat call to a stage's JSON output.
 
     Args:
-        query: The current user query to analyze
-        chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
-        max_retries: Maximum number of retry attempts for LLM calls (default: 3)
-        delay: Delay between retry attempts in seconds (default: 1)
+        schema: Pydantic model the stage parses the output into
+        method: The client method that will be called
 
     Returns:
-        Intent: Object containing classified intent and extracted topic
+        Optional[dict]: JSON-mode or JSON-schema response_format, or None to send none
     """
-    log_step("Intent Classification", f"Analyzing query with {len(chat_history)} chat history items")
-    start_time = time.time()
-    
-    prompt = f"""You are an expert Intent & Topic Classifier for an educational chatbot. Your job is to analyze the user's query and the last 10 turns of chat history to determine the user's intent and the main topic of conversation.
-
-You must classify the intent into one of the following categories: **["Learning Mode", "Revision Mode", "Cheatsheet Mode", "Normal Mode", "Misc Mode"]**.
-
-  * **Learning Mode**: Use for foundational questions, requests for definitions, or "what is" / "how does" style questions where the user is learning a topic for the first time.
-  * **Revision Mode**: Use when the user asks complex or layered questions, multiple-choice questions (MCQs), or quizzes to test their knowledge.
-  * **Cheatsheet Mode**: Use when the user asks for a summary, a direct "cheatsheet", a list of important points, or key formulas.
-  * **Normal Mode**: Use for normal questions related to the topic, whose answers are however present in the chat history. This can be used for any question which simply asks for clarification on a topic or concept already discussed.
-  * **Misc Mode**: Use for greetings, goodbyes, thank yous, or any other conversational filler that does not require retrieving educational material.
-
-You must also extract the core **"Topic"** from the chat history.
-
-Analyze the following input and provide your output in a JSON format with two keys: "intent" and "topic".
-
------
+    mode = LLM_STRUCTURED_OUTPUT
+    if schema is None or mode == "off":
+        return None
+    if mode == "auto":
+        if not accepts_argument(method, "response_format"):
+            return None
+        mode = "schema"
+    if mode == "json":
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema()},
+    }
+
+
+async def chat_async(
+    messages: list[dict],
+    stage: Optional[str] = None,
+    schema: Optional[type[BaseModel]] = None,
+    temperature: Optional[float] = None,
+) -> dict:
+    """
+    Send a chat completion request without blocking the event loop.
 
-**Example 1:**
+    Uses the client's native coroutine (``achat``) when it provides one, otherwise runs
+    the blocking ``chat`` call in a dedicated thread pool. When a stage is
+    given, the response's token usage is recorded for prompt-cache reporting. When a
+    schema is given, the output is constrained to it where the provider supports
+    structured output (see LLM_STRUCTURED_OUTPUT). A temperature is only passed to
+    clients whose chat method takes one.
 
-**Chat History:**
-`User: "Hey, can you help me study for my CS exam?"`
-`Bot: "Of course! What topic are you focusing on today?"`
-`User: "Let's start with data structures. Can you tell me about linked lists?"`
-`Bot: "A linked list is a linear data structure..."`
+    The call is bounded by the current request's deadline; a blocking call that is
+    abandoned this way finishes in its worker thread but its result is discarded.
 
-**User Query:**
-`"How do you traverse a singly linked list?"`
+    Args:
+        messages: List of chat messages in dict format with 'role' and 'content' keys
+        stage: Optional pipeline stage name used to attribute token usage
+        schema: Optional pydantic model the response content will be parsed into
+        temperature: Optional sampling temperature
 
-**Output:**
+    Returns:
+        dict: The raw API response, in the same shape as ``llm_client.chat``
 
-json
-{{
-  "intent": "Learning Mode",
-  "topic": "Linked Lists"
-}}
+    Raises:
+        DeadlineExceeded: If the request's deadline passes before the response arrives
+    """
+    deadline = current_deadline()
+    if deadline.expired():
+        raise DeadlineExceeded(f"No time left for the {stage or 'chat'} call")
+
+    with span("llm.chat", stage=stage or "", messages=len(messages)) as call_span:
+        achat = getattr(llm_client, "achat", None)
+        method = achat or llm_client.chat
+        output_format = response_format(schema, method)
+        kwargs = {"response_format": output_format} if output_format is not None else {}
+        if temperature is not None and accepts_argument(method, "temperature"):
+            kwargs["temperature"] = temperature
+        if achat is not None:
+            call = achat(messages, **kwargs)
+        else:
+            call = asyncio.get_running_loop().run_in_executor(
+                chat_executor, functools.partial(llm_client.chat, messages, **kwargs)
+            )
+        try:
+            response = await asyncio.wait_for(call, deadline.timeout())
+        except asyncio.TimeoutError as e:
+            if deadline.expired():
+                raise DeadlineExceeded(f"Deadline passed during the {stage or 'chat'} call") from e
+            raise
 
+        usage = response.get("usage") or {}
+        call_span.set_attributes(
+            prompt_tokens=usage.get("prompt_tokens", usage.get("input_tokens", 0)),
+            completion_tokens=usage.get("completion_tokens", usage.get("output_tokens", 0)),
+        )
+    if stage is not None:
+        record_prompt_usage(stage, response)
+    return response
 
------
 
-**Example 2:**
+def fold_history_summary(previous_summary: Optional[str], messages: list[dict]) -> str:
+    """
+    Fold older chat history messages into the rolling conversation summary.
 
-**Chat History:**
-`User: "Can you explain the concept of photosynthesis?"`
-`Bot: "Photosynthesis is the process used by plants, algae, and certain bacteria to harness energy from sunlight..."`
+    Called by the history manager from a background thread, so it uses the blocking
+    client and retry helpers.
 
+    Args:
+        previous_summary: Summary of the messages before these ones, or None for the first fold
+        messages: Messages that fell out of the verbatim history window
 
-**User Query:**
-`"Awesome, thanks so much!"`
+    Returns:
+        str: The updated summary
+    """
+    summary_messages = history_summary_messages(previous_summary, messages)
 
-**Output:**
+    def call_llm():
+        response = llm_client.chat(summary_messages)
+        record_prompt_usage("history_summary", response)
+        return clean_response(response, HistorySummary)
 
-json
-{{
-  "intent": "Misc Mode",
-  "topic": "Photosynthesis"
-}}
+    with span("history_summary", messages=len(messages)):
+        return retry_policy.call(call_llm, endpoint="llm").summary
 
 
------
+history_manager = HistoryManager(
+    fold_history_summary,
+    recent_turns=HISTORY_RECENT_TURNS,
+    max_summaries=HISTORY_SUMMARY_CACHE_SIZE,
+    # Summary calls recorded at a fixed point of the turn, not whenever a thread gets to them
+    background=cassette is None,
+)
 
-**Your Task:**
 
-**Analyze the following input:**
+async def get_intent_async(
+    query: str, chat_history: list[dict] = [], use_fast_path: bool = FAST_INTENT_ENABLED
+) -> Intent:
+    """
+    Analyze user query and chat history to determine intent and topic for educational chatbot.
 
-**Chat History:**
-{chat_history}
+    Classifies user intent into one of five categories: Learning Mode, Revision Mode,
+    Cheatsheet Mode, Normal Mode, or Misc Mode. Also extracts the main conversation topic.
 
-**User Query:**
-{query}
+    When the fast path is enabled, a local classifier is tried first. If it is at least
+    FAST_INTENT_THRESHOLD confident in one of FAST_INTENT_MODES, its intent is returned
+    (without a topic) and the LLM call is skipped. Usage is counted in the
+    "intent_fast_path_hits" / "intent_fast_path_misses" metrics.
 
-**Output:**
-"""
+    Args:
+        query: The current user query to analyze
+        chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
+        use_fast_path: Whether to try the local classifier before the LLM (default: FAST_INTENT_ENABLED)
+        max_retries: Maximum number of retry attempts for LLM calls (default: 3)
+        delay: Delay between retry attempts in seconds (default: 1)
 
-    messages = [{"role": "user", "content": prompt}]
+    Returns:
+        Intent: Object containing classified intent and extracted topic
+    """
+    log_step("Intent Classification", lambda: f"Analyzing query with {len(chat_history)} chat history items")
+    with span("intent", label="Intent Classification", history_items=len(chat_history)) as stage_span:
+        if use_fast_path:
+            fast_intent, confidence = get_classifier(INTENT_MODEL_PATH).predict(query)
+            if fast_intent in FAST_INTENT_MODES and confidence >= FAST_INTENT_THRESHOLD:
+                increment("intent_fast_path_hits")
+                intent = Intent(intent=fast_intent)
+                stage_span.set_attributes(fast_path=True, intent=intent.intent)
+                log_success("Intent Classification Complete (fast path)", lambda: f"Intent: {intent.intent}, Confidence: {confidence:.2f}")
+                return intent
+            increment("intent_fast_path_misses")
+
+        messages = intent_messages(query, chat_history)
+
+        async def call_llm():
+            try:
+                return clean_response(await chat_async(messages, "intent", Intent), Intent)
+            except Exception as e:
+                log_error("Intent classification failed", error=e)
+                raise
 
-    def call_llm():
         try:
-            response = clean_response(llm_client.chat(messages))
-            return Intent(**response)
+            intent = await retry_policy.acall(call_llm, endpoint="llm")
+            stage_span.set_attributes(fast_path=False, intent=intent.intent)
+            if INTENT_LOG_PATH:
+                log_classification(INTENT_LOG_PATH, query, intent.intent, intent.topic)
+            log_success("Intent Classification Complete", lambda: f"Intent: {intent.intent}, Topic: {intent.topic}")
+            return intent
         except Exception as e:
-            log_error("Intent classification failed", error=e)
+            log_error("Intent classification failed after retries", error=e)
             raise
 
-    try:
-        intent = call_with_retry(call_llm)
-        duration = time.time() - start_time
-        log_success("Intent Classification Complete", f"Intent: {intent.intent}, Topic: {intent.topic}")
-        log_timing("Intent Classification", duration)
-        return intent
-    except Exception as e:
-        log_error("Intent classification failed after retries", error=e)
-        raise
 
+def get_intent(
+    query: str, chat_history: list[dict] = [], use_fast_path: bool = FAST_INTENT_ENABLED
+) -> Intent:
+    """
+    Synchronous wrapper around get_intent_async.
 
-def get_context_queries(
+    Args:
+        query: The current user query to analyze
+        chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
+        use_fast_path: Whether to try the local classifier before the LLM (default: FAST_INTENT_ENABLED)
+
+    Returns:
+        Intent: Object containing classified intent and extracted topic
+    """
+    return run_sync(get_intent_async(query, chat_history, use_fast_path))
+
+
+async def get_context_queries_async(
     query: str, chat_history: list[dict], topic: str
 ) -> ContextQueries:
     """
@@ -137,74 +348,89 @@ def get_context_queries(
     Returns:
         ContextQueries: Object containing list of generated context queries
     """
-    log_step("Context Query Generation", f"Generating queries for topic: {topic}")
-    start_time = time.time()
-    
-    prompt = f"""You are an expert Context Query Generator for an educational chatbot. Your job is to analyze the user's query, the last 10 turns of chat history and the topic of conversation to determine the 1 to 3 most relevant queries to retrieve context from the knowledge base.
-
-    Each query should be a single topic or phrase that is relevant to the topic of conversation and whose answers or context is not present in the chat history.
-    Do not take your own knowledge into account, only the chat history and the user's query.
-
-    The generated queries should be unique and should not overlap with each other. The queries should be specific to the topic of conversation and should not be too broad. In maximum cases, only 1 query should be generated, unless the user's query is very broad.
-
-    Your output should be a JSON with a single key "queries" which is a list of strings.
-
-    **Example 1:**
-
-    **Chat History:**
-    `User: "Hey, can you help me study for my CS exam?"`
-    `Bot: "Of course! What topic are you focusing on today?"`
-
-    **User Query:**
-    `"How do you traverse a singly linked list?"`
-
-    **Topic:**
-    `"Linked Lists"`
+    log_step("Context Query Generation", lambda: f"Generating queries for topic: {topic}")
+    with span("context_queries", label="Context Query Generation") as stage_span:
+        messages = context_queries_messages(query, chat_history, topic)
+
+        async def call_llm():
+            try:
+                return clean_response(await chat_async(messages, "context_queries", ContextQueries), ContextQueries)
+            except Exception as e:
+                log_error("Context query generation failed", error=e)
+                raise
 
-    **Output:**
+        try:
+            context_queries = await retry_policy.acall(call_llm, endpoint="llm")
+            stage_span.set_attribute("queries", len(context_queries.queries))
+            log_success("Context Query Generation Complete", lambda: f"Generated {len(context_queries.queries)} queries")
+            log_info("Generated Context Queries", lambda: f"Queries: {', '.join(context_queries.queries)}")
+            return context_queries
+        except Exception as e:
+            log_error("Context query generation failed after retries", error=e)
+            raise
 
-json
-{{
-  "queries": ["Singly Linked List", "Linked List Traversal"]
-}}
 
+def get_context_queries(
+    query: str, chat_history: list[dict], topic: str
+) -> ContextQueries:
+    """
+    Synchronous wrapper around get_context_queries_async.
 
------
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation extracted from intent classification
 
+    Returns:
+        ContextQueries: Object containing list of generated context queries
+    """
+    return run_sync(get_context_queries_async(query, chat_history, topic))
 
-**Chat History:**
-{chat_history}
 
-**User Query:**
-{query}
+async def summarize_context_async(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context_query: str,
+    context: list[tuple[str, dict]],
+) -> ContextSummary:
+    """
+    Summarize retrieved context to extract only relevant information for the current conversation.
 
-**Topic:**
-{topic}
+    Analyzes the fetched context and filters out irrelevant information, focusing only on
+    facts and explanations that directly address the user's needs based on query and chat history.
 
-**Output:**
-"""
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        context_query: The specific query used to retrieve this context
+        context: List of tuples containing retrieved context text and metadata
 
-    messages = [{"role": "user", "content": prompt}]
+    Returns:
+        ContextSummary: Object containing summarized relevant information from the context
+    """
+    log_step("Context Summarization", lambda: f"Summarizing {len(context)} items for query: {context_query}")
+    with span("context_summary", label="Context Summarization", items=len(context)) as stage_span:
+        messages = context_summary_messages(query, chat_history, topic, context_query, context)
+
+        async def call_llm():
+            try:
+                return clean_response(await chat_async(messages, "context_summary", ContextSummary), ContextSummary)
+            except Exception as e:
+                log_error("Context summarization failed", f"Query: {context_query}", error=e)
+                raise
 
-    def call_llm():
         try:
-            response = clean_response(llm_client.chat(messages))
-            return ContextQueries(**response)
+            context_summary = await retry_policy.acall(call_llm, endpoint="llm")
+            summary_length = len(context_summary.summary)
+            stage_span.set_attribute("summary_chars", summary_length)
+            log_success("Context Summarization Complete", lambda: f"Summary length: {summary_length} chars for query: {context_query}")
+            return context_summary
         except Exception as e:
-            log_error("Context query generation failed", error=e)
+            log_error("Context summarization failed after retries", f"Query: {context_query}", error=e)
             raise
 
-    try:
-        context_queries = call_with_retry(call_llm)
-        duration = time.time() - start_time
-        log_success("Context Query Generation Complete", f"Generated {len(context_queries.queries)} queries")
-        log_info("Generated Context Queries", f"Queries: {', '.join(context_queries.queries)}")
-        log_timing("Context Query Generation", duration)
-        return context_queries
-    except Exception as e:
-        log_error("Context query generation failed after retries", error=e)
-        raise
-
 
 def summarize_context(
     query: str,
@@ -214,10 +440,7 @@ def summarize_context(
     context: list[tuple[str, dict]],
 ) -> ContextSummary:
     """
-    Summarize retrieved context to extract only relevant information for the current conversation.
-
-    Analyzes the fetched context and filters out irrelevant information, focusing only on
-    facts and explanations that directly address the user's needs based on query and chat history.
+    Synchronous wrapper around summarize_context_async.
 
     Args:
         query: The current user query
@@ -229,132 +452,163 @@ def summarize_context(
     Returns:
         ContextSummary: Object containing summarized relevant information from the context
     """
-    log_step("Context Summarization", f"Summarizing {len(context)} items for query: {context_query}")
-    start_time = time.time()
-    
-    prompt = f"""You are an expert Context Summarizer for an educational chatbot. Your job is to analyze the user's query, the last 10 turns of chat history, and the topic of conversation to extract and summarize only the most relevant information from the context retrieved from the knowledge base.
-
-    **Important Instructions:**
-    - Do NOT summarize or repeat the user query or the chat history.
-    - Use the user query and chat history only as background to understand what information is relevant to the current conversation.
-    - Focus solely on the fetched context: extract the key facts, explanations, or data that directly address the user's needs, as inferred from the query and chat history.
-    - Filter out any irrelevant, redundant, or generic information (noise) that is not useful for the current conversation.
-    - Your summary should be concise, focused, and should not include any information already present in the chat history or user query.
-
-    Your output should be a JSON with a single key \"summary\" which is a string, in the following format:
-
-    json
-    {{
-        \"summary\": \"<summary of the relevant information from the fetched context>\"
-    }}
-    
-
-    **User Query:**
-    {query}
+    return run_sync(
+        summarize_context_async(query, chat_history, topic, context_query, context)
+    )
 
-    **Chat History:**
-    {chat_history}
 
-    **Topic:**
-    {topic}
+async def get_context_async(
+    context_queries: list[str],
+    chat_history: list[dict],
+    topic: str,
+    query: str,
+    max_concurrency: int = SEARCH_CONCURRENCY,
+    summarize: bool = SUMMARIZE_CONTEXT,
+    summary_min_chars: int = SUMMARY_MIN_CHARS,
+    pack: bool = CONTEXT_PACKING_ENABLED,
+) -> tuple[list[str], list[dict]]:
+    """
+    Retrieve and process context information from knowledge base using multiple queries.
 
-    **Context Query:**
-    {context_query}
+    Searches the knowledge base for all context queries with one multi-query search
+    (a single batched embedding and index probe when the knowledge base supports it,
+    otherwise at most max_concurrency concurrent searches), then merges the results in
+    query order, dropping chunks with repeated metadata and exact or near-duplicate text,
+    so the output does not depend on which search finishes first.
+    When summarization is enabled, the new results of every context query are summarized
+    concurrently; results shorter than summary_min_chars are passed through unchanged.
+    When packing is enabled, the summaries and chunks are then ordered by relevance and
+    diversity, trimmed to the model's context token budget and tagged with their
+    sources ("[S2] ..." cites metadata[1]).
 
-    **Fetched Context to be summarized:**
-    {context}
+    Args:
+        context_queries: List of queries to search the knowledge base
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        query: The original user query
+        max_concurrency: Maximum number of single-query searches in flight when batched search is unavailable (default: SEARCH_CONCURRENCY)
+        summarize: Whether to summarize the retrieved context (default: SUMMARIZE_CONTEXT)
+        summary_min_chars: Minimum size in characters of a query's results before they are summarized
+        pack: Whether to pack the context into the model's token budget (default: CONTEXT_PACKING_ENABLED)
 
-    **Output:**
+    Returns:
+        Tuple containing:
+            - List of summarized context strings
+            - List of unique metadata dictionaries from retrieved documents
     """
+    log_step("Context Retrieval", lambda: f"Processing {len(context_queries)} context queries")
+    with span("context_retrieval", label="Context Retrieval", queries=len(context_queries)) as stage_span:
+        for i, context_query in enumerate(context_queries, 1):
+            log_info(lambda: f"Context Query {i}/{len(context_queries)}", lambda: f"Searching for: {context_query}")
+        search_start = time.time()
+        search_results, query_items, metadata = await asyncio.to_thread(
+            retrieve_many, context_queries, max_concurrency=max_concurrency
+        )
+        search_duration = time.time() - search_start
+
+        failed_queries = set()
+        for i, (context_query, result) in enumerate(zip(context_queries, search_results)):
+            if isinstance(result, BaseException):
+                log_error(f"Context retrieval failed for query: {context_query}", error=result)
+                failed_queries.add(i)
+        log_success(
+            "Semantic Search Complete",
+            lambda: f"Found {sum(len(r) for r in search_results if not isinstance(r, BaseException))} results "
+            f"for {len(context_queries)} queries in {search_duration:.2f}s",
+        )
 
-    messages = [{"role": "user", "content": prompt}]
+        to_summarize = [
+            i
+            for i, items in enumerate(query_items)
+            if summarize and items and sum(len(text) for text, _ in items) >= summary_min_chars
+        ]
+        if to_summarize:
+            log_info("Context Summarization", lambda: f"Summarizing results of {len(to_summarize)}/{len(context_queries)} queries concurrently")
+        summaries = await asyncio.gather(
+            *(
+                summarize_context_async(query, chat_history, topic, context_queries[i], query_items[i])
+                for i in to_summarize
+            ),
+            return_exceptions=True,
+        )
+        summary_by_query = dict(zip(to_summarize, summaries))
+
+        results: list[str] = []
+        # (text, indices of its sources in metadata, rank in its query's results) per chunk
+        chunks: list[tuple[str, list[int], int]] = []
+        source = 0
+        for i, items in enumerate(query_items):
+            sources = list(range(source, source + len(items)))
+            source += len(items)
+            summary = summary_by_query.get(i)
+            if isinstance(summary, ContextSummary):
+                results.append(summary.summary)
+                chunks.append((summary.summary, sources, 0))
+            else:
+                if summary is not None:
+                    log_warning("Using unsummarized context", f"Query: {context_queries[i]}")
+                results.extend(text for text, _ in items)
+                chunks.extend((text, [s], rank) for rank, ((text, _), s) in enumerate(zip(items, sources)))
+            if i in failed_queries:
+                results.append("")
 
-    def call_llm():
-        try:
-            response = clean_response(llm_client.chat(messages))
-            return ContextSummary(**response)
-        except Exception as e:
-            log_error("Context summarization failed", f"Query: {context_query}", error=e)
-            raise
+        total_summaries = sum(1 for r in results if r.strip())
+        if pack:
+            budget = context_budget(getattr(llm_client, "model", None), CONTEXT_TOKEN_BUDGETS, CONTEXT_TOKEN_BUDGET)
+            results = pack_context(f"{query} {topic or ''}", chunks, budget, CONTEXT_PACK_DIVERSITY)
+        stage_span.set_attributes(sources=len(metadata), context_chars=sum(len(r) for r in results))
+        log_success("Context Retrieval Complete", lambda: f"Generated {total_summaries} summaries from {len(metadata)} unique sources")
 
-    try:
-        context_summary = call_with_retry(call_llm)
-        duration = time.time() - start_time
-        summary_length = len(context_summary.summary)
-        log_success("Context Summarization Complete", f"Summary length: {summary_length} chars for query: {context_query}")
-        log_timing("Context Summarization", duration)
-        return context_summary
-    except Exception as e:
-        log_error("Context summarization failed after retries", f"Query: {context_query}", error=e)
-        raise
+        return results, metadata
 
 
 def get_context(
-    context_queries: list[str], chat_history: list[dict], topic: str, query: str
+    context_queries: list[str],
+    chat_history: list[dict],
+    topic: str,
+    query: str,
+    max_concurrency: int = SEARCH_CONCURRENCY,
+    summarize: bool = SUMMARIZE_CONTEXT,
+    summary_min_chars: int = SUMMARY_MIN_CHARS,
+    pack: bool = CONTEXT_PACKING_ENABLED,
 ) -> tuple[list[str], list[dict]]:
     """
-    Retrieve and process context information from knowledge base using multiple queries.
-
-    Performs semantic search for each context query, deduplicates metadata,
-    and summarizes the retrieved context to extract relevant information.
+    Synchronous wrapper around get_context_async.
 
     Args:
         context_queries: List of queries to search the knowledge base
         chat_history: List of previous conversation messages in dict format
         topic: The main topic of conversation
         query: The original user query
+        max_concurrency: Maximum number of single-query searches in flight when batched search is unavailable (default: SEARCH_CONCURRENCY)
+        summarize: Whether to summarize the retrieved context (default: SUMMARIZE_CONTEXT)
+        summary_min_chars: Minimum size in characters of a query's results before they are summarized
+        pack: Whether to pack the context into the model's token budget (default: CONTEXT_PACKING_ENABLED)
 
     Returns:
         Tuple containing:
             - List of summarized context strings
             - List of unique metadata dictionaries from retrieved documents
     """
-    log_step("Context Retrieval", f"Processing {len(context_queries)} context queries")
-    start_time = time.time()
-
-    results: list[str] = []
-    metadata: list[dict] = []
-    seen_metadata = set()
-
-    for i, context_query in enumerate(context_queries, 1):
-        log_info(f"Context Query {i}/{len(context_queries)}", f"Searching for: {context_query}")
-        
-        try:
-            search_start = time.time()
-            result: list[tuple[str, dict]] = semantic_search(context_query)
-            search_duration = time.time() - search_start
-            
-            log_success(f"Semantic Search Complete", f"Found {len(result)} results in {search_duration:.2f}s")
-            
-            for item in result:
-                metadata_dict = item[1]
-                metadata_key = frozenset(metadata_dict.items())
-                if metadata_key not in seen_metadata:
-                    seen_metadata.add(metadata_key)
-                    metadata.append(metadata_dict)
-                    results.append(item[0])
-
-            # Summarize context currrently skipped
-            # summary: ContextSummary = summarize_context(
-            #     query, chat_history, topic, context_query, result
-            # )
-            # results.append(summary.summary)
-
-            
-        except Exception as e:
-            log_error(f"Context retrieval failed for query: {context_query}", error=e)
-            results.append("")
-
-    duration = time.time() - start_time
-    total_summaries = sum(1 for r in results if r.strip())
-    log_success("Context Retrieval Complete", f"Generated {total_summaries} summaries from {len(metadata)} unique sources")
-    log_timing("Context Retrieval", duration)
-    
-    return results, metadata
+    return run_sync(
+        get_context_async(
+            context_queries,
+            chat_history,
+            topic,
+            query,
+            max_concurrency,
+            summarize,
+            summary_min_chars,
+            pack,
+        )
+    )
 
 
-def run_context_layer(
-    query: str, chat_history: list[dict], topic: str
+async def run_context_layer_async(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    summarize: bool = SUMMARIZE_CONTEXT,
 ) -> tuple[list[str], list[dict]]:
     """
     Execute the complete context retrieval pipeline.
@@ -366,6 +620,7 @@ def run_context_layer(
         query: The current user query
         chat_history: List of previous conversation messages in dict format
         topic: The main topic of conversation
+        summarize: Whether to summarize the retrieved context (default: SUMMARIZE_CONTEXT)
 
     Returns:
         Tuple containing:
@@ -373,23 +628,45 @@ def run_context_layer(
             - List of unique metadata dictionaries from retrieved documents
     """
     log_step("Context Layer", "Starting context retrieval pipeline")
-    start_time = time.time()
-    
-    try:
-        context_queries = get_context_queries(query, chat_history, topic)
-        context, metadata = get_context(context_queries.queries, chat_history, topic, query)
-        
-        duration = time.time() - start_time
-        log_success("Context Layer Complete", f"Retrieved {len(context)} context summaries")
-        log_timing("Context Layer", duration)
-        
-        return context, metadata
-    except Exception as e:
-        log_error("Context layer failed", error=e)
-        raise
+    with span("context_layer", label="Context Layer"):
+        try:
+            context_queries = await get_context_queries_async(query, chat_history, topic)
+            context, metadata = await get_context_async(
+                context_queries.queries, chat_history, topic, query, summarize=summarize
+            )
 
+            log_success("Context Layer Complete", lambda: f"Retrieved {len(context)} context summaries")
 
-def generate_response(
+            return context, metadata
+        except Exception as e:
+            log_error("Context layer failed", error=e)
+            raise
+
+
+def run_context_layer(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    summarize: bool = SUMMARIZE_CONTEXT,
+) -> tuple[list[str], list[dict]]:
+    """
+    Synchronous wrapper around run_context_layer_async.
+
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        summarize: Whether to summarize the retrieved context (default: SUMMARIZE_CONTEXT)
+
+    Returns:
+        Tuple containing:
+            - List of summarized context strings
+            - List of unique metadata dictionaries from retrieved documents
+    """
+    return run_sync(run_context_layer_async(query, chat_history, topic, summarize))
+
+
+async def generate_response_async(
     query: str,
     chat_history: list[dict],
     topic: str,
@@ -397,6 +674,7 @@ def generate_response(
     reason: str = None,
     resolution: str = None,
     past_response: str = None,
+    temperature: Optional[float] = None,
 ) -> Response:
     """
     Generate educational chatbot response using provided context and conversation history.
@@ -412,94 +690,79 @@ def generate_response(
         reason: Optional reason why previous response was suboptimal (for refinement)
         resolution: Optional suggestion for improving response (for refinement)
         past_response: Optional previous response that needs improvement (for refinement)
+        temperature: Optional sampling temperature, e.g. to vary best-of-N candidates
 
     Returns:
         Response: Object containing the generated response text
     """
     is_refinement = bool(reason and resolution and past_response)
     step_name = "Response Refinement" if is_refinement else "Response Generation"
-    log_step(step_name, f"Using {len(context)} context summaries")
+    log_step(step_name, lambda: f"Using {len(context)} context summaries")
     
     if is_refinement:
         log_warning("Response Refinement Required", f"Reason: {reason[:100]}...")
     
-    start_time = time.time()
-    
-    base_prompt = f"""You are an expert educational chatbot response generator. Your task is to carefully read the user's query, the last 10 turns of chat history, the main topic, and any relevant context, and then generate a clear, helpful, and conversational response that directly addresses the user's query.
-
-Guidelines:
-- Your response should be accurate, friendly, engaging, descriptive, and relevant to the user's question.
-- Maintain a friendly and engaging tone, appropriate for an educational setting.
-- Try to be as descriptive as possible, and use the context to provide more information.
-- In the end, ask the user if they have any questions or need further clarification.
-- If the context contains useful information, incorporate it naturally into your answer.
-- Avoid repeating information already present in the chat history unless it is necessary for clarity.
-- Assume that you know nothing outside the provided context, topic, or chat history.
-- Only output a JSON object with a single key "response" whose value is your generated response as a string."""
-
-    refinement_section = ""
-    if reason and resolution and past_response:
-        refinement_section = f"""
-
-**IMPORTANT - This is a response refinement attempt:**
-The previous response was deemed suboptimal for the following reason: {reason}
-
-**Previous Response:**
-{past_response}
-
-**How to improve:**
-{resolution}
-
-Please generate a new response that addresses these issues and follows the improvement suggestions."""
-
-    prompt = f"""{base_prompt}{refinement_section}
-
-Format your output exactly as follows:
-
-json
-{{
-    \"response\": \"<response to the user's query>\"
-}}
-
-
-**User Query:**
-{query}
-
-**Chat History:**
-{chat_history}
-
-**Topic:**
-{topic}
-
-**Context:**
-{context}
-
-**Output:**"""
+    with span("response", label=step_name, refinement=is_refinement) as stage_span:
+        messages = response_messages(
+            query, chat_history, topic, context, reason, resolution, past_response
+        )
 
-    messages = [*chat_history, {"role": "user", "content": prompt}]
+        async def call_llm():
+            try:
+                return clean_response(await chat_async(messages, "response", Response, temperature), Response)
+            except Exception as e:
+                log_error("Response generation failed", error=e)
+                raise
 
-    def call_llm():
         try:
-            response = clean_response(llm_client.chat(messages))
-            return Response(**response)
+            response = await retry_policy.acall(call_llm, endpoint="llm")
+            response_length = len(response.response)
+            stage_span.set_attribute("response_chars", response_length)
+            log_success(lambda: f"{step_name} Complete", lambda: f"Generated response of {response_length} chars")
+            return response
         except Exception as e:
-            log_error("Response generation failed", error=e)
+            log_error(f"{step_name} failed after retries", error=e)
             raise
 
-    try:
-        response = call_with_retry(call_llm)
-        duration = time.time() - start_time
-        response_length = len(response.response)
-        log_success(f"{step_name} Complete", f"Generated response of {response_length} chars")
-        log_timing(step_name, duration)
-        return response
-    except Exception as e:
-        log_error(f"{step_name} failed after retries", error=e)
-        raise
 
+def generate_response(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context: list[str],
+    reason: str = None,
+    resolution: str = None,
+    past_response: str = None,
+) -> Response:
+    """
+    Synchronous wrapper around generate_response_async.
+
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        context: List of summarized context strings from knowledge base
+        reason: Optional reason why previous response was suboptimal (for refinement)
+        resolution: Optional suggestion for improving response (for refinement)
+        past_response: Optional previous response that needs improvement (for refinement)
 
-def validate_response(
-    response: str, query: str, chat_history: list[dict], topic: str, context: list[str]
+    Returns:
+        Response: Object containing the generated response text
+    """
+    return run_sync(
+        generate_response_async(
+            query, chat_history, topic, context, reason, resolution, past_response
+        )
+    )
+
+
+async def validate_response_async(
+    response: str,
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context: list[str],
+    use_local_check: bool = GROUNDING_CHECK_ENABLED,
 ) -> ResponseValidation:
     """
     Validate the quality of a generated chatbot response.
@@ -507,108 +770,224 @@ def validate_response(
     Evaluates response accuracy, relevance, and completeness based on the provided
     context and conversation history. Provides feedback for improvement if needed.
 
+    With the local check enabled, the response is first scored against the context
+    without an LLM (see grounding.local_verdict). Poorly grounded responses are rejected
+    directly and well grounded ones that address the query are accepted (unless
+    GROUNDING_LOCAL_ACCEPT is off); only the uncertain band, plus a GROUNDING_AUDIT_RATE
+    sample of decided responses, is sent to the LLM judge. The "grounding_judge_skipped",
+    "grounding_judge_calls" and "grounding_disagreements" metrics track the outcome.
+
     Args:
         response: The generated response text to validate
         query: The current user query
         chat_history: List of previous conversation messages in dict format
         topic: The main topic of conversation
         context: List of summarized context strings used for response generation
+        use_local_check: Whether to try the local grounding check first (default: GROUNDING_CHECK_ENABLED)
 
     Returns:
         ResponseValidation: Object containing quality assessment and improvement suggestions
     """
     log_step("Response Validation", "Evaluating response quality")
-    start_time = time.time()
-    
-    prompt = f"""You are a meticulous and impartial judge. Your role is to evaluate a generated chatbot response based on the provided context.
-
-You must assess the response for accuracy, relevance to the user's query, and completeness based on the summarized context.
+    with span("validation", label="Response Validation") as stage_span:
+        local_lean = None
+        if use_local_check:
+            verdict, score, signals = local_verdict(
+                response,
+                context,
+                GROUNDING_ACCEPT_THRESHOLD,
+                GROUNDING_REJECT_THRESHOLD,
+                GROUNDING_MIN_CHARS,
+                GROUNDING_MAX_CHARS,
+                query=query,
+                accept=GROUNDING_LOCAL_ACCEPT,
+            )
+            log_debug("Local Grounding Check", lambda: f"Score: {score:.2f}, Signals: {signals}")
+            if verdict is not None and random.random() >= grounding_audit_rate:
+                increment("grounding_judge_skipped")
+                stage_span.set_attributes(judge=False, quality=verdict.quality, grounding_score=score)
+                log_success("Response Validation Complete (local)", lambda: f"Response quality: {verdict.quality}")
+                return verdict
+            if verdict is not None:
+                local_lean = verdict.quality
+            elif signals:
+                midpoint = (GROUNDING_ACCEPT_THRESHOLD + GROUNDING_REJECT_THRESHOLD) / 2
+                local_lean = "Optimal" if score >= midpoint else "Suboptimal"
+
+        messages = validation_messages(response, query, chat_history, topic, context)
+
+        async def call_llm():
+            try:
+                return clean_response(await chat_async(messages, "validation", ResponseValidation), ResponseValidation)
+            except Exception as e:
+                log_error("Response validation failed", error=e)
+                raise
 
-Your output must be a JSON object with one of two structures:
+        try:
+            response_validation = await retry_policy.acall(call_llm, endpoint="llm")
+            stage_span.set_attributes(judge=True, quality=response_validation.quality)
 
-1. If the response is high-quality, clear, accurate, and fully utilizes the provided context:
+            if use_local_check:
+                increment("grounding_judge_calls")
+                if local_lean is not None and local_lean != response_validation.quality:
+                    increment("grounding_disagreements")
 
-json
-{{
-    "quality": "Optimal",
-    "reason": "None",
-    "resolution": "None"
-}}
+            if response_validation.quality == "Optimal":
+                log_success("Response Validation Complete", "Response quality: Optimal")
+            else:
+                log_warning("Response Validation Complete", f"Response quality: {response_validation.quality}")
+                log_debug("Validation Issues", lambda: f"Reason: {response_validation.reason}")
 
+            return response_validation
+        except Exception as e:
+            log_error("Response validation failed after retries", error=e)
+            raise
 
-2. If the response is inaccurate, incomplete, irrelevant, or could be significantly improved:
 
-json
-{{
-    "quality": "Suboptimal",
-    "reason": "Provide a brief explanation of what is wrong with the response.",
-    "resolution": "Provide a specific suggestion on how to fix the response and make it better."
-}}
+def validate_response(
+    response: str,
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context: list[str],
+    use_local_check: bool = GROUNDING_CHECK_ENABLED,
+) -> ResponseValidation:
+    """
+    Synchronous wrapper around validate_response_async.
 
+    Args:
+        response: The generated response text to validate
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        context: List of summarized context strings used for response generation
+        use_local_check: Whether to try the local grounding check first (default: GROUNDING_CHECK_ENABLED)
 
----
+    Returns:
+        ResponseValidation: Object containing quality assessment and improvement suggestions
+    """
+    return run_sync(
+        validate_response_async(response, query, chat_history, topic, context, use_local_check)
+    )
 
-**Evaluation Materials:**
 
-**User Query:**
-{query}
+async def rank_responses_async(
+    candidates: list[str], query: str, chat_history: list[dict], topic: str, context: list[str]
+) -> ResponseRanking:
+    """
+    Pick the best of several candidate responses with one LLM judge call.
 
-**Chat History:**
-{chat_history}
+    Args:
+        candidates: Candidate response texts
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        context: List of summarized context strings used for response generation
 
-**Topic:**
-{topic}
+    Returns:
+        ResponseRanking: The 1-based number of the best candidate, with a validation of it
+    """
+    log_step("Response Ranking", lambda: f"Judging {len(candidates)} candidate responses")
+    with span("ranking", label="Response Ranking", candidates=len(candidates)) as stage_span:
+        messages = ranking_messages(candidates, query, chat_history, topic, context)
+
+        async def call_llm():
+            try:
+                ranking = clean_response(await chat_async(messages, "ranking", ResponseRanking), ResponseRanking)
+                if not 1 <= ranking.best <= len(candidates):
+                    raise ValueError(f"Judge picked candidate {ranking.best} of {len(candidates)}")
+                return ranking
+            except Exception as e:
+                log_error("Response ranking failed", error=e)
+                raise
 
-**Summarized Context that was used to generate the response:**
-{context}
+        ranking = await retry_policy.acall(call_llm, endpoint="llm")
+        stage_span.set_attributes(best=ranking.best, quality=ranking.quality)
+        log_success("Response Ranking Complete", lambda: f"Candidate {ranking.best} is best, quality: {ranking.quality}")
+        return ranking
 
-**Generated Response to be judged:**
-{response}
 
----
+async def generate_best_response_async(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context: list[str],
+    candidates: int = RESPONSE_CANDIDATES,
+    temperatures: tuple[float, ...] = RESPONSE_CANDIDATE_TEMPERATURES,
+) -> tuple[Response, Optional[ResponseValidation]]:
+    """
+    Generate several responses concurrently and let one judge call pick the best.
 
-**Your Judgement:**
-"""
+    Candidates are sampled with the temperatures in turn. Failed candidates are left out;
+    with a single candidate left, or when the deadline leaves no time for the judge or
+    the judge call fails, the first candidate is returned without a validation, for the
+    caller to validate as usual.
 
-    messages = [{"role": "user", "content": prompt}]
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        context: List of summarized context strings from knowledge base
+        candidates: Number of responses generated (default: RESPONSE_CANDIDATES)
+        temperatures: Sampling temperatures, cycled over the candidates
 
-    def call_llm():
-        try:
-            response = clean_response(llm_client.chat(messages))
-            return ResponseValidation(**response)
-        except Exception as e:
-            log_error("Response validation failed", error=e)
-            raise
+    Returns:
+        Tuple of the chosen response and the judge's validation of it (None if not judged)
+    """
+    log_info("Best-of-N Generation", lambda: f"Generating {candidates} candidate responses concurrently")
+    results = await asyncio.gather(
+        *(
+            generate_response_async(
+                query,
+                chat_history,
+                topic,
+                context,
+                temperature=temperatures[i % len(temperatures)] if temperatures else None,
+            )
+            for i in range(candidates)
+        ),
+        return_exceptions=True,
+    )
+    responses = [result for result in results if isinstance(result, Response)]
+    increment("response_candidates", len(results))
+    if len(responses) < len(results):
+        increment("response_candidates_failed", len(results) - len(responses))
+    if not responses:
+        raise next(result for result in results if isinstance(result, BaseException))
+    if len(responses) == 1 or not current_deadline().allows(DEADLINE_VALIDATE_MIN_SECONDS):
+        return responses[0], None
 
     try:
-        response_validation = call_with_retry(call_llm)
-        duration = time.time() - start_time
-        
-        if response_validation.quality == "Optimal":
-            log_success("Response Validation Complete", "Response quality: Optimal")
-        else:
-            log_warning("Response Validation Complete", f"Response quality: {response_validation.quality}")
-            log_debug("Validation Issues", f"Reason: {response_validation.reason}")
-        
-        log_timing("Response Validation", duration)
-        return response_validation
-    except Exception as e:
-        log_error("Response validation failed after retries", error=e)
+        ranking = await rank_responses_async([r.response for r in responses], query, chat_history, topic, context)
+    except DeadlineExceeded:
         raise
+    except Exception as e:
+        log_warning("Ranking failed, validating the first candidate instead", str(e))
+        return responses[0], None
+    validation = ResponseValidation(quality=ranking.quality, reason=ranking.reason, resolution=ranking.resolution)
+    return responses[ranking.best - 1], validation
 
 
-def run_response_layer(
+async def run_response_layer_async(
     query: str,
     chat_history: list[dict],
     topic: str,
     context: list[str],
     max_retries: int = 3,
+    candidates: int = RESPONSE_CANDIDATES,
 ) -> Response:
     """
     Execute the complete response generation and validation pipeline.
 
     Generates responses and validates their quality, attempting refinement if needed.
     Continues iteration until optimal response is achieved or maximum retries reached.
+    With more than one candidate, the first attempt generates them concurrently and a
+    single ranking call picks and judges the best (see generate_best_response_async),
+    so sequential refinement only runs when even the best candidate is suboptimal.
+
+    When the request's deadline runs low the layer degrades instead of overrunning: it
+    stops refining (returning the latest response) and then stops validating (returning
+    the first response unjudged). The steps taken are recorded on the deadline.
 
     Args:
         query: The current user query
@@ -616,58 +995,105 @@ def run_response_layer(
         topic: The main topic of conversation
         context: List of summarized context strings from knowledge base
         max_retries: Maximum number of refinement attempts (default: 3)
+        candidates: Number of responses generated concurrently on the first attempt (default: RESPONSE_CANDIDATES)
 
     Returns:
         Response: Object containing the final generated response text
     """
-    log_step("Response Layer", f"Starting response generation with max {max_retries} attempts")
-    start_time = time.time()
-    
-    response = None
-    reason = None
-    resolution = None
-    past_response = None
-    
-    for attempt in range(max_retries):
-        log_info(f"Response Attempt {attempt + 1}/{max_retries}", "Generating response")
-        
-        try:
-            if attempt == 0:
-                response = generate_response(query, chat_history, topic, context)
-            else:
-                response = generate_response(
-                    query, chat_history, topic, context, reason, resolution, past_response
-                )
+    log_step("Response Layer", lambda: f"Starting response generation with max {max_retries} attempts")
+    with span("response_layer", label="Response Layer", candidates=candidates) as stage_span:
+        deadline = current_deadline()
+        response = None
+        reason = None
+        resolution = None
+        past_response = None
+        attempts = 0
+
+        for attempt in range(max_retries):
+            if attempt > 0 and not deadline.allows(DEADLINE_REFINE_MIN_SECONDS):
+                deadline.degrade(SKIP_REFINEMENT, f"{deadline.remaining():.2f}s left before refinement {attempt + 1}")
+                break
+            attempts = attempt + 1
+
+            log_info(lambda: f"Response Attempt {attempt + 1}/{max_retries}", "Generating response")
+
+            step = SKIP_REFINEMENT
+            try:
+                response_validation = None
+                if attempt == 0 and candidates > 1:
+                    response, response_validation = await generate_best_response_async(
+                        query, chat_history, topic, context, candidates
+                    )
+                elif attempt == 0:
+                    response = await generate_response_async(query, chat_history, topic, context)
+                else:
+                    response = await generate_response_async(
+                        query, chat_history, topic, context, reason, resolution, past_response
+                    )
+
+                if response_validation is None:
+                    if not deadline.allows(DEADLINE_VALIDATE_MIN_SECONDS):
+                        deadline.degrade(SKIP_VALIDATION, f"{deadline.remaining():.2f}s left before validation")
+                        break
+
+                    step = SKIP_VALIDATION
+                    response_validation = await validate_response_async(
+                        response.response, query, chat_history, topic, context
+                    )
+
+                if response_validation.quality == "Optimal":
+                    stage_span.set_attribute("attempts", attempt + 1)
+                    log_success("Response Layer Complete", lambda: f"Optimal response achieved on attempt {attempt + 1}")
+                    return response
+
+                reason = response_validation.reason
+                resolution = response_validation.resolution
+                past_response = response.response
+
+                if attempt < max_retries - 1:
+                    log_warning(f"Response needs refinement", f"Attempting refinement {attempt + 2}/{max_retries}")
+
+            except DeadlineExceeded as e:
+                if response is None:
+                    raise
+                deadline.degrade(step, str(e))
+                break
+            except Exception as e:
+                log_error(f"Response generation attempt {attempt + 1} failed", error=e)
+                if attempt == max_retries - 1:
+                    raise
+
+        stage_span.set_attribute("attempts", attempts)
+        log_warning("Response Layer Complete", f"Using suboptimal response after {attempts} attempts")
+        return response
 
-            response_validation = validate_response(
-                response.response, query, chat_history, topic, context
-            )
 
-            if response_validation.quality == "Optimal":
-                duration = time.time() - start_time
-                log_success("Response Layer Complete", f"Optimal response achieved on attempt {attempt + 1}")
-                log_timing("Response Layer", duration)
-                return response
-
-            reason = response_validation.reason
-            resolution = response_validation.resolution
-            past_response = response.response
-            
-            if attempt < max_retries - 1:
-                log_warning(f"Response needs refinement", f"Attempting refinement {attempt + 2}/{max_retries}")
-            
-        except Exception as e:
-            log_error(f"Response generation attempt {attempt + 1} failed", error=e)
-            if attempt == max_retries - 1:
-                raise
+def run_response_layer(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context: list[str],
+    max_retries: int = 3,
+    candidates: int = RESPONSE_CANDIDATES,
+) -> Response:
+    """
+    Synchronous wrapper around run_response_layer_async.
 
-    duration = time.time() - start_time
-    log_warning("Response Layer Complete", f"Using suboptimal response after {max_retries} attempts")
-    log_timing("Response Layer", duration)
-    return response
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
+        topic: The main topic of conversation
+        context: List of summarized context strings from knowledge base
+        max_retries: Maximum number of refinement attempts (default: 3)
+        candidates: Number of responses generated concurrently on the first attempt (default: RESPONSE_CANDIDATES)
 
+    Returns:
+        Response: Object containing the final generated response text
+    """
+    return run_sync(run_response_layer_async(query, chat_history, topic, context, max_retries, candidates))
 
-def get_direct_response(query: str, chat_history: list[dict]) -> Response:
+
+async def get_direct_response_async(query: str, chat_history: list[dict]) -> Response:
     """
     Generate direct conversational response without context retrieval.
 
@@ -682,63 +1108,167 @@ def get_direct_response(query: str, chat_history: list[dict]) -> Response:
         Response: Object containing the generated response text
     """
     log_step("Direct Response", "Generating response without context retrieval")
-    start_time = time.time()
-    
-    prompt = f"""You are a helpful educational chatbot. Your task is to converse with the user in a friendly and engaging manner, and respond to the user's latest query in an engaging and conversational manner.
+    with span("direct_response", label="Direct Response") as stage_span:
+        messages = direct_response_messages(query, chat_history)
+
+        async def call_llm():
+            try:
+                return clean_response(await chat_async(messages, "direct_response", Response), Response)
+            except Exception as e:
+                log_error("Direct response generation failed", error=e)
+                raise
+
+        try:
+            direct_response = await retry_policy.acall(call_llm, endpoint="llm")
+            response_length = len(direct_response.response)
+            stage_span.set_attribute("response_chars", response_length)
+            log_success("Direct Response Complete", lambda: f"Generated response of {response_length} chars")
+            return direct_response
+        except Exception as e:
+            log_error("Direct response generation failed after retries", error=e)
+            raise
 
-    Your output should be a JSON object with a single key "response" whose value is your generated response as a string.
 
-    Format your output exactly as follows:
+def get_direct_response(query: str, chat_history: list[dict]) -> Response:
+    """
+    Synchronous wrapper around get_direct_response_async.
 
-    json
-    {{
-        \"response\": \"<response to the user's query>\"
-    }}
-    
+    Args:
+        query: The current user query
+        chat_history: List of previous conversation messages in dict format
 
-    **User Query:**
-    {query}
+    Returns:
+        Response: Object containing the generated response text
+    """
+    return run_sync(get_direct_response_async(query, chat_history))
 
-    **Chat History:**
-    {chat_history}
 
-    **Output:**
+async def run_intent_layer_async(
+    query: str,
+    chat_history: list[dict],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    speculative: bool = SPECULATIVE_RETRIEVAL,
+) -> tuple[Intent, Optional[list[str]], Optional[list[dict]]]:
     """
+    Classify the query and, for Learning Mode, retrieve its context.
 
-    messages = [*chat_history, {"role": "user", "content": prompt}]
+    In speculative mode the context layer is started at the same time as intent
+    classification (without a topic, since it is not known yet). Its result is used if
+    the intent turns out to be Learning Mode and cancelled otherwise; the outcome is
+    counted in the "speculation_hits" / "speculation_misses" metrics.
 
-    def call_llm():
+    Retrieval is skipped (the SKIP_RETRIEVAL degradation) when too little of the
+    request's deadline is left to retrieve and then generate, or when the context layer
+    does not finish in time to leave room for a direct response. A Learning Mode intent
+    is then returned with no context, and the caller answers directly.
+
+    Args:
+        query: The current user query to process
+        chat_history: List of previous conversation messages in dict format
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        speculative: Whether to start context retrieval before the intent is known (default: SPECULATIVE_RETRIEVAL)
+
+    Returns:
+        Tuple containing:
+            - Intent: Classified intent and topic
+            - List of context strings (None unless Learning Mode and retrieval ran)
+            - List of unique metadata dictionaries from retrieved documents (None unless Learning Mode and retrieval ran)
+    """
+    deadline = current_deadline()
+    speculation = None
+    if speculative:
+        log_info("Speculative Retrieval", "Starting context layer alongside intent classification")
+        speculation = asyncio.create_task(
+            run_context_layer_async(query, chat_history, None, summarize)
+        )
+        # Mark a failure as retrieved so a discarded speculation does not log "never retrieved"
+        speculation.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    try:
+        intent = await get_intent_async(query, chat_history)
+
+        log_info("Intent Routing", lambda: f"Routing to {intent.intent} pipeline")
+
+        if speculation is not None:
+            if intent.intent == "Learning Mode":
+                increment("speculation_hits")
+            else:
+                increment("speculation_misses")
+                speculation.cancel()
+                speculation = None
+            log_debug("Speculative Retrieval", lambda: f"Hit rate: {hit_rate('speculation')['hit_rate']:.0%}")
+
+        if intent.intent != "Learning Mode":
+            return intent, None, None
+
+        speculation_ready = speculation is not None and speculation.done() and not speculation.exception()
+        if not speculation_ready and not deadline.allows(DEADLINE_RETRIEVAL_MIN_SECONDS):
+            deadline.degrade(SKIP_RETRIEVAL, f"{deadline.remaining():.2f}s left after intent classification")
+            if speculation is not None:
+                speculation.cancel()
+            return intent, None, None
+
+        context = metadata = None
         try:
-            response = clean_response(llm_client.chat(messages))
-            return Response(**response)
-        except Exception as e:
-            log_error("Direct response generation failed", error=e)
+            if speculation is not None:
+                try:
+                    context, metadata = await asyncio.wait_for(
+                        speculation, deadline.timeout(DEADLINE_DIRECT_RESERVE_SECONDS)
+                    )
+                except asyncio.TimeoutError:
+                    raise
+                except Exception as e:
+                    log_warning("Speculative retrieval failed, retrying with topic", str(e))
+            if context is None:
+                context, metadata = await asyncio.wait_for(
+                    run_context_layer_async(query, chat_history, intent.topic, summarize),
+                    deadline.timeout(DEADLINE_DIRECT_RESERVE_SECONDS),
+                )
+        except (asyncio.TimeoutError, DeadlineExceeded) as e:
+            if not deadline.allows(DEADLINE_DIRECT_RESERVE_SECONDS):
+                deadline.degrade(SKIP_RETRIEVAL, "Context layer did not finish in time")
+                return intent, None, None
             raise
+        return intent, context, metadata
 
-    try:
-        direct_response = call_with_retry(call_llm)
-        duration = time.time() - start_time
-        response_length = len(direct_response.response)
-        log_success("Direct Response Complete", f"Generated response of {response_length} chars")
-        log_timing("Direct Response", duration)
-        return direct_response
-    except Exception as e:
-        log_error("Direct response generation failed after retries", error=e)
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
         raise
 
 
-def run_pipeline(
-    query: str, chat_history: list[dict]
+async def run_pipeline_async(
+    query: str,
+    chat_history: list[dict],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    speculative: bool = SPECULATIVE_RETRIEVAL,
+    use_cache: bool = RESPONSE_CACHE_ENABLED,
+    deadline: Optional[Deadline] = None,
 ) -> tuple[str, Optional[list[dict]]]:
     """
     Execute the complete educational chatbot pipeline.
 
     Orchestrates the entire process from intent classification to response generation.
     Routes queries through appropriate processing paths based on detected intent.
+    Every stage awaits its LLM and search calls, so one event loop can serve many
+    concurrent turns without dedicating a thread to each conversation.
+
+    Before any of that, the semantic response cache is consulted; a hit returns the
+    stored response and metadata without calling the LLM at all. The chat history is then
+    compacted once (older turns folded into a rolling summary) and every stage renders
+    that compact form within its own token budget.
+
+    The whole turn runs against a deadline. As it runs low the pipeline degrades in
+    steps rather than overrunning: skip refinement, then skip validation, then skip
+    retrieval and answer directly. Degraded responses are not cached.
 
     Args:
         query: The current user query to process
         chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        speculative: Whether to start context retrieval before the intent is known (default: SPECULATIVE_RETRIEVAL)
+        use_cache: Whether to look up and store the response in the semantic response cache (default: RESPONSE_CACHE_ENABLED)
+        deadline: Latency budget for the request; its degradations list records the steps taken (default: a new Deadline of PIPELINE_DEADLINE_SECONDS)
 
     Returns:
         Tuple containing:
@@ -747,49 +1277,387 @@ def run_pipeline(
     """
     start_time = time.time()
     log_pipeline_start(query)
-    
-    try:
-        intent = get_intent(query, chat_history)
-        topic = intent.topic
-        metadata = None
-        response = "I am sorry, I am not able to answer that question."
-        
-        log_info("Intent Routing", f"Routing to {intent.intent} pipeline")
-        
-        if intent.intent == "Learning Mode":
-            log_info("Learning Mode Pipeline", "Using context retrieval and response generation")
-            context, metadata = run_context_layer(query, chat_history, topic)
-            response = run_response_layer(query, chat_history, topic, context)
-        elif intent.intent == "Misc Mode":
-            log_info("Misc Mode Pipeline", "Using direct response generation")
-            response = get_direct_response(query, chat_history)
-        elif intent.intent == "Normal Mode":
-            log_info("Normal Mode Pipeline", "Using direct response generation")
-            response = get_direct_response(query, chat_history)
-        else:
-            log_info(f"{intent.intent} Pipeline", "Using direct response generation (fallback)")
-            response = get_direct_response(query, chat_history)
-
-        end_time = time.time()
-        total_duration = end_time - start_time
-        
-        response_text = response.response
-        final_metadata = metadata if metadata else None
-        
-        log_success("Pipeline Success", f"Generated response for {intent.intent} query")
-        if final_metadata:
-            log_info("Response Metadata", f"Includes {len(final_metadata)} source documents")
-        
-        log_pipeline_end(total_duration)
-        
-        return response_text, final_metadata
+    if cassette is not None:
+        cassette.record_turn(query, chat_history)
+    with span("pipeline", history_items=len(chat_history)) as request_span:
+        if use_cache:
+            cached = response_cache.lookup(query, chat_history)
+            if cached is not None:
+                increment("response_cache_hits")
+                request_span.set_attribute("cache_hit", True)
+                log_success("Response Cache Hit", "Returning cached response")
+                log_pipeline_end(time.time() - start_time)
+                return cached
+            increment("response_cache_misses")
+
+        compacted_history = history_manager.compact(chat_history)
+        if deadline is None:
+            deadline = Deadline(PIPELINE_DEADLINE_SECONDS)
+        deadline_token = set_deadline(deadline)
+
+        try:
+            intent, context, metadata = await run_intent_layer_async(
+                query, compacted_history, summarize, speculative
+            )
+            topic = intent.topic
+            response = "I am sorry, I am not able to answer that question."
+
+            if intent.intent == "Learning Mode" and context is not None:
+                log_info("Learning Mode Pipeline", "Using context retrieval and response generation")
+                response = await run_response_layer_async(query, compacted_history, topic, context)
+            elif intent.intent == "Learning Mode":
+                log_info("Learning Mode Pipeline", "Using direct response generation (retrieval skipped)")
+                response = await get_direct_response_async(query, compacted_history)
+            elif intent.intent == "Misc Mode":
+                log_info("Misc Mode Pipeline", "Using direct response generation")
+                response = await get_direct_response_async(query, compacted_history)
+            elif intent.intent == "Normal Mode":
+                log_info("Normal Mode Pipeline", "Using direct response generation")
+                response = await get_direct_response_async(query, compacted_history)
+            else:
+                log_info(lambda: f"{intent.intent} Pipeline", "Using direct response generation (fallback)")
+                response = await get_direct_response_async(query, compacted_history)
+
+            end_time = time.time()
+            total_duration = end_time - start_time
+
+            response_text = response.response
+            final_metadata = metadata if metadata else None
 
+            if use_cache and intent.intent in CACHEABLE_INTENTS and not deadline.degradations:
+                response_cache.store(query, chat_history, topic, response_text, final_metadata)
+
+            request_span.set_attributes(
+                cache_hit=False,
+                intent=intent.intent,
+                sources=len(final_metadata or []),
+                degradations=",".join(deadline.degradations),
+            )
+            log_success("Pipeline Success", lambda: f"Generated response for {intent.intent} query")
+            if final_metadata:
+                log_info("Response Metadata", lambda: f"Includes {len(final_metadata)} source documents")
+            if deadline.degradations:
+                log_warning("Degraded Response", f"Steps taken: {', '.join(deadline.degradations)}")
+
+            log_pipeline_end(total_duration)
+
+            return response_text, final_metadata
+
+        except Exception as e:
+            end_time = time.time()
+            total_duration = end_time - start_time
+            log_error("Pipeline Failed", f"Total duration: {total_duration:.2f}s", error=e)
+            log_pipeline_end(total_duration)
+            raise
+        finally:
+            reset_deadline(deadline_token)
+
+
+def run_pipeline(
+    query: str,
+    chat_history: list[dict],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    speculative: bool = SPECULATIVE_RETRIEVAL,
+    use_cache: bool = RESPONSE_CACHE_ENABLED,
+    deadline: Optional[Deadline] = None,
+) -> tuple[str, Optional[list[dict]]]:
+    """
+    Execute the complete educational chatbot pipeline.
+
+    Synchronous wrapper around run_pipeline_async for callers that are not running
+    an event loop. Async servers should await run_pipeline_async directly so that a
+    single event loop can serve many concurrent turns.
+
+    Args:
+        query: The current user query to process
+        chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        speculative: Whether to start context retrieval before the intent is known (default: SPECULATIVE_RETRIEVAL)
+        use_cache: Whether to look up and store the response in the semantic response cache (default: RESPONSE_CACHE_ENABLED)
+        deadline: Latency budget for the request; its degradations list records the steps taken (default: a new Deadline of PIPELINE_DEADLINE_SECONDS)
+
+    Returns:
+        Tuple containing:
+            - Generated response text string
+            - Optional list of metadata dictionaries from retrieved documents (None for direct responses)
+    """
+    return run_sync(
+        run_pipeline_async(query, chat_history, summarize, speculative, use_cache, deadline)
+    )
+
+
+async def stream_chat_async(messages: list[dict], stage: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Stream the raw text of a chat completion.
+
+    Uses the client's ``astream`` async iterator or its blocking ``stream`` iterator
+    (consumed from a worker thread) when available. Chunks may be plain strings or
+    OpenAI-style ``{"choices": [{"delta": {"content": ...}}]}`` dicts. Clients without
+    streaming support get a single chunk holding the whole completion.
+
+    Every chunk is awaited within the current request's deadline, so a stalled stream
+    cannot outlast it; blocking streams are read in the chat thread pool for the same
+    reason as chat_async's blocking calls.
+
+    Args:
+        messages: List of chat messages in dict format with 'role' and 'content' keys
+        stage: Optional pipeline stage name used to attribute token usage
+
+    Yields:
+        str: Successive pieces of the completion text
+
+    Raises:
+        DeadlineExceeded: If the request's deadline passes before the stream ends
+    """
+    def chunk_text(chunk) -> str:
+        if isinstance(chunk, str):
+            return chunk
+        if stage is not None and chunk.get("usage"):
+            record_prompt_usage(stage, chunk)
+        choices = chunk.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content") or ""
+
+    deadline = current_deadline()
+    if deadline.expired():
+        raise DeadlineExceeded(f"No time left for the {stage or 'chat'} stream")
+
+    async def within_deadline(pending):
+        try:
+            return await asyncio.wait_for(pending, deadline.timeout())
+        except asyncio.TimeoutError as e:
+            if deadline.expired():
+                raise DeadlineExceeded(f"Deadline passed while streaming the {stage or 'chat'} call") from e
+            raise
+
+    astream = getattr(llm_client, "astream", None)
+    stream = getattr(llm_client, "stream", None)
+    if astream is not None:
+        iterator = astream(messages).__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await within_deadline(iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield chunk_text(chunk)
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    elif stream is not None:
+        loop = asyncio.get_running_loop()
+        iterator = iter(await within_deadline(loop.run_in_executor(chat_executor, stream, messages)))
+        exhausted = object()
+        while (
+            chunk := await within_deadline(loop.run_in_executor(chat_executor, next, iterator, exhausted))
+        ) is not exhausted:
+            yield chunk_text(chunk)
+    else:
+        response = await chat_async(messages, stage)
+        yield response["choices"][0]["message"]["content"]
+
+
+async def stream_response_async(messages: list[dict], stage: str) -> AsyncIterator[str]:
+    """
+    Stream the "response" field of a JSON-enveloped completion as plain text.
+
+    The field is decoded incrementally as tokens arrive. If the model does not produce
+    the expected envelope, the whole completion is parsed once it ends instead. If the
+    stream fails before any text was produced, a regular completion with retries is used,
+    unless the failure is the request's deadline passing.
+
+    Args:
+        messages: Response generation messages (see prompts.response_messages)
+        stage: Pipeline stage name used to attribute token usage
+
+    Yields:
+        str: Successive pieces of the response text
+    """
+    decoder = JSONStringFieldDecoder("response")
+    raw_completion = ""
+    emitted = False
+
+    try:
+        async for token in stream_chat_async(messages, stage):
+            raw_completion += token
+            text = decoder.feed(token)
+            if text:
+                emitted = True
+                yield text
     except Exception as e:
-        end_time = time.time()
-        total_duration = end_time - start_time
-        log_error("Pipeline Failed", f"Total duration: {total_duration:.2f}s", error=e)
-        log_pipeline_end(total_duration)
-        raise
+        if emitted or isinstance(e, DeadlineExceeded):
+            raise
+        log_warning("Streaming failed, falling back to a single completion", str(e))
+
+        async def call_llm():
+            return clean_response(await chat_async(messages, stage, Response), Response)
+
+        yield (await retry_policy.acall(call_llm, endpoint="llm")).response
+        return
+
+    if not decoder.found:
+        yield parse_model(raw_completion, Response).response
+
+
+async def run_pipeline_stream_async(
+    query: str,
+    chat_history: list[dict],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    speculative: bool = SPECULATIVE_RETRIEVAL,
+    use_cache: bool = RESPONSE_CACHE_ENABLED,
+    validate: bool = STREAM_VALIDATE,
+    deadline: Optional[Deadline] = None,
+) -> AsyncIterator[StreamChunk]:
+    """
+    Execute the chatbot pipeline, streaming the response text as it is generated.
+
+    Intent classification and context retrieval run as in run_pipeline_async; the final
+    generation is then streamed. Because text reaches the user before it can be judged,
+    the validate/refine loop does not run: validation is an optional post-hoc step whose
+    verdict is attached to the final chunk. The stream is bounded by the request's
+    deadline like every other call; if it passes mid-stream the response ends with the
+    text sent so far (the TRUNCATE_RESPONSE degradation) and is not cached.
+
+    Args:
+        query: The current user query to process
+        chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        speculative: Whether to start context retrieval before the intent is known (default: SPECULATIVE_RETRIEVAL)
+        use_cache: Whether to look up and store the response in the semantic response cache (default: RESPONSE_CACHE_ENABLED)
+        deadline: Latency budget for the request; its degradations list records the steps taken (default: a new Deadline of PIPELINE_DEADLINE_SECONDS)
+        validate: Whether to judge Learning Mode responses once streamed (default: STREAM_VALIDATE)
+
+    Yields:
+        StreamChunk: Text deltas, followed by one chunk with done=True carrying the full
+            response, the source metadata and the optional validation result
+    """
+    start_time = time.time()
+    log_pipeline_start(query)
+    if cassette is not None:
+        cassette.record_turn(query, chat_history)
+    with span("pipeline", history_items=len(chat_history), streaming=True) as request_span:
+        if use_cache:
+            cached = response_cache.lookup(query, chat_history)
+            if cached is not None:
+                increment("response_cache_hits")
+                request_span.set_attribute("cache_hit", True)
+                log_success("Response Cache Hit", "Returning cached response")
+                log_pipeline_end(time.time() - start_time)
+                yield StreamChunk(delta=cached[0])
+                yield StreamChunk(done=True, response=cached[0], metadata=cached[1])
+                return
+            increment("response_cache_misses")
+
+        compacted_history = history_manager.compact(chat_history)
+        if deadline is None:
+            deadline = Deadline(PIPELINE_DEADLINE_SECONDS)
+        deadline_token = set_deadline(deadline)
+
+        try:
+            intent, context, metadata = await run_intent_layer_async(
+                query, compacted_history, summarize, speculative
+            )
+            topic = intent.topic
+
+            if intent.intent == "Learning Mode" and context is not None:
+                log_info("Learning Mode Pipeline", "Streaming response generation")
+                messages = response_messages(query, compacted_history, topic, context)
+                stage = "response"
+            else:
+                log_info(lambda: f"{intent.intent} Pipeline", "Streaming direct response generation")
+                messages = direct_response_messages(query, compacted_history)
+                stage = "direct_response"
+
+            log_step("Streaming Response", lambda: f"Stage: {stage}")
+            first_token_time = None
+            response_text = ""
+            with span("response_stream", label="Streaming Response", stage=stage) as stream_span:
+                try:
+                    async for text in stream_response_async(messages, stage):
+                        if first_token_time is None:
+                            first_token_time = time.time() - start_time
+                            stream_span.set_attribute("time_to_first_token", first_token_time)
+                            log_timing("Time to First Token", first_token_time)
+                        response_text += text
+                        yield StreamChunk(delta=text)
+                except DeadlineExceeded as e:
+                    # Text already sent cannot be taken back: end the response where it stopped
+                    if not response_text:
+                        raise
+                    deadline.degrade(TRUNCATE_RESPONSE, str(e))
+                stream_span.set_attribute("response_chars", len(response_text))
+
+            validation = None
+            if validate and stage == "response":
+                if deadline.allows(DEADLINE_VALIDATE_MIN_SECONDS):
+                    validation = await validate_response_async(
+                        response_text, query, compacted_history, topic, context
+                    )
+                else:
+                    deadline.degrade(SKIP_VALIDATION, f"{deadline.remaining():.2f}s left after streaming")
+
+            final_metadata = metadata if metadata else None
+            if (
+                use_cache
+                and intent.intent in CACHEABLE_INTENTS
+                and not deadline.degradations
+                and (validation is None or validation.quality == "Optimal")
+            ):
+                response_cache.store(query, chat_history, topic, response_text, final_metadata)
+
+            request_span.set_attributes(
+                cache_hit=False,
+                intent=intent.intent,
+                sources=len(final_metadata or []),
+                degradations=",".join(deadline.degradations),
+            )
+            log_success("Pipeline Success", lambda: f"Streamed response for {intent.intent} query")
+            if deadline.degradations:
+                log_warning("Degraded Response", f"Steps taken: {', '.join(deadline.degradations)}")
+            log_pipeline_end(time.time() - start_time)
+
+            yield StreamChunk(
+                done=True, response=response_text, metadata=final_metadata, validation=validation
+            )
+
+        except Exception as e:
+            total_duration = time.time() - start_time
+            log_error("Pipeline Failed", f"Total duration: {total_duration:.2f}s", error=e)
+            log_pipeline_end(total_duration)
+            raise
+        finally:
+            reset_deadline(deadline_token)
+
+
+def run_pipeline_stream(
+    query: str,
+    chat_history: list[dict],
+    summarize: bool = SUMMARIZE_CONTEXT,
+    speculative: bool = SPECULATIVE_RETRIEVAL,
+    use_cache: bool = RESPONSE_CACHE_ENABLED,
+    validate: bool = STREAM_VALIDATE,
+    deadline: Optional[Deadline] = None,
+) -> Iterator[StreamChunk]:
+    """
+    Synchronous wrapper around run_pipeline_stream_async.
+
+    Args:
+        query: The current user query to process
+        chat_history: List of previous conversation messages in dict format with 'role' and 'content' keys
+        summarize: Whether to summarize retrieved context in Learning Mode (default: SUMMARIZE_CONTEXT)
+        speculative: Whether to start context retrieval before the intent is known (default: SPECULATIVE_RETRIEVAL)
+        use_cache: Whether to look up and store the response in the semantic response cache (default: RESPONSE_CACHE_ENABLED)
+        deadline: Latency budget for the request; its degradations list records the steps taken (default: a new Deadline of PIPELINE_DEADLINE_SECONDS)
+        validate: Whether to judge Learning Mode responses once streamed (default: STREAM_VALIDATE)
+
+    Yields:
+        StreamChunk: Text deltas, followed by one final chunk with done=True
+    """
+    yield from iterate_sync(
+        run_pipeline_stream_async(
+            query, chat_history, summarize, speculative, use_cache, validate, deadline
+        )
+    )
 
 
 if __name__ == "__main__":
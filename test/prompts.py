@@ -0,0 +1,591 @@
+from typing import Optional
+from config import HISTORY_TOKEN_BUDGETS
+from history import render_history
+from metrics import get_counter, hit_rate, increment
+
+
+# Every stage sends its static instructions and few-shot examples as a byte-identical system
+# message first, followed by the per-request values. Keeping the variable parts last lets
+# provider-side prompt caching reuse the prefix across requests.
+
+INTENT_SYSTEM_PROMPT = """You are an expert Intent & Topic Classifier for an educational chatbot. Your job is to analyze the user's query and the last 10 turns of chat history to determine the user's intent and the main topic of conversation.
+
+You must classify the intent into one of the following categories: **["Learning Mode", "Revision Mode", "Cheatsheet Mode", "Normal Mode", "Misc Mode"]**.
+
+  * **Learning Mode**: Use for foundational questions, requests for definitions, or "what is" / "how does" style questions where the user is learning a topic for the first time.
+  * **Revision Mode**: Use when the user asks complex or layered questions, multiple-choice questions (MCQs), or quizzes to test their knowledge.
+  * **Cheatsheet Mode**: Use when the user asks for a summary, a direct "cheatsheet", a list of important points, or key formulas.
+  * **Normal Mode**: Use for normal questions related to the topic, whose answers are however present in the chat history. This can be used for any question which simply asks for clarification on a topic or concept already discussed.
+  * **Misc Mode**: Use for greetings, goodbyes, thank yous, or any other conversational filler that does not require retrieving educational material.
+
+You must also extract the core **"Topic"** from the chat history.
+
+Analyze the following input and provide your output in a JSON format with two keys: "intent" and "topic".
+
+-----
+
+**Example 1:**
+
+**Chat History:**
+`User: "Hey, can you help me study for my CS exam?"`
+`Bot: "Of course! What topic are you focusing on today?"`
+`User: "Let's start with data structures. Can you tell me about linked lists?"`
+`Bot: "A linked list is a linear data structure..."`
+
+**User Query:**
+`"How do you traverse a singly linked list?"`
+
+**Output:**
+
+json
+{
+  "intent": "Learning Mode",
+  "topic": "Linked Lists"
+}
+
+
+-----
+
+**Example 2:**
+
+**Chat History:**
+`User: "Can you explain the concept of photosynthesis?"`
+`Bot: "Photosynthesis is the process used by plants, algae, and certain bacteria to harness energy from sunlight..."`
+
+
+**User Query:**
+`"Awesome, thanks so much!"`
+
+**Output:**
+
+json
+{
+  "intent": "Misc Mode",
+  "topic": "Photosynthesis"
+}
+
+
+-----
+"""
+
+CONTEXT_QUERIES_SYSTEM_PROMPT = """You are an expert Context Query Generator for an educational chatbot. Your job is to analyze the user's query, the last 10 turns of chat history and the topic of conversation to determine the 1 to 3 most relevant queries to retrieve context from the knowledge base.
+
+Each query should be a single topic or phrase that is relevant to the topic of conversation and whose answers or context is not present in the chat history.
+Do not take your own knowledge into account, only the chat history and the user's query.
+
+The generated queries should be unique and should not overlap with each other. The queries should be specific to the topic of conversation and should not be too broad. In maximum cases, only 1 query should be generated, unless the user's query is very broad.
+
+Your output should be a JSON with a single key "queries" which is a list of strings.
+
+**Example 1:**
+
+**Chat History:**
+`User: "Hey, can you help me study for my CS exam?"`
+`Bot: "Of course! What topic are you focusing on today?"`
+
+**User Query:**
+`"How do you traverse a singly linked list?"`
+
+**Topic:**
+`"Linked Lists"`
+
+**Output:**
+
+json
+{
+  "queries": ["Singly Linked List", "Linked List Traversal"]
+}
+
+
+-----
+"""
+
+CONTEXT_SUMMARY_SYSTEM_PROMPT = """You are an expert Context Summarizer for an educational chatbot. Your job is to analyze the user's query, the last 10 turns of chat history, and the topic of conversation to extract and summarize only the most relevant information from the context retrieved from the knowledge base.
+
+**Important Instructions:**
+- Do NOT summarize or repeat the user query or the chat history.
+- Use the user query and chat history only as background to understand what information is relevant to the current conversation.
+- Focus solely on the fetched context: extract the key facts, explanations, or data that directly address the user's needs, as inferred from the query and chat history.
+- Filter out any irrelevant, redundant, or generic information (noise) that is not useful for the current conversation.
+- Your summary should be concise, focused, and should not include any information already present in the chat history or user query.
+
+Your output should be a JSON with a single key "summary" which is a string, in the following format:
+
+json
+{
+    "summary": "<summary of the relevant information from the fetched context>"
+}
+"""
+
+RESPONSE_SYSTEM_PROMPT = """You are an expert educational chatbot response generator. Your task is to carefully read the user's query, the last 10 turns of chat history, the main topic, and any relevant context, and then generate a clear, helpful, and conversational response that directly addresses the user's query.
+
+Guidelines:
+- Your response should be accurate, friendly, engaging, descriptive, and relevant to the user's question.
+- Maintain a friendly and engaging tone, appropriate for an educational setting.
+- Try to be as descriptive as possible, and use the context to provide more information.
+- In the end, ask the user if they have any questions or need further clarification.
+- If the context contains useful information, incorporate it naturally into your answer.
+- Avoid repeating information already present in the chat history unless it is necessary for clarity.
+- Assume that you know nothing outside the provided context, topic, or chat history.
+- Only output a JSON object with a single key "response" whose value is your generated response as a string.
+
+Format your output exactly as follows:
+
+json
+{
+    "response": "<response to the user's query>"
+}
+"""
+
+VALIDATION_SYSTEM_PROMPT = """You are a meticulous and impartial judge. Your role is to evaluate a generated chatbot response based on the provided context.
+
+You must assess the response for accuracy, relevance to the user's query, and completeness based on the summarized context.
+
+Your output must be a JSON object with one of two structures:
+
+1. If the response is high-quality, clear, accurate, and fully utilizes the provided context:
+
+json
+{
+    "quality": "Optimal",
+    "reason": "None",
+    "resolution": "None"
+}
+
+
+2. If the response is inaccurate, incomplete, irrelevant, or could be significantly improved:
+
+json
+{
+    "quality": "Suboptimal",
+    "reason": "Provide a brief explanation of what is wrong with the response.",
+    "resolution": "Provide a specific suggestion on how to fix the response and make it better."
+}
+
+
+---
+"""
+
+RANKING_SYSTEM_PROMPT = """You are a meticulous and impartial judge. Your role is to compare several candidate chatbot responses to the same user query based on the provided context, and pick the best one.
+
+You must assess every candidate for accuracy, relevance to the user's query, and completeness based on the summarized context. Then decide whether the best candidate is good enough to be sent to the user as it is.
+
+Your output must be a JSON object with one of two structures, where "best" is the number of the best candidate:
+
+1. If the best candidate is high-quality, clear, accurate, and fully utilizes the provided context:
+
+json
+{
+    "best": 2,
+    "quality": "Optimal",
+    "reason": "None",
+    "resolution": "None"
+}
+
+
+2. If even the best candidate is inaccurate, incomplete, irrelevant, or could be significantly improved:
+
+json
+{
+    "best": 1,
+    "quality": "Suboptimal",
+    "reason": "Provide a brief explanation of what is wrong with the best candidate.",
+    "resolution": "Provide a specific suggestion on how to fix the best candidate and make it better."
+}
+
+
+---
+"""
+
+DIRECT_RESPONSE_SYSTEM_PROMPT = """You are a helpful educational chatbot. Your task is to converse with the user in a friendly and engaging manner, and respond to the user's latest query in an engaging and conversational manner.
+
+Your output should be a JSON object with a single key "response" whose value is your generated response as a string.
+
+Format your output exactly as follows:
+
+json
+{
+    "response": "<response to the user's query>"
+}
+"""
+
+HISTORY_SUMMARY_SYSTEM_PROMPT = """You are a conversation summarizer for an educational chatbot. You maintain a rolling summary of the older part of a conversation between a user and the chatbot.
+
+You will be given the current summary (or "None" if there is none yet) and the messages that have to be folded into it. Produce an updated summary that:
+- Keeps the topics discussed, the key facts and explanations the chatbot gave, and what the user is studying or struggling with.
+- Drops greetings, filler and repetition.
+- Is at most a short paragraph.
+
+Your output should be a JSON with a single key "summary" which is a string, in the following format:
+
+json
+{
+    "summary": "<updated summary of the conversation>"
+}
+"""
+
+PROMPT_STAGES = (
+    "intent",
+    "context_queries",
+    "context_summary",
+    "response",
+    "validation",
+    "direct_response",
+    "history_summary",
+    "intent_batch",
+    "context_queries_batch",
+    "ranking",
+)
+
+
+def render_context(context: list[str]) -> str:
+    """Render context chunks one per paragraph ("None" when there is no context)."""
+    chunks = [chunk.strip() for chunk in context if chunk.strip()]
+    return "\n\n".join(chunks) if chunks else "None"
+
+
+def intent_messages(query: str, chat_history: list[dict]) -> list[dict]:
+    """Build the intent classification messages."""
+    return [
+        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Your Task:**
+
+**Analyze the following input:**
+
+**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["intent"])}
+
+**User Query:**
+{query}
+
+**Output:**
+""",
+        },
+    ]
+
+
+def context_queries_messages(query: str, chat_history: list[dict], topic: str) -> list[dict]:
+    """Build the context query generation messages."""
+    return [
+        {"role": "system", "content": CONTEXT_QUERIES_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["context_queries"])}
+
+**User Query:**
+{query}
+
+**Topic:**
+{topic}
+
+**Output:**
+""",
+        },
+    ]
+
+
+def context_summary_messages(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context_query: str,
+    context: list[tuple[str, dict]],
+) -> list[dict]:
+    """Build the context summarization messages."""
+    return [
+        {"role": "system", "content": CONTEXT_SUMMARY_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**User Query:**
+{query}
+
+**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["context_summary"])}
+
+**Topic:**
+{topic}
+
+**Context Query:**
+{context_query}
+
+**Fetched Context to be summarized:**
+{context}
+
+**Output:**
+""",
+        },
+    ]
+
+
+def response_messages(
+    query: str,
+    chat_history: list[dict],
+    topic: str,
+    context: list[str],
+    reason: Optional[str] = None,
+    resolution: Optional[str] = None,
+    past_response: Optional[str] = None,
+) -> list[dict]:
+    """Build the response generation messages, with a refinement section when all refinement inputs are given."""
+    refinement_section = ""
+    if reason and resolution and past_response:
+        refinement_section = f"""**IMPORTANT - This is a response refinement attempt:**
+The previous response was deemed suboptimal for the following reason: {reason}
+
+**Previous Response:**
+{past_response}
+
+**How to improve:**
+{resolution}
+
+Please generate a new response that addresses these issues and follows the improvement suggestions.
+
+"""
+
+    return [
+        {"role": "system", "content": RESPONSE_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""{refinement_section}**User Query:**
+{query}
+
+**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["response"])}
+
+**Topic:**
+{topic}
+
+**Context:**
+{render_context(context)}
+
+**Output:**""",
+        },
+    ]
+
+
+def validation_messages(
+    response: str, query: str, chat_history: list[dict], topic: str, context: list[str]
+) -> list[dict]:
+    """Build the response validation messages."""
+    return [
+        {"role": "system", "content": VALIDATION_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Evaluation Materials:**
+
+**User Query:**
+{query}
+
+**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["validation"])}
+
+**Topic:**
+{topic}
+
+**Summarized Context that was used to generate the response:**
+{render_context(context)}
+
+**Generated Response to be judged:**
+{response}
+
+---
+
+**Your Judgement:**
+""",
+        },
+    ]
+
+
+def ranking_messages(
+    candidates: list[str], query: str, chat_history: list[dict], topic: str, context: list[str]
+) -> list[dict]:
+    """Build the messages asking the judge to pick the best of several candidate responses."""
+    rendered_candidates = "\n\n".join(
+        f"**Candidate {number}:**\n{candidate}" for number, candidate in enumerate(candidates, 1)
+    )
+    return [
+        {"role": "system", "content": RANKING_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Evaluation Materials:**
+
+**User Query:**
+{query}
+
+**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["ranking"])}
+
+**Topic:**
+{topic}
+
+**Summarized Context that was used to generate the responses:**
+{render_context(context)}
+
+**Candidate Responses to be compared:**
+{rendered_candidates}
+
+---
+
+**Your Judgement:**
+""",
+        },
+    ]
+
+
+def direct_response_messages(query: str, chat_history: list[dict]) -> list[dict]:
+    """Build the direct (no retrieval) response messages."""
+    return [
+        {"role": "system", "content": DIRECT_RESPONSE_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**User Query:**
+{query}
+
+**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["direct_response"])}
+
+**Output:**
+""",
+        },
+    ]
+
+
+def history_summary_messages(previous_summary: Optional[str], messages: list[dict]) -> list[dict]:
+    """Build the messages that fold older chat history messages into the rolling summary."""
+    return [
+        {"role": "system", "content": HISTORY_SUMMARY_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Current Summary:**
+{previous_summary or "None"}
+
+**Messages to fold into the summary:**
+{render_history(messages)}
+
+**Output:**
+""",
+        },
+    ]
+
+
+def _packed_items(items: list[str]) -> str:
+    return "\n".join(f"### Item {i}\n\n{item}" for i, item in enumerate(items, 1))
+
+
+def packed_intent_messages(items: list[tuple[str, list[dict]]]) -> list[dict]:
+    """
+    Build one intent classification prompt covering several (query, chat history) items.
+
+    The system message is the single-item one, so the cached prefix is shared with
+    intent_messages; the expected output is {"results": [{"id", "intent", "topic"}, ...]}.
+    """
+    rendered = [
+        f"""**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["intent"])}
+
+**User Query:**
+{query}
+"""
+        for query, chat_history in items
+    ]
+    return [
+        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Your Task:**
+
+Classify each of the following {len(items)} items independently, exactly as you would classify a single input.
+
+{_packed_items(rendered)}
+**Output:**
+Respond with a JSON object with one key, "results": a list with one object per item, in item order, each with the keys "id" (the item number), "intent" and "topic".
+""",
+        },
+    ]
+
+
+def packed_context_queries_messages(items: list[tuple[str, list[dict], str]]) -> list[dict]:
+    """
+    Build one context query generation prompt covering several (query, chat history, topic) items.
+
+    The expected output is {"results": [{"id", "queries"}, ...]}.
+    """
+    rendered = [
+        f"""**Chat History:**
+{render_history(chat_history, HISTORY_TOKEN_BUDGETS["context_queries"])}
+
+**User Query:**
+{query}
+
+**Topic:**
+{topic}
+"""
+        for query, chat_history, topic in items
+    ]
+    return [
+        {"role": "system", "content": CONTEXT_QUERIES_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"""**Your Task:**
+
+Generate the context queries for each of the following {len(items)} items independently, exactly as you would for a single input.
+
+{_packed_items(rendered)}
+**Output:**
+Respond with a JSON object with one key, "results": a list with one object per item, in item order, each with the keys "id" (the item number) and "queries".
+""",
+        },
+    ]
+
+
+def record_prompt_usage(stage: str, response: dict) -> None:
+    """
+    Record prompt and cached-prefix token counts from a provider response.
+
+    Understands OpenAI-style usage (prompt_tokens, prompt_tokens_details.cached_tokens)
+    and Anthropic-style usage (input_tokens, cache_read_input_tokens,
+    cache_creation_input_tokens). Responses without usage information are ignored.
+
+    Args:
+        stage: Pipeline stage that made the call, one of PROMPT_STAGES
+        response: Raw chat completion response
+    """
+    usage = response.get("usage") if isinstance(response, dict) else None
+    if not usage:
+        return
+
+    if "prompt_tokens" in usage:
+        prompt_tokens = usage["prompt_tokens"] or 0
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    elif "input_tokens" in usage:
+        cached_tokens = usage.get("cache_read_input_tokens") or 0
+        prompt_tokens = (
+            (usage["input_tokens"] or 0) + cached_tokens + (usage.get("cache_creation_input_tokens") or 0)
+        )
+    else:
+        return
+
+    increment(f"prompt_tokens_{stage}", prompt_tokens)
+    increment(f"prompt_cached_tokens_{stage}", cached_tokens)
+    increment(f"prompt_prefix_{stage}_hits" if cached_tokens else f"prompt_prefix_{stage}_misses")
+
+
+def prompt_cache_stats() -> dict[str, dict]:
+    """
+    Summarize provider prompt-prefix caching per stage.
+
+    Returns:
+        dict: For every stage, the share of calls that reused a cached prefix ("hit_rate")
+            and the share of prompt tokens served from the cache ("cached_token_ratio")
+    """
+    stats = {}
+    for stage in PROMPT_STAGES:
+        stage_stats = hit_rate(f"prompt_prefix_{stage}")
+        prompt_tokens = get_counter(f"prompt_tokens_{stage}")
+        cached_tokens = get_counter(f"prompt_cached_tokens_{stage}")
+        stage_stats["cached_token_ratio"] = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        stats[stage] = stage_stats
+    return stats
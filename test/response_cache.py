@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import hashlib
+import json
+import threading
+import time
+from nlp import content_words, cosine_similarity, embed_text, normalize_text
+
+
+class _CacheEntry:
+    __slots__ = ("scope", "words", "vector", "topic", "response", "metadata", "created_at", "size")
+
+    def __init__(self, scope, words, vector, topic, response, metadata, size):
+        self.scope = scope
+        self.words = words
+        self.vector = vector
+        self.topic = topic
+        self.response = response
+        self.metadata = metadata
+        self.created_at = time.time()
+        self.size = size
+
+
+def _topic_key(topic: Optional[str]) -> str:
+    return topic.strip().lower() if topic else ""
+
+
+def _word_overlap(a: frozenset[str], b: frozenset[str]) -> float:
+    """Jaccard overlap of two word sets (1.0 when both are empty)."""
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class ResponseCache:
+    """
+    Semantic cache of final pipeline responses.
+
+    Entries are scoped by a fingerprint of the most recent chat history turns, so the
+    same question asked at the start of two different conversations can share an answer
+    while follow-ups in different contexts do not, and by the topic the query was
+    classified under. Within a scope, a query hits when its content words overlap a
+    stored query's by at least min_word_overlap (Jaccard) and the embedding of its
+    normalized text is at least similarity_threshold similar. With the default hashed
+    embedding, unrelated words can collide, so the word check defaults to requiring the
+    same content words. Entries expire after ttl_seconds and are evicted least recently
+    used first once max_entries or max_bytes is exceeded.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.9,
+        min_word_overlap: float = 1.0,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl_seconds: float = 3600,
+        history_turns: int = 2,
+        embed: Callable[[str], list[float]] = embed_text,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.min_word_overlap = min_word_overlap
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.history_turns = history_turns
+        self.embed = embed
+        self._entries: "OrderedDict[tuple[str, str, str], _CacheEntry]" = OrderedDict()
+        self._scopes: dict[str, set[tuple[str, str, str]]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def history_fingerprint(self, chat_history: list[dict]) -> str:
+        """Hash the role and normalized content of the last history_turns messages."""
+        recent = chat_history[-self.history_turns:] if self.history_turns > 0 else []
+        canonical = json.dumps(
+            [[message.get("role"), normalize_text(message.get("content", ""))] for message in recent]
+        )
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+    def lookup(
+        self, query: str, chat_history: list[dict], topic: Optional[str] = None
+    ) -> Optional[tuple[str, Optional[list[dict]]]]:
+        """
+        Find a cached response for a semantically equivalent query.
+
+        Args:
+            query: The current user query
+            chat_history: List of previous conversation messages in dict format
+            topic: Optional topic; when given, only entries stored under the same topic match.
+                Without one, matches stored under more than one topic are ambiguous and miss.
+
+        Returns:
+            Tuple of the cached response text and source metadata, or None on a miss
+        """
+        scope = self.history_fingerprint(chat_history)
+        normalized = normalize_text(query)
+        words = content_words(normalized)
+        vector = self.embed(normalized)
+        now = time.time()
+
+        with self._lock:
+            best_key, best_similarity = None, self.similarity_threshold
+            topics = set()
+            for key in list(self._scopes.get(scope, ())):
+                entry = self._entries[key]
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove(key)
+                    continue
+                if topic is not None and key[1] != _topic_key(topic):
+                    continue
+                if key[2] == normalized:
+                    similarity = 1.0
+                elif _word_overlap(words, entry.words) < self.min_word_overlap:
+                    continue
+                else:
+                    similarity = cosine_similarity(vector, entry.vector)
+                if similarity >= self.similarity_threshold:
+                    topics.add(key[1])
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+
+            if best_key is None or len(topics) > 1:
+                return None
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            return entry.response, entry.metadata
+
+    def store(
+        self,
+        query: str,
+        chat_history: list[dict],
+        topic: Optional[str],
+        response: str,
+        metadata: Optional[list[dict]],
+    ) -> None:
+        """
+        Cache a final response.
+
+        Args:
+            query: The user query the response answers
+            chat_history: Chat history the query was asked with
+            topic: Topic of conversation from intent classification
+            response: Final response text
+            metadata: Source metadata returned alongside the response
+        """
+        scope = self.history_fingerprint(chat_history)
+        normalized = normalize_text(query)
+        words = content_words(normalized)
+        vector = self.embed(normalized)
+        size = len(response) + len(json.dumps(metadata, default=str)) + 8 * len(vector)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            key = (scope, _topic_key(topic), normalized)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(scope, words, vector, topic, response, metadata, size)
+            self._scopes.setdefault(scope, set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Drop every cached response."""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: tuple[str, str, str]) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        keys = self._scopes.get(entry.scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[entry.scope]
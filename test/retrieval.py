@@ -0,0 +1,541 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Union
+import contextvars
+import json
+import threading
+import time
+from config import (
+    ANN_EMBEDDING,
+    ANN_INDEX_PATH,
+    ANN_NPROBE,
+    ANN_TOP_K,
+    CONTEXT_DEDUP_SIMILARITY,
+    KB_VERSION,
+    LEXICAL_INDEX_PATH,
+    LEXICAL_TOP_K,
+    RETRIEVAL_CACHE_ENABLED,
+    RETRIEVAL_CACHE_MAX_ENTRIES,
+    RETRIEVAL_CACHE_TTL,
+    RETRIEVAL_MODE,
+    RRF_K,
+    SEARCH_CONCURRENCY,
+)
+from metrics import increment
+from utils import log_warning
+from history import estimate_tokens
+from nlp import content_hash, normalize_text, simhash, simhash_similarity
+from tracing import current_span, span
+
+if ANN_INDEX_PATH:
+    # Embedded index shared through memory-mapped files; numpy is only needed in this mode
+    from ann_index import ANNIndex, load_embedding
+
+    ann_index: Optional["ANNIndex"] = ANNIndex(
+        ANN_INDEX_PATH,
+        embed=load_embedding(ANN_EMBEDDING) if ANN_EMBEDDING else None,
+        nprobe=ANN_NPROBE,
+        top_k=ANN_TOP_K,
+    )
+    semantic_search: Callable[[str], list[tuple[str, dict]]] = ann_index.search
+    semantic_search_batch: Optional[Callable[[list[str]], list[list[tuple[str, dict]]]]] = ann_index.search_batch
+else:
+    import rag
+
+    ann_index = None
+    semantic_search = rag.semantic_search
+    # Multi-query search of the knowledge base, when it provides one (embeds all queries in one batch)
+    semantic_search_batch = getattr(rag, "semantic_search_batch", None)
+
+
+class RetrievalCache:
+    """
+    TTL and size-bounded cache of semantic search results with single-flight lookups.
+
+    Results are keyed on the normalized query string. Concurrent lookups of the same
+    key while a search is running wait for that search instead of issuing their own.
+    Every entry belongs to a knowledge base version; changing the version (e.g. after
+    a re-index) flushes the cache, and results of searches that started under the old
+    version are not stored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: float = 600,
+        kb_version: str = "0",
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._kb_version = kb_version
+        self._entries: "OrderedDict[str, tuple[float, list[tuple[str, dict]]]]" = OrderedDict()
+        self._in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def kb_version(self) -> str:
+        return self._kb_version
+
+    def set_kb_version(self, version: str) -> None:
+        """Switch to a new knowledge base version, flushing all cached results if it changed."""
+        with self._lock:
+            if version != self._kb_version:
+                self._kb_version = version
+                self._entries.clear()
+
+    def get_or_search(
+        self, query: str, search: Callable[[str], list[tuple[str, dict]]]
+    ) -> list[tuple[str, dict]]:
+        """
+        Return cached results for query, running search on a miss.
+
+        Args:
+            query: The context query to search for
+            search: Function performing the actual search on a cache miss
+
+        Returns:
+            list[tuple[str, dict]]: Search results as (text, metadata) tuples
+        """
+        key = normalize_text(query)
+        with self._lock:
+            version = self._kb_version
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                increment("retrieval_cache_hits")
+                _annotate(cache="hit")
+                return list(entry[1])
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_leader:
+            increment("retrieval_cache_coalesced")
+            _annotate(cache="coalesced")
+            return list(future.result())
+
+        increment("retrieval_cache_misses")
+        _annotate(cache="miss")
+        try:
+            results = search(query)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if version == self._kb_version:
+                self._entries[key] = (time.time(), results)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(results)
+        return list(results)
+
+    def get_or_search_many(
+        self,
+        queries: list[str],
+        search_many: Callable[[list[str]], list[Union[list[tuple[str, dict]], BaseException]]],
+    ) -> list[Union[list[tuple[str, dict]], BaseException]]:
+        """
+        Return cached results for several queries, searching all misses in one call.
+
+        Like get_or_search, but the queries missing from the cache (and not already being
+        searched by another caller) are handed to search_many together.
+
+        Args:
+            queries: The context queries to search for
+            search_many: Function searching a list of queries, returning results (or the
+                exception of a failed query) per query in order
+
+        Returns:
+            list: Search results as (text, metadata) tuples, or the exception raised, per query
+        """
+        results: list = [None] * len(queries)
+        followers: list[tuple[int, Future]] = []
+        leaders: dict[str, list[int]] = {}
+        with self._lock:
+            version = self._kb_version
+            for i, query in enumerate(queries):
+                key = normalize_text(query)
+                entry = self._entries.get(key)
+                if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    increment("retrieval_cache_hits")
+                    results[i] = list(entry[1])
+                elif key in leaders:
+                    leaders[key].append(i)
+                elif key in self._in_flight:
+                    followers.append((i, self._in_flight[key]))
+                else:
+                    self._in_flight[key] = Future()
+                    leaders[key] = [i]
+
+        keys = list(leaders)
+        if keys:
+            increment("retrieval_cache_misses", len(keys))
+            try:
+                searched = list(search_many([queries[leaders[key][0]] for key in keys]))
+            except BaseException as e:
+                searched = [e] * len(keys)
+            if len(searched) < len(keys):
+                # Fail the queries left without a result, or their followers would wait forever
+                missing = ValueError(f"Search returned {len(searched)} results for {len(keys)} queries")
+                searched += [missing] * (len(keys) - len(searched))
+            with self._lock:
+                for key, result in zip(keys, searched):
+                    future = self._in_flight.pop(key)
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        if version == self._kb_version:
+                            self._entries[key] = (time.time(), result)
+                            self._entries.move_to_end(key)
+                        future.set_result(result)
+                    for i in leaders[key]:
+                        results[i] = result if isinstance(result, BaseException) else list(result)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        for i, future in followers:
+            increment("retrieval_cache_coalesced")
+            try:
+                results[i] = list(future.result())
+            except BaseException as e:
+                results[i] = e
+        return results
+
+    def clear(self) -> None:
+        """Drop every cached result."""
+        with self._lock:
+            self._entries.clear()
+
+
+def _annotate(**attributes) -> None:
+    """Add attributes to the current span, if the caller is being traced."""
+    current = current_span()
+    if current is not None:
+        current.set_attributes(**attributes)
+
+
+def _kb_version() -> str:
+    """Knowledge base version, including the document count of the ANN index when one is used."""
+    if ann_index is None:
+        return KB_VERSION
+    ann_index.refresh()
+    return f"{KB_VERSION}+{ann_index.count}"
+
+
+retrieval_cache = RetrievalCache(
+    max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+    ttl_seconds=RETRIEVAL_CACHE_TTL,
+    kb_version=_kb_version(),
+)
+
+
+def semantic_search_many(
+    queries: list[str], max_concurrency: int = SEARCH_CONCURRENCY
+) -> list[Union[list[tuple[str, dict]], BaseException]]:
+    """
+    Search the knowledge base for several queries at once.
+
+    Uses semantic_search_batch when the knowledge base provides it, which embeds all
+    queries in one batch and probes the index once with the query matrix. Otherwise, or
+    if the batch call fails, the queries are searched one by one on up to
+    max_concurrency threads.
+
+    Args:
+        queries: The context queries to search for
+        max_concurrency: Maximum number of single-query searches in flight (default: SEARCH_CONCURRENCY)
+
+    Returns:
+        list: Search results as (text, metadata) tuples, or the exception raised, per query
+    """
+    if semantic_search_batch is not None and len(queries) > 1:
+        try:
+            with span("semantic_search_batch", queries=len(queries)):
+                results = semantic_search_batch(queries)
+            if len(results) != len(queries):
+                raise ValueError(f"Batch search returned {len(results)} results for {len(queries)} queries")
+            increment("semantic_search_batches")
+            return [list(result) for result in results]
+        except Exception as e:
+            increment("semantic_search_batch_failures")
+            log_warning("Batched semantic search failed, searching queries one by one", str(e))
+
+    def search_one(query: str) -> Union[list[tuple[str, dict]], BaseException]:
+        try:
+            return semantic_search(query)
+        except Exception as e:
+            return e
+
+    if len(queries) <= 1:
+        return [search_one(query) for query in queries]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(queries)))) as executor:
+        # Run each search in a copy of the caller's context so that its spans nest correctly
+        futures = [executor.submit(contextvars.copy_context().run, search_one, query) for query in queries]
+        return [future.result() for future in futures]
+
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index():
+    """
+    Return the process-wide BM25 index, opening it on first use.
+
+    Returns:
+        BM25Index: The index at LEXICAL_INDEX_PATH
+    """
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                from lexical_index import BM25Index
+
+                _lexical_index = BM25Index(LEXICAL_INDEX_PATH, top_k=LEXICAL_TOP_K)
+    return _lexical_index
+
+
+def lexical_search_many(queries: list[str]) -> list[Union[list[tuple[str, dict]], BaseException]]:
+    """
+    Search the BM25 index for several queries, without any embedding call.
+
+    Args:
+        queries: The context queries to search for
+
+    Returns:
+        list: Search results as (text, metadata) tuples, or the exception raised, per query
+    """
+    with span("lexical_search", queries=len(queries)):
+        results: list = []
+        for query in queries:
+            try:
+                results.append(get_lexical_index().search(query))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def metadata_key(metadata: dict) -> str:
+    """Hashable key of a metadata dictionary, including ones holding lists or nested dictionaries."""
+    return json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _result_key(item: tuple[str, dict]) -> tuple[str, str]:
+    text, metadata = item
+    return text, metadata_key(metadata)
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[tuple[str, dict]]], k: int = RRF_K, top_k: int = LEXICAL_TOP_K
+) -> list[tuple[str, dict]]:
+    """
+    Fuse several rankings of the same knowledge base into one.
+
+    Every result scores 1 / (k + rank) in each ranking it appears in; results found by
+    several retrievers rise to the top without having to compare their raw scores.
+
+    Args:
+        rankings: Search results of each retriever, best first
+        k: Rank fusion constant (default: RRF_K)
+        top_k: Number of fused results returned (default: LEXICAL_TOP_K)
+
+    Returns:
+        list[tuple[str, dict]]: Fused (text, metadata) tuples, best first
+    """
+    scores: dict[tuple, float] = {}
+    items: dict[tuple, tuple[str, dict]] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            key = _result_key(item)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(key, item)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    return [items[key] for key in fused[:top_k]]
+
+
+def search_many(
+    queries: list[str], max_concurrency: int = SEARCH_CONCURRENCY, mode: str = RETRIEVAL_MODE
+) -> list[Union[list[tuple[str, dict]], BaseException]]:
+    """
+    Search the knowledge base for several queries with the configured retrieval mode.
+
+    In hybrid mode, a query whose lexical or semantic search failed uses the results of
+    the other one.
+
+    Args:
+        queries: The context queries to search for
+        max_concurrency: Maximum number of single-query semantic searches in flight
+        mode: "semantic", "lexical" or "hybrid" (default: RETRIEVAL_MODE)
+
+    Returns:
+        list: Search results as (text, metadata) tuples, or the exception raised, per query
+    """
+    if mode == "semantic":
+        return semantic_search_many(queries, max_concurrency)
+    if mode not in ("lexical", "hybrid"):
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected 'semantic', 'lexical' or 'hybrid'")
+    lexical = lexical_search_many(queries)
+    if mode == "lexical":
+        return lexical
+
+    semantic = semantic_search_many(queries, max_concurrency)
+    results: list = []
+    for lexical_result, semantic_result in zip(lexical, semantic):
+        if isinstance(lexical_result, BaseException) or isinstance(semantic_result, BaseException):
+            increment("hybrid_search_fallbacks")
+            results.append(semantic_result if isinstance(lexical_result, BaseException) else lexical_result)
+        else:
+            results.append(reciprocal_rank_fusion([lexical_result, semantic_result]))
+    return results
+
+
+def search(query: str, mode: str = RETRIEVAL_MODE) -> list[tuple[str, dict]]:
+    """
+    Search the knowledge base for one query with the configured retrieval mode.
+
+    Args:
+        query: The context query to search for
+        mode: "semantic", "lexical" or "hybrid" (default: RETRIEVAL_MODE)
+
+    Returns:
+        list[tuple[str, dict]]: Retrieved (text, metadata) tuples
+    """
+    result = search_many([query], mode=mode)[0]
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def merge_results(
+    per_query: list[Union[list[tuple[str, dict]], BaseException]],
+    near_duplicate_similarity: float = CONTEXT_DEDUP_SIMILARITY,
+) -> tuple[list[list[tuple[str, dict]]], list[dict]]:
+    """
+    Deduplicate the results of several queries, keeping query order.
+
+    A result is dropped when an earlier result (of any query) has the same metadata,
+    the same normalized text, or text whose simhash similarity is at least
+    near_duplicate_similarity, so a passage ingested twice under different metadata
+    reaches the prompts only once. The estimated tokens removed are counted in the
+    context_dedup_tokens_removed metric.
+
+    Args:
+        per_query: Search results (or the exception of a failed query) per query
+        near_duplicate_similarity: Simhash similarity from which texts count as duplicates
+            (default: CONTEXT_DEDUP_SIMILARITY; 1.0 disables near-duplicate detection)
+
+    Returns:
+        Tuple containing:
+            - Per query, the results that do not duplicate an earlier result
+            - List of unique metadata dictionaries, in order of first appearance
+    """
+    metadata: list[dict] = []
+    seen_metadata = set()
+    seen_content = set()
+    fingerprints: list[int] = []
+    removed: dict[str, int] = {}
+    removed_tokens = 0
+    new_items_per_query: list[list[tuple[str, dict]]] = []
+    for result in per_query:
+        new_items: list[tuple[str, dict]] = []
+        if not isinstance(result, BaseException):
+            for item in result:
+                text, item_metadata = item
+                duplicate = None
+                key = metadata_key(item_metadata)
+                digest = content_hash(text)
+                fingerprint = None
+                if key in seen_metadata:
+                    duplicate = "metadata"
+                elif digest in seen_content:
+                    duplicate = "exact"
+                elif near_duplicate_similarity < 1.0:
+                    fingerprint = simhash(text)
+                    if any(simhash_similarity(fingerprint, seen) >= near_duplicate_similarity for seen in fingerprints):
+                        duplicate = "near"
+
+                if duplicate is not None:
+                    removed[duplicate] = removed.get(duplicate, 0) + 1
+                    removed_tokens += estimate_tokens(text)
+                    continue
+                seen_metadata.add(key)
+                seen_content.add(digest)
+                if fingerprint is not None:
+                    fingerprints.append(fingerprint)
+                metadata.append(item_metadata)
+                new_items.append(item)
+        new_items_per_query.append(new_items)
+
+    for kind, count in removed.items():
+        increment(f"context_dedup_{kind}", count)
+    if removed_tokens:
+        increment("context_dedup_tokens_removed", removed_tokens)
+    return new_items_per_query, metadata
+
+
+def retrieve_many(
+    queries: list[str],
+    use_cache: bool = RETRIEVAL_CACHE_ENABLED,
+    max_concurrency: int = SEARCH_CONCURRENCY,
+) -> tuple[list[Union[list[tuple[str, dict]], BaseException]], list[list[tuple[str, dict]]], list[dict]]:
+    """
+    Search the knowledge base for several context queries with one multi-query search.
+
+    Cached queries are served from the retrieval cache; the rest go to search_many
+    together.
+
+    Args:
+        queries: The context queries to search for
+        use_cache: Whether to go through the retrieval cache (default: RETRIEVAL_CACHE_ENABLED)
+        max_concurrency: Maximum number of single-query searches in flight when batching is unavailable
+
+    Returns:
+        Tuple containing:
+            - Search results (or the exception of a failed query) per query
+            - Per query, the results left after deduplication across all queries (see merge_results)
+            - List of unique metadata dictionaries, in order of first appearance
+    """
+    with span("retrieve_many", queries=len(queries), mode=RETRIEVAL_MODE) as search_span:
+        search_batch = lambda batch: search_many(batch, max_concurrency)
+        if use_cache:
+            # Documents added to the ANN index invalidate the cached results
+            retrieval_cache.set_kb_version(_kb_version())
+            per_query = retrieval_cache.get_or_search_many(queries, search_batch)
+        else:
+            per_query = search_batch(queries)
+        new_items_per_query, metadata = merge_results(per_query)
+        merged = [item for items in new_items_per_query for item in items]
+        search_span.set_attributes(
+            failed=sum(1 for result in per_query if isinstance(result, BaseException)),
+            results=len(merged),
+            result_chars=sum(len(text) for text, _ in merged),
+        )
+        return per_query, new_items_per_query, metadata
+
+
+def retrieve(query: str, use_cache: bool = RETRIEVAL_CACHE_ENABLED) -> list[tuple[str, dict]]:
+    """
+    Search the knowledge base for a context query.
+
+    Args:
+        query: The context query to search for
+        use_cache: Whether to go through the retrieval cache (default: RETRIEVAL_CACHE_ENABLED)
+
+    Returns:
+        list[tuple[str, dict]]: Retrieved (text, metadata) tuples
+    """
+    with span("retrieve", cache="off", mode=RETRIEVAL_MODE) as search_span:
+        if use_cache:
+            retrieval_cache.set_kb_version(_kb_version())
+            results = retrieval_cache.get_or_search(query, search)
+        else:
+            results = search(query)
+        search_span.set_attributes(results=len(results), result_chars=sum(len(text) for text, _ in results))
+        return results
@@ -0,0 +1,348 @@
+from typing import Any, Callable, Optional
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from deadline import DeadlineExceeded, current_deadline
+from metrics import increment
+from tracing import current_span, span
+from utils import log_warning
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Errors raised while parsing or validating LLM output. The model may well produce valid
+# output on the next try, but a bad prompt will not fix itself, so these get few retries.
+PARSE_ERRORS = (ValueError, KeyError, TypeError)
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    """Return the HTTP status code carried by a provider SDK exception, if any."""
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """Return the server-requested delay in seconds from a Retry-After header or attribute, if any."""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    Process-wide cap on retries, as a token bucket shared by every caller.
+
+    Each first attempt deposits ratio tokens (up to max_tokens) and each retry spends
+    one, so retries are limited to roughly ratio of the call volume. When a provider is
+    struggling, workers stop retrying instead of multiplying the load.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def record_attempt(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one retry token; False when the budget is exhausted."""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint after repeated failures.
+
+    After failure_threshold consecutive retryable failures the circuit opens and calls
+    fail fast with CircuitOpenError. Once reset_timeout has passed one trial call is let
+    through (half-open); its success closes the circuit, its failure re-opens it. A trial
+    that ends in an error saying nothing about the endpoint's health (malformed output,
+    a 4xx response, a passed deadline) is released, so the next call becomes the trial.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[str]:
+        """
+        Admit a call, if the circuit lets it through.
+
+        Returns:
+            Optional[str]: "closed" for a normal call, "trial" for the half-open trial call
+                (to be ended with record_success, record_failure or release_trial), None
+                when the circuit is open
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.time() - self._opened_at >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return "trial"
+            return None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+
+    def release_trial(self) -> None:
+        """End the trial call without a verdict, leaving the circuit open."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class RetryPolicy:
+    """
+    Retry engine shared by every pipeline stage.
+
+    Errors are classified as fatal (circuit open, deadline exceeded, non-retryable 4xx responses), parse
+    errors (malformed LLM output, retried at most max_parse_retries times) or retryable
+    (everything else, e.g. timeouts, connection errors, 429 and 5xx responses). Retries
+    wait with exponential backoff and full jitter (plain exponential backoff with jitter
+    off, for reproducible timing), or for the server's Retry-After delay when it gives
+    one, and draw from a process-wide RetryBudget; a retry whose wait would outlast the
+    request's deadline is not attempted. Each endpoint has its own CircuitBreaker; when
+    it opens during a call's retries, the call stops and raises its last real error.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20,
+        max_parse_retries: int = 1,
+        max_retry_after: float = 60,
+        budget: Optional[RetryBudget] = None,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 30,
+        jitter: bool = True,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_parse_retries = max_parse_retries
+        self.max_retry_after = max_retry_after
+        self.budget = budget or RetryBudget()
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.jitter = jitter
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Return the circuit breaker for an endpoint, creating it on first use."""
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(
+                    self.breaker_failure_threshold, self.breaker_reset_timeout
+                )
+            return self._breakers[endpoint]
+
+    def classify(self, error: BaseException) -> str:
+        """Classify an error as "fatal", "parse" or "retryable"."""
+        if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+            return "fatal"
+        status = status_code_of(error)
+        if status is not None:
+            return "retryable" if status in RETRYABLE_STATUS_CODES or status >= 500 else "fatal"
+        if isinstance(error, PARSE_ERRORS):
+            return "parse"
+        return "retryable"
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Seconds to wait before retry number attempt (1-based)."""
+        retry_after = retry_after_of(error)
+        if retry_after is not None:
+            return retry_after
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def _next_delay(
+        self, attempt: int, parse_failures: int, error: BaseException, endpoint: str, trial: bool = False
+    ) -> Optional[float]:
+        """
+        Record the failure and return how long to wait before retrying, or None to give up.
+
+        A trial call's failures are not recorded here: the trial holds the breaker through
+        its retries and is ended by _end_trial once the call gives up.
+        """
+        kind = self.classify(error)
+        if kind == "retryable" and not trial:
+            self.breaker(endpoint).record_failure()
+        if kind == "fatal" or attempt >= self.max_attempts:
+            return None
+        if kind == "parse" and parse_failures > self.max_parse_retries:
+            return None
+
+        delay = self.backoff(attempt, error)
+        if delay > self.max_retry_after or delay >= current_deadline().remaining():
+            return None
+        if not self.budget.try_spend():
+            increment("retry_budget_exhausted")
+            return None
+
+        increment("retries")
+        if kind == "parse":
+            increment("retries_parse")
+        log_warning(f"Retrying {endpoint} call (attempt {attempt + 1}/{self.max_attempts})", f"{type(error).__name__}: {error}; waiting {delay:.2f}s")
+        return delay
+
+    def _record_success(self, endpoint: str, attempts: int) -> None:
+        self.breaker(endpoint).record_success()
+        # Attempt count on the caller's span (e.g. the pipeline stage that retried)
+        parent = current_span()
+        if parent is not None:
+            parent.set_attribute("attempts", attempts)
+
+    def _check_breaker(self, endpoint: str, last_error: Optional[BaseException] = None) -> bool:
+        """
+        Raise if the endpoint's circuit is open; True if this call is its trial.
+
+        A first attempt gets CircuitOpenError. A retry gets last_error, the failure of the
+        previous attempt, since that (possibly the very failure that opened the circuit)
+        is what the caller needs to see.
+        """
+        admitted = self.breaker(endpoint).allow()
+        if admitted is None and last_error is not None:
+            increment("retries_stopped_by_circuit")
+            raise last_error
+        if admitted is None:
+            increment("circuit_open_rejections")
+            raise CircuitOpenError(f"Circuit breaker open for endpoint '{endpoint}'")
+        return admitted == "trial"
+
+    def _end_trial(self, endpoint: str, error: BaseException) -> None:
+        """End a failed trial call: a retryable error re-opens the circuit, any other error releases the trial."""
+        if isinstance(error, Exception) and self.classify(error) == "retryable":
+            self.breaker(endpoint).record_failure()
+        else:
+            self.breaker(endpoint).release_trial()
+
+    def call(self, func: Callable, *args, endpoint: str = "default", **kwargs) -> Any:
+        """
+        Call func with retries, sleeping between attempts.
+
+        Args:
+            func: The function to execute
+            *args: Positional arguments to pass to the function
+            endpoint: Name of the endpoint func talks to, selecting its circuit breaker
+            **kwargs: Keyword arguments to pass to the function
+
+        Returns:
+            Any: The return value of the first successful attempt
+
+        Raises:
+            Exception: The last error once it is fatal, attempts or budget run out, or the circuit is open
+        """
+        self.budget.record_attempt()
+        parse_failures = 0
+        trial = False
+        last_error = None
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                # The half-open trial keeps its slot through its own retries
+                if not trial:
+                    trial = self._check_breaker(endpoint, last_error)
+                try:
+                    with span("attempt", endpoint=endpoint, attempt=attempt):
+                        result = func(*args, **kwargs)
+                except Exception as e:
+                    last_error = e
+                    parse_failures += self.classify(e) == "parse"
+                    delay = self._next_delay(attempt, parse_failures, e, endpoint, trial)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    continue
+                trial = False
+                self._record_success(endpoint, attempt)
+                return result
+        except BaseException as e:
+            # Whatever ends a trial call (error, cancellation, interrupted sleep) resolves it
+            if trial:
+                self._end_trial(endpoint, e)
+            raise
+
+    async def acall(self, func: Callable, *args, endpoint: str = "default", **kwargs) -> Any:
+        """
+        Await the coroutine function func with retries, using asyncio.sleep between attempts.
+
+        Args:
+            func: The coroutine function to execute
+            *args: Positional arguments to pass to the function
+            endpoint: Name of the endpoint func talks to, selecting its circuit breaker
+            **kwargs: Keyword arguments to pass to the function
+
+        Returns:
+            Any: The return value of the first successful attempt
+
+        Raises:
+            Exception: The last error once it is fatal, attempts or budget run out, or the circuit is open
+        """
+        self.budget.record_attempt()
+        parse_failures = 0
+        trial = False
+        last_error = None
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                # The half-open trial keeps its slot through its own retries
+                if not trial:
+                    trial = self._check_breaker(endpoint, last_error)
+                try:
+                    with span("attempt", endpoint=endpoint, attempt=attempt):
+                        result = await func(*args, **kwargs)
+                except Exception as e:
+                    last_error = e
+                    parse_failures += self.classify(e) == "parse"
+                    delay = self._next_delay(attempt, parse_failures, e, endpoint, trial)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                trial = False
+                self._record_success(endpoint, attempt)
+                return result
+        except BaseException as e:
+            # Whatever ends a trial call (error, cancellation, interrupted sleep) resolves it
+            if trial:
+                self._end_trial(endpoint, e)
+            raise
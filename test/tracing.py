@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+import json
+import os
+import threading
+import time
+from config import TRACE_EXPORT, TRACE_EXPORT_PATH, TRACE_SERVICE_NAME
+from metrics import observe
+from utils import log_error, log_timing
+
+
+class Span:
+    """
+    One timed operation (a pipeline stage, LLM call, retry attempt or search).
+
+    Spans started while another span is current become its children and share its
+    trace_id, so all spans of one pipeline request form a single trace.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes: dict[str, Any] = dict(attributes or {})
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time or time.time()) - self.start_time
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class JSONLSpanExporter:
+    """Append finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]) -> None:
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class OTLPJSONSpanExporter:
+    """
+    Append finished spans to a file in the OpenTelemetry OTLP/JSON encoding.
+
+    Each line is one ExportTraceServiceRequest holding one trace, the same layout the
+    OpenTelemetry Collector's file exporter writes and its otlpjsonfile receiver reads.
+    """
+
+    def __init__(self, path: str, service_name: str = TRACE_SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _value(value: Any) -> dict:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _span(self, span: Span) -> dict:
+        encoded = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.start_time * 1e9)),
+            "endTimeUnixNano": str(int((span.end_time or span.start_time) * 1e9)),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    def export(self, spans: list[Span]) -> None:
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "pipeline"}, "spans": [self._span(s) for s in spans]}],
+            }]
+        }
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(request) + "\n")
+
+
+class Tracer:
+    """
+    Creates spans, records their durations and exports them per request.
+
+    Every finished span's duration is recorded in the "span_duration_seconds" histogram
+    (labelled by span name). Finished spans are held until the root span of their trace
+    ends and then exported together, so a request's spans stay contiguous in the output;
+    a span that outlives its root (e.g. an abandoned call) is exported on its own.
+    """
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self._pending: dict[str, list[Span]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, label: str = None, **attributes) -> Iterator[Span]:
+        """
+        Run the enclosed block as a span, a child of the current span if there is one.
+
+        Args:
+            name: Span name, e.g. "intent" or "llm.chat"
+            label: If given, the duration is also printed with log_timing under this label
+            **attributes: Initial span attributes
+
+        Yields:
+            Span: The span, for adding attributes such as token counts or result sizes
+        """
+        parent = _current_span.get()
+        span = Span(name, parent, attributes)
+        if parent is None and self.exporter is not None:
+            with self._lock:
+                self._pending[span.trace_id] = []
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # An async generator finalized from another task runs in a different context
+                _current_span.set(parent)
+            self._finish(span, root=parent is None)
+            if label and span.error is None:
+                log_timing(label, span.duration)
+
+    def _finish(self, span: Span, root: bool) -> None:
+        span.end_time = time.time()
+        observe("span_duration_seconds", span.duration, {"span": span.name})
+        if self.exporter is None:
+            return
+        with self._lock:
+            if root:
+                batch = self._pending.pop(span.trace_id, []) + [span]
+            elif span.trace_id in self._pending:
+                self._pending[span.trace_id].append(span)
+                return
+            else:
+                batch = [span]
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            log_error("Span export failed", error=e)
+
+
+def create_exporter(kind: str = TRACE_EXPORT, path: str = TRACE_EXPORT_PATH):
+    """Build the span exporter named by TRACE_EXPORT ("jsonl", "otlp" or "" for none)."""
+    if kind == "jsonl":
+        return JSONLSpanExporter(path)
+    if kind == "otlp":
+        return OTLPJSONSpanExporter(path)
+    return None
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+tracer = Tracer(create_exporter())
+
+
+def span(name: str, label: str = None, **attributes):
+    """Start a span on the process-wide tracer (see Tracer.span)."""
+    return tracer.span(name, label, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    """Return the span the caller is running in, or None outside any span."""
+    return _current_span.get()
@@ -1,6 +1,18 @@
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, Optional, Type, TypeVar, Union
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from pydantic import BaseModel, ValidationError
 from pydantic_core import from_json
-import time
+import asyncio
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+import threading
+from config import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE
+from metrics import increment
 
 
 class Colors:
@@ -16,118 +28,499 @@ class Colors:
     END = '\033[0m'
 
 
+# Custom levels between the stdlib ones: success sits above INFO, step and timing lines at INFO and DEBUG
+SUCCESS = 25
+logging.addLevelName(SUCCESS, "SUCCESS")
+
+LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "SUCCESS": SUCCESS, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+
+logger = logging.getLogger("pipeline")
+logger.propagate = False
+
+
+class ColorFormatter(logging.Formatter):
+    """Reproduces the colored console output of the log helpers (development default)."""
+
+    STYLES = {
+        "info": (Colors.BLUE, "INFO: "),
+        "success": (Colors.GREEN, "SUCCESS: "),
+        "warning": (Colors.YELLOW, "WARNING: "),
+        "error": (Colors.RED, "ERROR: "),
+        "debug": (Colors.CYAN, "DEBUG: "),
+        "step": (Colors.MAGENTA, "STEP: "),
+        "timing": (Colors.CYAN, "TIMING: "),
+    }
+
+    def format(self, record: logging.LogRecord) -> str:
+        kind = record.kind
+        if kind == "pipeline_start":
+            rule = f"{Colors.BOLD}{Colors.WHITE}{'='*60}{Colors.END}"
+            return (
+                f"\n{rule}\n{Colors.BOLD}{Colors.WHITE}PIPELINE START{Colors.END}\n"
+                f"{Colors.WHITE}Query: {record.msg}{Colors.END}\n{rule}"
+            )
+        if kind == "pipeline_end":
+            rule = f"{Colors.BOLD}{Colors.WHITE}{'='*60}{Colors.END}"
+            return (
+                f"{rule}\n{Colors.GREEN}{Colors.BOLD}PIPELINE COMPLETED{Colors.END}\n"
+                f"{Colors.GREEN}{record.msg}{Colors.END}\n{rule}\n"
+            )
+
+        color, prefix = self.STYLES[kind]
+        emphasis = Colors.BOLD if kind == "step" else ""
+        lines = [f"{color}{emphasis}{prefix}{record.msg}{Colors.END}"]
+        if record.details:
+            lines.append(f"{color}   └─ {record.details}{Colors.END}")
+        if record.error is not None:
+            lines.append(f"{color}   └─ Exception: {str(record.error)}{Colors.END}")
+        return "\n".join(lines)
+
+
+class PlainFormatter(logging.Formatter):
+    """One uncolored line per message: timestamp, kind, message, details and error."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record)} {record.kind.upper()}: {record.msg}"
+        if record.details:
+            line += f" | {record.details}"
+        if record.error is not None:
+            line += f" | Exception: {record.error}"
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per message, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "kind": record.kind,
+            "message": str(record.msg),
+        }
+        if record.details:
+            entry["details"] = str(record.details)
+        if record.error is not None:
+            entry["error"] = f"{type(record.error).__name__}: {record.error}"
+        return json.dumps(entry)
+
+
+FORMATTERS = {"color": ColorFormatter, "plain": PlainFormatter, "json": JSONFormatter}
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them.
+
+    The stock QueueHandler formats each record on the calling thread; here formatting is
+    left to the listener so that callers only pay for building the record. When the
+    queue is full the record is dropped and counted rather than blocking the caller.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            increment("log_records_dropped")
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None, queue_size: int = LOG_QUEUE_SIZE) -> None:
+    """
+    (Re)configure the backend of the log helpers.
+
+    Records are put on a bounded queue and written by a background listener thread, so
+    logging never waits on stdout. Calls below the configured level return before any
+    message is formatted.
+
+    Args:
+        level: Minimum level to emit: DEBUG, INFO, SUCCESS, WARNING or ERROR (default: LOG_LEVEL)
+        fmt: Output format: "color" (ANSI, for development), "plain" or "json" (default: LOG_FORMAT)
+        stream: Stream to write to (default: sys.stdout)
+        queue_size: Maximum number of records waiting to be written (default: LOG_QUEUE_SIZE)
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(FORMATTERS.get(fmt.lower(), ColorFormatter)())
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    logger.addHandler(_NonBlockingQueueHandler(records))
+    logger.setLevel(LEVELS.get(level.upper(), logging.DEBUG))
+    _listener = QueueListener(records, output)
+    _listener.start()
+
+
+def flush_logs() -> None:
+    """Block until every queued record has been written (restarts the listener)."""
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+
+def is_enabled(level: int) -> bool:
+    """Whether messages at this level are currently emitted."""
+    return logger.isEnabledFor(level)
+
+
+def _emit(level: int, kind: str, message: Any, details: Any = None, error: Exception = None) -> None:
+    # Messages and details may be callables so that expensive ones are only built when emitted
+    if not logger.isEnabledFor(level):
+        return
+    if callable(message):
+        message = message()
+    if callable(details):
+        details = details()
+    logger.log(level, message, extra={"kind": kind, "details": details, "error": error})
+
+
 def log_info(message: str, details: str = None):
     """Log informational messages in blue color."""
-    print(f"{Colors.BLUE}INFO: {message}{Colors.END}")
-    if details:
-        print(f"{Colors.BLUE}   └─ {details}{Colors.END}")
+    _emit(logging.INFO, "info", message, details)
 
 
 def log_success(message: str, details: str = None):
     """Log success messages in green color."""
-    print(f"{Colors.GREEN}SUCCESS: {message}{Colors.END}")
-    if details:
-        print(f"{Colors.GREEN}   └─ {details}{Colors.END}")
+    _emit(SUCCESS, "success", message, details)
 
 
 def log_warning(message: str, details: str = None):
     """Log warning messages in yellow color."""
-    print(f"{Colors.YELLOW}WARNING: {message}{Colors.END}")
-    if details:
-        print(f"{Colors.YELLOW}   └─ {details}{Colors.END}")
+    _emit(logging.WARNING, "warning", message, details)
 
 
 def log_error(message: str, details: str = None, error: Exception = None):
     """Log error messages in red color."""
-    print(f"{Colors.RED}ERROR: {message}{Colors.END}")
-    if details:
-        print(f"{Colors.RED}   └─ {details}{Colors.END}")
-    if error:
-        print(f"{Colors.RED}   └─ Exception: {str(error)}{Colors.END}")
+    _emit(logging.ERROR, "error", message, details, error)
 
 
 def log_debug(message: str, details: str = None):
     """Log debug messages in cyan color."""
-    print(f"{Colors.CYAN}DEBUG: {message}{Colors.END}")
-    if details:
-        print(f"{Colors.CYAN}   └─ {details}{Colors.END}")
+    _emit(logging.DEBUG, "debug", message, details)
 
 
 def log_step(step_name: str, details: str = None):
     """Log pipeline step messages in magenta color."""
-    print(f"{Colors.MAGENTA}{Colors.BOLD}STEP: {step_name}{Colors.END}")
-    if details:
-        print(f"{Colors.MAGENTA}   └─ {details}{Colors.END}")
+    _emit(logging.INFO, "step", step_name, details)
 
 
 def log_timing(operation: str, duration: float):
     """Log timing information in cyan color."""
-    print(f"{Colors.CYAN}TIMING: {operation} completed in {duration:.2f}s{Colors.END}")
+    if is_enabled(logging.DEBUG):
+        _emit(logging.DEBUG, "timing", f"{operation} completed in {duration:.2f}s")
 
 
 def log_pipeline_start(query: str):
     """Log pipeline start with formatted query (truncated if too long)."""
-    truncated_query = query[:100] + "..." if len(query) > 100 else query
-    print(f"\n{Colors.BOLD}{Colors.WHITE}{'='*60}{Colors.END}")
-    print(f"{Colors.BOLD}{Colors.WHITE}PIPELINE START{Colors.END}")
-    print(f"{Colors.WHITE}Query: {truncated_query}{Colors.END}")
-    print(f"{Colors.BOLD}{Colors.WHITE}{'='*60}{Colors.END}")
+    if is_enabled(logging.INFO):
+        truncated_query = query[:100] + "..." if len(query) > 100 else query
+        _emit(logging.INFO, "pipeline_start", truncated_query)
 
 
 def log_pipeline_end(duration: float):
     """Log pipeline completion with total time."""
-    print(f"{Colors.BOLD}{Colors.WHITE}{'='*60}{Colors.END}")
-    print(f"{Colors.GREEN}{Colors.BOLD}PIPELINE COMPLETED{Colors.END}")
-    print(f"{Colors.GREEN}Total time: {duration:.2f}s{Colors.END}")
-    print(f"{Colors.BOLD}{Colors.WHITE}{'='*60}{Colors.END}\n")
+    if is_enabled(logging.INFO):
+        _emit(logging.INFO, "pipeline_end", f"Total time: {duration:.2f}s")
+
+
+configure_logging()
+atexit.register(lambda: _listener is not None and _listener.stop())
+
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# Characters that change the state of the JSON scanner outside and inside strings
+_JSON_STRUCTURE_RE = re.compile(r'[{}"]')
+_JSON_STRING_RE = re.compile(r'["\\]')
 
 
-def clean_response(response: Dict[str, Any]) -> Any:
+def extract_json(content: Union[str, bytes]) -> bytes:
     """
-    Extract and clean JSON content from LLM API response.
+    Find the first balanced JSON object in LLM output, in a single pass.
 
-    Processes the response from an LLM API call by extracting the content from the message,
-    removing JSON code block markers, and parsing it into a Python object using pydantic.
+    Text before and after the object (code fences, a "json" marker, explanations) is
+    skipped, and braces inside JSON strings are ignored. Output that ends before the
+    object is closed is returned up to its end, for partial parsing.
 
     Args:
-        response: Dictionary containing the full API response with nested structure
-                 Expected to have response["choices"][0]["message"]["content"] path
+        content: Raw message content
 
     Returns:
-        Any: Parsed Python object from the JSON content, allowing partial parsing for incomplete JSON
+        bytes: UTF-8 encoded JSON object
+
+    Raises:
+        ValueError: If the content contains no JSON object
     """
-    response = response["choices"][0]["message"]["content"]
-    response = response.replace("json", "").replace("", "")
-    return from_json(response, allow_partial=True)
+    text = content.decode("utf-8") if isinstance(content, bytes) else content
+    start = text.find("{")
+    if start < 0:
+        raise ValueError(f"No JSON object in LLM output: {text[:80]!r}")
+
+    depth = 0
+    pos = start
+    while True:
+        match = _JSON_STRUCTURE_RE.search(text, pos)
+        if match is None:
+            return text[start:].encode("utf-8")
+        char = match.group()
+        pos = match.end()
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:pos].encode("utf-8")
+        else:
+            # Skip to the closing quote of the string, stepping over escaped characters
+            while True:
+                match = _JSON_STRING_RE.search(text, pos)
+                if match is None:
+                    return text[start:].encode("utf-8")
+                pos = match.end()
+                if match.group() == '"':
+                    break
+                pos += 1
 
 
-def call_with_retry(
-    func, max_retries=3, delay=1, exceptions=(Exception,), *args, **kwargs
-) -> Any:
+def parse_json_content(content: Union[str, bytes]) -> Any:
     """
-    Execute a function with automatic retry logic on exceptions.
+    Parse the first JSON object in an LLM message content string.
 
-    Attempts to call the provided function up to max_retries times, with a delay
-    between attempts. If all retries are exhausted, raises the last encountered exception.
+    Args:
+        content: Raw message content, possibly wrapped in code fences or surrounded by text
+
+    Returns:
+        Any: Parsed Python object, allowing partial parsing for incomplete JSON
+    """
+    return from_json(extract_json(content), allow_partial=True)
+
+
+def parse_model(content: Union[str, bytes], model: Type[ModelT]) -> ModelT:
+    """
+    Validate the first JSON object in LLM output straight into a pydantic model.
+
+    The extracted bytes go through model_validate_json, without an intermediate dict.
+    Output cut off before the object is closed is parsed partially and validated if the
+    fields that made it are enough.
 
     Args:
-        func: The function to execute with retry logic
-        max_retries: Maximum number of retry attempts (default: 3)
-        delay: Time in seconds to wait between retry attempts (default: 1)
-        exceptions: Tuple of exception types to catch and retry on (default: (Exception,))
-        *args: Positional arguments to pass to the function
-        **kwargs: Keyword arguments to pass to the function
+        content: Raw message content
+        model: Pydantic model the object should match
 
     Returns:
-        Any: The return value of the successfully executed function
+        The validated model instance
 
     Raises:
-        Exception: The last exception encountered if all retry attempts fail
+        ValueError: If the content contains no JSON object or it does not match the model
+            (pydantic's ValidationError is a ValueError)
     """
-    for attempt in range(max_retries):
+    try:
+        payload = extract_json(content)
         try:
-            return func(*args, **kwargs)
-        except exceptions as e:
-            if attempt == max_retries - 1:
+            return model.model_validate_json(payload)
+        except ValidationError as e:
+            if not any(error["type"] == "json_invalid" for error in e.errors()):
                 raise
-            time.sleep(delay)
+            result = model.model_validate(from_json(payload, allow_partial=True))
+            increment("json_partial_parses")
+            return result
+    except ValueError:
+        increment("json_parse_failures")
+        raise
+
+
+def clean_response(response: Dict[str, Any], model: Optional[Type[ModelT]] = None) -> Any:
+    """
+    Extract and parse the JSON content of an LLM API response.
+
+    Args:
+        response: Dictionary containing the full API response with nested structure
+                 Expected to have response["choices"][0]["message"]["content"] path
+        model: Pydantic model to validate the JSON object into (see parse_model)
+
+    Returns:
+        Any: The model instance when a model is given, otherwise the parsed Python object
+            (partial parsing allowed for incomplete JSON)
+    """
+    content = response["choices"][0]["message"]["content"]
+    if model is not None:
+        return parse_model(content, model)
+    try:
+        return parse_json_content(content)
+    except ValueError:
+        increment("json_parse_failures")
+        raise
+
+
+class JSONStringFieldDecoder:
+    """
+    Incrementally decode one string field of a JSON object as it streams in.
+
+    Feed raw completion text chunk by chunk; each call returns the newly decoded part of
+    the field's value (escape sequences resolved), so it can be shown to the user before
+    the JSON envelope is complete. Everything outside the field is ignored.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.found = False
+        self.finished = False
+        self._buffer = ""
+        self._pos = 0
+        self._key = f'"{field}"'
+
+    def feed(self, chunk: str) -> str:
+        """
+        Consume the next chunk of raw completion text.
+
+        Args:
+            chunk: Next piece of the streamed completion
+
+        Returns:
+            str: Newly decoded characters of the field value ("" if none yet)
+        """
+        self._buffer += chunk
+        if self.finished:
+            return ""
+        if not self.found and not self._seek_value():
+            return ""
+        return self._decode()
+
+    def _seek_value(self) -> bool:
+        start = self._buffer.find(self._key, self._pos)
+        if start == -1:
+            # Keep enough of the tail to match a key split across chunks
+            self._pos = max(0, len(self._buffer) - len(self._key))
+            return False
+        i = start + len(self._key)
+        while i < len(self._buffer) and self._buffer[i].isspace():
+            i += 1
+        if i >= len(self._buffer):
+            self._pos = start
+            return False
+        if self._buffer[i] != ":":
+            self._pos = start + 1
+            return self._seek_value()
+        i += 1
+        while i < len(self._buffer) and self._buffer[i].isspace():
+            i += 1
+        if i >= len(self._buffer):
+            self._pos = start
+            return False
+        if self._buffer[i] != '"':
+            self._pos = start + 1
+            return self._seek_value()
+        self.found = True
+        self._pos = i + 1
+        return True
+
+    def _decode(self) -> str:
+        out = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.finished = True
+                i += 1
+                break
+            if char != "\\":
+                out.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i + 1] != "u":
+                out.append(json.loads(f'"{buffer[i:i + 2]}"'))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            escape = buffer[i:i + 6]
+            if 0xD800 <= int(escape[2:], 16) <= 0xDBFF:
+                # High surrogate: wait for the low half so the pair decodes to one character
+                if i + 12 > len(buffer):
+                    break
+                escape = buffer[i:i + 12]
+            out.append(json.loads(f'"{escape}"'))
+            i += len(escape)
+        self._pos = i
+        return "".join(out)
+
+
+def iterate_sync(agen: AsyncIterator) -> Iterator:
+    """
+    Iterate an async generator from synchronous code.
+
+    The generator runs on its own event loop in a background thread and hands items over
+    through a queue. Closing the returned iterator early stops the generator after the
+    item it is currently producing.
+
+    Args:
+        agen: The async generator to consume
+
+    Yields:
+        Any: Items produced by the async generator, in order
+
+    Raises:
+        Exception: Any exception raised by the async generator
+    """
+    items: "queue.Queue[tuple[str, Any]]" = queue.Queue()
+    stop = threading.Event()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(("item", item))
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            items.put(("error", e))
+        finally:
+            await agen.aclose()
+            items.put(("done", None))
+
+    worker = threading.Thread(target=asyncio.run, args=(pump(),), daemon=True)
+    worker.start()
+    try:
+        while True:
+            kind, value = items.get()
+            if kind == "done":
+                break
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+
+def run_sync(coro: Awaitable) -> Any:
+    """
+    Run a coroutine to completion from synchronous code.
+
+    Uses asyncio.run when no event loop is running in the current thread. When called
+    from inside a running loop (e.g. a notebook or an async web handler), the coroutine
+    is run on a fresh loop in a worker thread instead, since the current loop cannot be
+    re-entered.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        Any: The value returned by the coroutine
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()